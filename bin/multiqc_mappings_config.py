@@ -2,12 +2,34 @@
 
 import sys
 
-with open(sys.argv[1], "r") as fin, open(sys.argv[2], "w") as fout:
-    header = fin.readline().split(",")
+
+def mappings_config(header, rows):
+    """
+    Create a MultiQC config renaming samples with the given id mappings.
+
+    Args:
+        header (list): The fields of the header line of the mappings file, optionally quoted.
+        rows (iterable): The remaining lines of the mappings file.
+
+    Returns:
+        str: The MultiQC config.
+
+    """
     config = "sample_names_rename_buttons:\n"
-    config += "\n".join(["  - " + x.strip('"') for x in header])
+    config += "".join("  - " + field.strip().strip('"') + "\n" for field in header)
     config += "sample_names_rename:\n"
     rename = []
-    for line in fin:
+    for line in rows:
         rename.append(f"  - [{', '.join(line.strip().split(','))}]")
-    fout.write(config + "\n".join(sorted(rename)) + "\n")
+    return config + "\n".join(sorted(rename)) + "\n"
+
+
+def main(args=None):
+    args = sys.argv[1:] if args is None else args
+    with open(args[0]) as fin, open(args[1], "w") as fout:
+        header = fin.readline().split(",")
+        fout.write(mappings_config(header, fin))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+
+
+import argparse
+import csv
+import logging
+import sys
+from pathlib import Path
+
+logger = logging.getLogger()
+
+
+def parse_args(args=None):
+    Description = "Plan the download of the runs in files created by 'sra_runinfo_to_ftp.py' by grouping small runs into batches and assigning resource tiers."
+    Epilog = "Example usage: python sra_download_plan.py <FILES_IN> <FILE_OUT>"
+
+    parser = argparse.ArgumentParser(description=Description, epilog=Epilog)
+    parser.add_argument(
+        "files_in",
+        metavar="FILES_IN",
+        help="Comma-separated samplesheets with FTP download links created by 'sra_runinfo_to_ftp.py'; "
+        "runs in more than one of them are only planned once.",
+    )
+    parser.add_argument(
+        "file_out",
+        metavar="FILE_OUT",
+        type=Path,
+        help="Output file with the columns of the input files and the download plan of every run.",
+    )
+    parser.add_argument(
+        "-m",
+        "--download-method",
+        choices=("ftp", "aspera", "sratools"),
+        default="ftp",
+        help="The download method of the pipeline; only runs downloaded via FTP are grouped (default ftp).",
+    )
+    parser.add_argument(
+        "-p",
+        "--group-prefix",
+        default=None,
+        help="Prefix of the names of download groups, which must be unique across all planned files "
+        "(default the name of the first input file without suffixes).",
+    )
+    parser.add_argument(
+        "--small-run-size",
+        type=int,
+        default=100 * 1024**2,
+        help="Runs smaller than this size in bytes are grouped with other small runs (default 100 MiB).",
+    )
+    parser.add_argument(
+        "--max-group-size",
+        type=int,
+        default=2 * 1024**3,
+        help="The maximum total size in bytes of the runs of a group (default 2 GiB).",
+    )
+    parser.add_argument(
+        "--max-group-runs",
+        type=int,
+        default=100,
+        help="The maximum number of runs of a group (default 100).",
+    )
+    parser.add_argument(
+        "--tier-sizes",
+        default=f"{5 * 1024**3},{50 * 1024**3}",
+        help="Comma-separated minimum sizes in bytes of runs in the 'medium' and 'high' resource tiers; "
+        "smaller runs are in the 'low' tier (default 5 GiB and 50 GiB).",
+    )
+    parser.add_argument(
+        "--bytes-per-read",
+        type=int,
+        default=100,
+        help="The estimated size of a compressed read per FastQ file, used if 'fastq_bytes' is missing (default 100).",
+    )
+    parser.add_argument(
+        "-l",
+        "--log-level",
+        help="The desired log level (default WARNING).",
+        choices=("CRITICAL", "ERROR", "WARNING", "INFO", "DEBUG"),
+        default="WARNING",
+    )
+    return parser.parse_args(args)
+
+
+PLAN_COLUMNS = ["download_group", "download_group_size", "download_tier"]
+TIERS = ["low", "medium", "high"]
+
+
+def run_size(row, bytes_per_read):
+    """
+    Return the size of the FastQ files of the run in bytes.
+
+    The size is taken from `fastq_bytes` for the same files as in `fastq_1` and `fastq_2`
+    and otherwise estimated from `read_count`. Returns `None` if neither is known.
+
+    """
+    sizes = [size for size in (row.get("fastq_bytes") or "").split(";") if size]
+    if sizes and all(size.isdigit() for size in sizes):
+        return sum(int(size) for size in sizes[-2:])
+    read_count = row.get("read_count") or ""
+    if read_count.isdigit():
+        files = 1 if row.get("single_end") == "true" else 2
+        return int(read_count) * bytes_per_read * files
+    return None
+
+
+def download_method(row, method):
+    """Return how the run is downloaded, like the 'SRA' workflow decides it."""
+    route = "ftp"
+    if row.get("fastq_aspera") and method == "aspera":
+        route = "aspera"
+    if (not row.get("fastq_aspera") and not row.get("fastq_1")) or method == "sratools":
+        route = "sratools"
+    return route
+
+
+def run_tier(size, tier_sizes):
+    """Return the resource tier of a run of the given size, the lowest if it is unknown."""
+    tier = TIERS[0]
+    for name, minimum in zip(TIERS[1:], tier_sizes):
+        if size is not None and size >= minimum:
+            tier = name
+    return tier
+
+
+def pack_groups(sizes, max_group_size, max_group_runs):
+    """
+    Pack runs into as few groups as possible with first-fit decreasing bin packing.
+
+    Args:
+        sizes (dict): The size of every run by its index.
+
+    Returns:
+        list: The indices of the runs of every group.
+
+    """
+    groups = []
+    totals = []
+    for index in sorted(sizes, key=lambda index: (-sizes[index], index)):
+        for group, total in enumerate(totals):
+            if total + sizes[index] <= max_group_size and len(groups[group]) < max_group_runs:
+                groups[group].append(index)
+                totals[group] += sizes[index]
+                break
+        else:
+            groups.append([index])
+            totals.append(sizes[index])
+    return [sorted(group) for group in groups]
+
+
+def plan_downloads(rows, args):
+    """Add the download group, its number of runs and the resource tier to every row."""
+    tier_sizes = [int(size) for size in args.tier_sizes.split(",")]
+    sizes = [run_size(row, args.bytes_per_read) for row in rows]
+    small = {
+        index: size
+        for index, (row, size) in enumerate(zip(rows, sizes))
+        if size is not None and size < args.small_run_size and download_method(row, args.download_method) == "ftp"
+    }
+    for row, size in zip(rows, sizes):
+        row.update(download_group=row["id"], download_group_size=1, download_tier=run_tier(size, tier_sizes))
+    groups = [group for group in pack_groups(small, args.max_group_size, args.max_group_runs) if len(group) > 1]
+    for number, group in enumerate(groups, start=1):
+        for index in group:
+            rows[index].update(download_group=f"{args.group_prefix}_group{number}", download_group_size=len(group))
+    logger.info(f"Grouped {sum(map(len, groups))} of {len(rows)} runs into {len(groups)} download groups.")
+
+
+def read_runs(files_in):
+    """
+    Read the runs of all files, keeping only the first row of every run id.
+
+    Returns:
+        tuple: The combined columns of all files and the rows of the runs.
+
+    """
+    header = {}
+    rows = {}
+    for file_in in files_in:
+        with file_in.open(newline="") as fin:
+            reader = csv.DictReader(fin, delimiter="\t")
+            header.update(dict.fromkeys(col for col in reader.fieldnames if col not in PLAN_COLUMNS))
+            for row in reader:
+                if row["id"] in rows:
+                    logger.debug(f"Skipping duplicate run '{row['id']}' in {file_in}.")
+                    continue
+                rows[row["id"]] = row
+    return list(header) + PLAN_COLUMNS, list(rows.values())
+
+
+def main(args=None):
+    args = parse_args(args)
+    logging.basicConfig(level=args.log_level, format="[%(levelname)s] %(message)s")
+    files = [Path(x.strip()) for x in args.files_in.split(",")]
+    for path in files:
+        if not path.is_file():
+            logger.critical(f"The given input file {path} was not found!")
+            sys.exit(1)
+    if args.group_prefix is None:
+        args.group_prefix = files[0].name.split(".")[0]
+    header, rows = read_runs(files)
+    plan_downloads(rows, args)
+    args.file_out.parent.mkdir(parents=True, exist_ok=True)
+    with args.file_out.open("w", newline="") as fout:
+        writer = csv.DictWriter(fout, fieldnames=header, delimiter="\t", restval="")
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
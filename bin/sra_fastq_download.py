@@ -0,0 +1,699 @@
+#!/usr/bin/env python
+
+
+import argparse
+import fcntl
+import functools
+import hashlib
+import http.client
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+
+logger = logging.getLogger()
+
+
+def parse_args(args=None):
+    Description = "Download FastQ files concurrently, resume partial downloads and verify their md5 sums while streaming."
+    Epilog = "Example usage: python sra_fastq_download.py --download <URL> <MD5> <FILE_OUT> [<BYTES>] [--download ...]"
+
+    parser = argparse.ArgumentParser(description=Description, epilog=Epilog)
+    parser.add_argument(
+        "-d",
+        "--download",
+        nargs="+",
+        action="append",
+        required=True,
+        metavar="URL MD5 FILE_OUT [BYTES]",
+        help="Download the URL to the output file and check its md5 sum; may be given multiple times. "
+        "URLs without a scheme, like the 'fastq_ftp' links of ENA, are fetched via HTTP. The optional "
+        "size in bytes, e.g., from 'fastq_bytes', is used to plan segments.",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=None,
+        help="The maximum number of files downloaded concurrently (default all files).",
+    )
+    parser.add_argument(
+        "-s",
+        "--segments",
+        type=int,
+        default=1,
+        help="The maximum number of byte-range segments of a file that are downloaded concurrently (default 1).",
+    )
+    parser.add_argument(
+        "--min-segment-size",
+        type=int,
+        default=256 * 1024**2,
+        help="The minimum size of a segment in bytes; smaller files are split into fewer segments "
+        "(default 256 MiB).",
+    )
+    parser.add_argument(
+        "--store-dir",
+        type=Path,
+        default=None,
+        help="Directory of a content-addressed store of FastQ files keyed by md5 sum that is checked "
+        "before downloading and can be shared between runs (default no store).",
+    )
+    parser.add_argument(
+        "--store-max-size",
+        type=int,
+        default=1000,
+        help="The maximum size of the store in GB before the least recently used files are evicted (default 1000).",
+    )
+    parser.add_argument(
+        "--max-retries",
+        type=int,
+        default=5,
+        help="The maximum number of consecutive failed attempts per file before giving up (default 5).",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=60,
+        help="The timeout of connecting and of every read from the server in seconds (default 60).",
+    )
+    parser.add_argument(
+        "--backoff",
+        type=float,
+        default=5,
+        help="The delay before the first retry in seconds, doubled with every further retry (default 5).",
+    )
+    parser.add_argument(
+        "-l",
+        "--log-level",
+        help="The desired log level (default WARNING).",
+        choices=("CRITICAL", "ERROR", "WARNING", "INFO", "DEBUG"),
+        default="WARNING",
+    )
+    return parser.parse_args(args)
+
+
+CHUNK_SIZE = 1024 * 1024
+MAX_DELAY = 300.0
+# HTTP status codes of responses that are retried.
+RETRY_STATUS_CODES = frozenset({408, 429, 500, 502, 503, 504})
+
+
+class PartialFile:
+    """
+    Define a partially downloaded file whose md5 sum is computed while it is written.
+
+    Data are appended to a `.part` file next to the output file, which is only renamed
+    once the download is complete. An existing `.part` file is resumed and read once
+    to compute the md5 sum of its content.
+
+    Attributes:
+        path (pathlib.Path): The path of the partial file.
+        size (int): The number of bytes written so far.
+
+    """
+
+    def __init__(self, file_out, **kwargs):
+        """
+        Open the partial file of the given output file for appending.
+
+        Args:
+            file_out (pathlib.Path): The final path of the downloaded file.
+            **kwargs: Passed to parent constructor.
+
+        """
+        super().__init__(**kwargs)
+        self.path = file_out.with_name(f"{file_out.name}.part")
+        self._md5 = hashlib.md5()
+        self.size = 0
+        # The partial file of a segmented download has gaps and cannot be appended to.
+        state = file_out.with_name(f"{file_out.name}.part.json")
+        if state.is_file():
+            self.path.unlink(missing_ok=True)
+            state.unlink()
+        if self.path.is_file():
+            with self.path.open("rb") as fin:
+                while chunk := fin.read(CHUNK_SIZE):
+                    self._md5.update(chunk)
+                    self.size += len(chunk)
+            logger.info(f"Resuming the download of {file_out.name} after {self.size} bytes.")
+        self._fout = self.path.open("ab")
+
+    def write(self, chunk):
+        """Append the chunk to the file and the md5 sum."""
+        self._fout.write(chunk)
+        self._md5.update(chunk)
+        self.size += len(chunk)
+
+    def truncate(self):
+        """Discard all content, e.g., if the server does not support range requests."""
+        self._fout.truncate(0)
+        self._md5 = hashlib.md5()
+        self.size = 0
+
+    def hexdigest(self):
+        """Return the md5 sum of the content written so far."""
+        return self._md5.hexdigest()
+
+    def close(self):
+        """Flush and close the file."""
+        self._fout.close()
+
+
+def parse_content_range(value):
+    """Return the first byte and the total size of a `Content-Range` header, either may be `None`."""
+    match = re.fullmatch(r"bytes\s+(?:(\d+)-\d+|\*)/(\d+|\*)", (value or "").strip())
+    if match is None:
+        return None, None
+    start, total = match.groups()
+    return (int(start) if start else None), (int(total) if total != "*" else None)
+
+
+def fetch_remaining(url, part, timeout):
+    """
+    Request the bytes of the URL not yet in the partial file and append them.
+
+    Raises:
+        ConnectionError: If the server closed the connection before sending all bytes.
+
+    """
+    headers = {"User-Agent": "nf-core/fetchngs"}
+    if part.size:
+        headers["Range"] = f"bytes={part.size}-"
+    try:
+        response = urlopen(Request(url, headers=headers), timeout=timeout)
+    except HTTPError as error:
+        if error.code != 416 or not part.size:
+            raise
+        # The requested range starts at or past the end of the file.
+        _, total = parse_content_range(error.headers.get("Content-Range"))
+        error.close()
+        if total == part.size:
+            return
+        logger.warning(f"The partial file {part.path.name} is larger than {url}. Restarting the download.")
+        part.truncate()
+        response = urlopen(Request(url, headers={"User-Agent": "nf-core/fetchngs"}), timeout=timeout)
+    with response:
+        if part.size:
+            start, _ = parse_content_range(response.getheader("Content-Range"))
+            if response.status != 206 or start != part.size:
+                logger.warning(f"The server does not support resuming {url}. Restarting the download.")
+                part.truncate()
+        length = response.getheader("Content-Length")
+        expected = part.size + int(length) if length else None
+        while chunk := response.read(CHUNK_SIZE):
+            part.write(chunk)
+    # A connection closed early ends the body without an error.
+    if expected is not None and part.size < expected:
+        raise ConnectionError(f"The connection was closed after {part.size} of {expected} bytes.")
+
+
+class SegmentedFile:
+    """
+    Define a preallocated file whose byte-range segments are written concurrently.
+
+    Segments are written into place at their offset. The md5 sum is computed in file
+    order while writing: data at the end of the hashed prefix are hashed directly,
+    data of later segments are read back once the prefix reaches them. The progress
+    of every segment is saved next to the `.part` file so that an interrupted
+    download resumes where each segment stopped.
+
+    Attributes:
+        path (pathlib.Path): The path of the partial file.
+        size (int): The total size of the file in bytes.
+        segments (list): The start, end and number of bytes written of every segment.
+
+    """
+
+    def __init__(self, file_out, size, count, **kwargs):
+        """
+        Open or create the partial file of the given output file.
+
+        Args:
+            file_out (pathlib.Path): The final path of the downloaded file.
+            size (int): The total size of the file in bytes.
+            count (int): The number of segments.
+            **kwargs: Passed to parent constructor.
+
+        """
+        super().__init__(**kwargs)
+        self.path = file_out.with_name(f"{file_out.name}.part")
+        self._state = file_out.with_name(f"{file_out.name}.part.json")
+        self.size = size
+        self.segments = self._load(count)
+        self._lock = threading.Lock()
+        self._md5 = hashlib.md5()
+        self._hashed = 0
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(self._fd).st_size != size:
+            os.ftruncate(self._fd, 0)
+            if hasattr(os, "posix_fallocate"):
+                os.posix_fallocate(self._fd, 0, size)
+            else:
+                os.ftruncate(self._fd, size)
+        if done := sum(segment[2] for segment in self.segments):
+            logger.info(f"Resuming the download of {file_out.name} after {done} bytes.")
+        with self._lock:
+            self._advance()
+
+    def _load(self, count):
+        """Return the segments of a previous attempt with the same size or plan new ones."""
+        if self.path.is_file() and self._state.is_file():
+            try:
+                state = json.loads(self._state.read_text())
+                if state["size"] == self.size:
+                    return state["segments"]
+            except (ValueError, KeyError):
+                pass
+        length = -(-self.size // count)
+        return [[start, min(start + length, self.size), 0] for start in range(0, self.size, length)]
+
+    def save(self):
+        """Save the progress of all segments."""
+        with self._lock:
+            self._state.write_text(json.dumps({"size": self.size, "segments": self.segments}))
+
+    def remaining(self, index):
+        """Return the first and last byte of the segment that were not yet written."""
+        start, end, done = self.segments[index]
+        return start + done, end - 1
+
+    def done(self, index):
+        """Return the number of bytes written to the segment."""
+        return self.segments[index][2]
+
+    def write(self, index, chunk):
+        """Write the chunk at the current end of the segment and update the md5 sum."""
+        offset, _ = self.remaining(index)
+        view = memoryview(chunk)
+        while view:
+            written = os.pwrite(self._fd, view, offset)
+            view = view[written:]
+            offset += written
+        with self._lock:
+            if offset - len(chunk) == self._hashed:
+                self._md5.update(chunk)
+                self._hashed += len(chunk)
+            self.segments[index][2] += len(chunk)
+            self._advance()
+
+    def _advance(self):
+        """Hash data after the hashed prefix that were already written to disk."""
+        for start, end, done in self.segments:
+            if not start <= self._hashed < end:
+                continue
+            while self._hashed < start + done:
+                data = os.pread(self._fd, min(CHUNK_SIZE, start + done - self._hashed), self._hashed)
+                self._md5.update(data)
+                self._hashed += len(data)
+            if self._hashed < end:
+                return
+
+    def hexdigest(self):
+        """Return the md5 sum of the file, which must be complete."""
+        assert self._hashed == self.size, f"Only {self._hashed} of {self.size} bytes of {self.path.name} are hashed."
+        return self._md5.hexdigest()
+
+    def discard(self):
+        """Close and remove the partial file and its progress."""
+        self.close()
+        self.path.unlink()
+        self._state.unlink(missing_ok=True)
+
+    def close(self):
+        """Close the file, keeping the progress of incomplete segments."""
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        if all(start + done == end for start, end, done in self.segments):
+            self._state.unlink(missing_ok=True)
+
+
+class SegmentationError(Exception):
+    """Raised if a file cannot be downloaded in byte-range segments."""
+
+
+def fetch_segment(url, part, index, timeout):
+    """
+    Request the bytes of the segment not yet in the partial file and write them.
+
+    Raises:
+        SegmentationError: If the server does not answer with the requested range.
+        ConnectionError: If the server closed the connection before sending all bytes.
+
+    """
+    first, last = part.remaining(index)
+    if first > last:
+        return
+    headers = {"User-Agent": "nf-core/fetchngs", "Range": f"bytes={first}-{last}"}
+    with urlopen(Request(url, headers=headers), timeout=timeout) as response:
+        start, total = parse_content_range(response.getheader("Content-Range"))
+        if response.status != 206 or start != first or total != part.size:
+            raise SegmentationError(
+                f"Expected bytes {first}-{last}/{part.size} of {url}, got status {response.status} "
+                f"with range {response.getheader('Content-Range')}."
+            )
+        while chunk := response.read(min(CHUNK_SIZE, last + 1 - part.remaining(index)[0])):
+            part.write(index, chunk)
+    if part.remaining(index)[0] <= last:
+        raise ConnectionError(f"The connection was closed after {part.done(index)} bytes of the segment.")
+
+
+def get_size(url, timeout):
+    """Return the size of the file at the URL if the server supports range requests, otherwise `None`."""
+    headers = {"User-Agent": "nf-core/fetchngs", "Range": "bytes=0-0"}
+    try:
+        with urlopen(Request(url, headers=headers), timeout=timeout) as response:
+            _, total = parse_content_range(response.getheader("Content-Range"))
+            return total if response.status == 206 else None
+    except (URLError, OSError, http.client.HTTPException) as error:
+        logger.info(f"Failed to determine the size of {url} ({error}).")
+        return None
+
+
+def with_retries(url, fetch, progress, max_retries=5, backoff=5):
+    """
+    Call `fetch` until it succeeds, retrying transient failures with a backoff.
+
+    Attempts after which `progress` returns more bytes than before do not count towards
+    the maximum number of retries, so only consecutive failures without progress give up.
+
+    Raises:
+        RuntimeError: If the maximum number of retries is exceeded or the error is permanent.
+
+    """
+    attempt = 0
+    while True:
+        size = progress()
+        try:
+            fetch()
+            return
+        except HTTPError as error:
+            if error.code not in RETRY_STATUS_CODES:
+                raise RuntimeError(f"Received {error.code} response from server for {url}.") from error
+            reason = f"Received {error.code} response from server"
+        except (URLError, OSError, http.client.HTTPException) as error:
+            # Timeouts, connection resets and the like.
+            reason = f"The download failed ({getattr(error, 'reason', error)})"
+        attempt = 1 if progress() > size else attempt + 1
+        if attempt > max_retries:
+            raise RuntimeError(f"{reason} for {url}. Exceeded max download attempts.")
+        delay = min(MAX_DELAY, backoff * 2 ** (attempt - 1))
+        delay = random.uniform(delay / 2, delay)
+        logger.warning(f"{reason} for {url} after {progress()} bytes. Retrying in {delay:.1f} seconds...")
+        time.sleep(delay)
+
+
+def download_segmented(url, file_out, size, count, max_retries=5, timeout=60, backoff=5):
+    """
+    Download the URL into a preallocated partial file in concurrent byte-range segments.
+
+    Returns:
+        SegmentedFile: The complete partial file.
+
+    Raises:
+        SegmentationError: If the server does not support the range requests.
+
+    """
+    part = SegmentedFile(file_out, size, count)
+    try:
+        with ThreadPoolExecutor(max_workers=len(part.segments)) as executor:
+            futures = [
+                executor.submit(
+                    with_retries,
+                    url,
+                    functools.partial(fetch_segment, url, part, index, timeout),
+                    functools.partial(part.done, index),
+                    max_retries,
+                    backoff,
+                )
+                for index in range(len(part.segments))
+            ]
+            for future in futures:
+                future.result()
+    except SegmentationError:
+        part.discard()
+        raise
+    finally:
+        if part.path.is_file():
+            part.save()
+            part.close()
+    return part
+
+
+class FastqStore:
+    """
+    Define a content-addressed store of downloaded files that is shared between runs.
+
+    Files are stored under their md5 sum and indexed in an SQLite database with their
+    size and last access time, so that lookups and the total size of the store do not
+    depend on the number of entries. Hits are hard-linked into place, or reflinked or
+    copied if the store is on another file system. The least recently used files are
+    evicted once the total size exceeds its limit.
+
+    """
+
+    _FILENAME = "index.sqlite"
+    # The Linux ioctl request to share the extents of a file on copy-on-write file systems.
+    _FICLONE = 0x40049409
+
+    def __init__(self, store_dir, max_size, **kwargs):
+        """
+        Open or create the store in the given directory.
+
+        Args:
+            store_dir (pathlib.Path): The directory containing the files and their index.
+            max_size (int): The maximum total size of all files in bytes.
+            **kwargs: Passed to parent constructor.
+
+        """
+        super().__init__(**kwargs)
+        store_dir.mkdir(parents=True, exist_ok=True)
+        self._dir = store_dir
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        # The connection is shared by the download threads and guarded by the lock.
+        self._connection = sqlite3.connect(store_dir / self._FILENAME, timeout=60, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS files (md5 TEXT PRIMARY KEY, size INTEGER, accessed REAL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS files_accessed ON files (accessed)")
+            # The total size is maintained with every change instead of summing all entries.
+            self._connection.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER)")
+            self._connection.execute("INSERT OR IGNORE INTO stats VALUES ('size', 0)")
+
+    def _path(self, md5):
+        """Return the path of the file with the given md5 sum, in a subdirectory per prefix."""
+        return self._dir / md5[:2] / md5
+
+    def fetch(self, md5, file_out):
+        """Link the stored file with the given md5 sum to the output file and return whether it was found."""
+        with self._lock, self._connection:
+            row = self._connection.execute("SELECT size FROM files WHERE md5 = ?", (md5,)).fetchone()
+            if row is None:
+                return False
+            self._connection.execute("UPDATE files SET accessed = ? WHERE md5 = ?", (time.time(), md5))
+        file_out.unlink(missing_ok=True)
+        try:
+            self.link(self._path(md5), file_out)
+        except FileNotFoundError:
+            # The file was evicted by another process or removed manually.
+            self._remove(md5)
+            return False
+        if file_out.stat().st_size != row[0]:
+            file_out.unlink()
+            self._remove(md5)
+            return False
+        return True
+
+    def add(self, md5, file_in):
+        """Store the file under its md5 sum and evict old files if necessary."""
+        path = self._path(md5)
+        with self._lock, self._connection:
+            if self._connection.execute("SELECT 1 FROM files WHERE md5 = ?", (md5,)).fetchone() is not None:
+                return
+        path.parent.mkdir(exist_ok=True)
+        # Link to a unique name first such that the stored file appears atomically.
+        tmp = path.with_name(f"{md5}.{os.getpid()}.{threading.get_ident()}.tmp")
+        self.link(file_in, tmp)
+        tmp.replace(path)
+        size = path.stat().st_size
+        with self._lock, self._connection:
+            if self._connection.execute("SELECT 1 FROM files WHERE md5 = ?", (md5,)).fetchone() is None:
+                self._connection.execute("INSERT INTO files VALUES (?, ?, ?)", (md5, size, time.time()))
+                self._connection.execute("UPDATE stats SET value = value + ? WHERE name = 'size'", (size,))
+            self._evict()
+
+    def _remove(self, md5):
+        """Remove the file with the given md5 sum from the index."""
+        with self._lock, self._connection:
+            self._delete(md5)
+
+    def _delete(self, md5):
+        """Delete the file and its index entry, which must be done while holding the lock."""
+        row = self._connection.execute("SELECT size FROM files WHERE md5 = ?", (md5,)).fetchone()
+        if row is not None:
+            self._connection.execute("DELETE FROM files WHERE md5 = ?", (md5,))
+            self._connection.execute("UPDATE stats SET value = value - ? WHERE name = 'size'", row)
+        self._path(md5).unlink(missing_ok=True)
+
+    def _evict(self):
+        """Delete the least recently used files until the store fits its maximum size."""
+        (total,) = self._connection.execute("SELECT value FROM stats WHERE name = 'size'").fetchone()
+        if total <= self._max_size:
+            return
+        for md5, size in self._connection.execute("SELECT md5, size FROM files ORDER BY accessed").fetchall():
+            self._delete(md5)
+            total -= size
+            if total <= self._max_size:
+                break
+
+    @classmethod
+    def link(cls, source, target):
+        """Hard-link the source to the target, or reflink or copy it across file systems."""
+        try:
+            os.link(source, target)
+            return
+        except FileNotFoundError:
+            raise
+        except OSError:
+            pass
+        with open(source, "rb") as fin, open(target, "wb") as fout:
+            try:
+                fcntl.ioctl(fout.fileno(), cls._FICLONE, fin.fileno())
+            except OSError:
+                shutil.copyfileobj(fin, fout, CHUNK_SIZE)
+
+
+def download_file(url, md5, file_out, size=None, segments=1, min_segment_size=0, store=None, **kwargs):
+    """
+    Download the URL to the output file and check its md5 sum.
+
+    Files found in the store are linked into place instead. Failed attempts are
+    resumed from the last byte received with an HTTP range request. Files of at least
+    twice the minimum segment size are split into up to `segments` byte ranges that
+    are downloaded concurrently, if the server supports it.
+
+    Args:
+        size (int): The expected size of the file, e.g., from `fastq_bytes`. It is
+            requested from the server if it is required but not given.
+        store (FastqStore): A store that is checked for the md5 sum before and
+            receives the file after downloading it.
+        **kwargs: The `max_retries`, `timeout` and `backoff` of the requests.
+
+    Raises:
+        RuntimeError: If the download failed or the md5 sum does not match.
+
+    """
+    if "://" not in url:
+        url = f"http://{url}"
+    if store is not None and store.fetch(md5.lower(), file_out):
+        write_md5(file_out, md5.lower())
+        logger.info(f"Linked {file_out.name} with md5 sum {md5} from the FastQ store.")
+        return
+    part = None
+    if segments > 1:
+        if size is None:
+            size = get_size(url, kwargs.get("timeout", 60))
+        count = min(segments, size // max(min_segment_size, 1)) if size else 1
+        if count > 1:
+            try:
+                part = download_segmented(url, file_out, size, count, **kwargs)
+            except SegmentationError as error:
+                logger.warning(f"{error} Downloading {file_out.name} in a single stream.")
+    if part is None:
+        part = PartialFile(file_out)
+        try:
+            with_retries(
+                url,
+                functools.partial(fetch_remaining, url, part, kwargs.get("timeout", 60)),
+                lambda: part.size,
+                kwargs.get("max_retries", 5),
+                kwargs.get("backoff", 5),
+            )
+        finally:
+            part.close()
+
+    if part.hexdigest() != md5.lower():
+        # The content is corrupt and must not be resumed.
+        part.path.unlink()
+        raise RuntimeError(f"The md5 sum {part.hexdigest()} of {file_out.name} does not match {md5}.")
+    part.path.replace(file_out)
+    write_md5(file_out, part.hexdigest())
+    logger.info(f"Downloaded {file_out.name} with md5 sum {part.hexdigest()}.")
+    if store is not None:
+        try:
+            store.add(md5.lower(), file_out)
+        except (OSError, sqlite3.Error) as error:
+            logger.warning(f"Failed to add {file_out.name} to the FastQ store ({error}).")
+
+
+def write_md5(file_out, md5):
+    """Write the md5 sum of the file next to it in the format of `md5sum`."""
+    file_out.with_name(f"{file_out.name}.md5").write_text(f"{md5}  {file_out.name}\n")
+
+
+def main(args=None):
+    args = parse_args(args)
+    logging.basicConfig(level=args.log_level, format="[%(levelname)s] %(message)s")
+    if args.max_retries < 0 or args.segments < 1 or (args.workers is not None and args.workers < 1):
+        logger.critical("The maximum number of retries must not be negative and of workers and segments at least 1!")
+        sys.exit(1)
+    downloads = []
+    for values in args.download:
+        if len(values) not in (3, 4) or (len(values) == 4 and not values[3].isdigit()):
+            logger.critical(f"Expected a URL, md5 sum, output file and optionally a size in bytes: {values}.")
+            sys.exit(1)
+        url, md5, file_out, *size = values
+        # A missing md5 sum shifts the values, e.g., of a run without checksums in its metadata.
+        if not re.fullmatch(r"[0-9a-fA-F]{32}", md5):
+            logger.critical(f"Expected an md5 sum of 32 hexadecimal digits for {file_out}, got '{md5}'.")
+            sys.exit(1)
+        downloads.append((url, md5, Path(file_out), int(size[0]) if size else None))
+    for _, _, file_out, _ in downloads:
+        file_out.parent.mkdir(parents=True, exist_ok=True)
+    store = None
+    if args.store_dir is not None:
+        store = FastqStore(args.store_dir, max_size=args.store_max_size * 1024**3)
+    # By default, all files, e.g., both mates of a paired-end run, are downloaded at the same time.
+    with ThreadPoolExecutor(max_workers=args.workers or len(downloads)) as executor:
+        futures = [
+            executor.submit(
+                download_file,
+                url,
+                md5,
+                file_out,
+                size=size,
+                segments=args.segments,
+                min_segment_size=args.min_segment_size,
+                store=store,
+                max_retries=args.max_retries,
+                timeout=args.timeout,
+                backoff=args.backoff,
+            )
+            for url, md5, file_out, size in downloads
+        ]
+        failed = False
+        for future in futures:
+            try:
+                future.result()
+            except RuntimeError as error:
+                logger.critical(str(error))
+                failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
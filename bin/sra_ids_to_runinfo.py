@@ -2,18 +2,33 @@
 
 
 import argparse
+import base64
 import cgi
+import codecs
 import csv
+import email.message
+import functools
 import gzip
+import hashlib
+import http.client
+import io
 import logging
 import os
+import random
 import re
+import sqlite3
 import sys
+import tempfile
+import threading
 import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from pathlib import Path
 from urllib.error import HTTPError, URLError
-from urllib.parse import urlencode
-from urllib.request import urlopen
+from urllib.parse import parse_qsl, unquote, urlencode, urljoin, urlsplit, urlunsplit
+from urllib.request import getproxies, proxy_bypass
 import json
 import time
 
@@ -51,6 +66,17 @@ DDBJ_IDS = (
 GEO_IDS = ("GSE18729", "GSM465244")
 ID_REGEX = re.compile(r"^([A-Z]+)([0-9]+)$")
 PREFIX_LIST = sorted({ID_REGEX.match(id).group(1) for id in SRA_IDS + ENA_IDS + DDBJ_IDS + GEO_IDS})
+EXPERIMENT_REGEX = re.compile(r"^[DES]RX[0-9]+$")
+
+# Base URLs of the web services queried by this script.
+ENA_PORTAL_API_URL = "https://www.ebi.ac.uk/ena/portal/api"
+NCBI_EUTILS_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils"
+
+# Fetched rows of an identifier are kept in memory up to this size in bytes and spilled to disk beyond.
+SPOOL_MAX_SIZE = 8 * 1024**2
+
+# Interval in seconds of logging the statistics of the pipeline stages at the INFO level.
+STATS_INTERVAL = 30
 
 
 # List of metadata fields fetched from the ENA API - can be overriden by options
@@ -91,6 +117,30 @@ ENA_METADATA_FIELDS = (
     "fastq_aspera",
 )
 
+# Snapshot of the valid read_run fields that is used to validate requested fields without a
+# network request. The full list is only fetched if other fields are requested. The snapshot
+# is the first column of the returnFields response and can be updated with:
+# curl -s 'https://www.ebi.ac.uk/ena/portal/api/returnFields?dataPortal=ena&format=tsv&result=read_run' \
+#     | cut -f 1 > bin/ena_return_fields.tsv
+ENA_RETURN_FIELDS_FILE = Path(__file__).resolve().parent / "ena_return_fields.tsv"
+
+
+def read_ena_return_fields(file_in=ENA_RETURN_FIELDS_FILE):
+    """Return the valid ENA metadata fields of the snapshot or none if it is missing."""
+    try:
+        with open(file_in, newline="") as fin:
+            return frozenset(row["columnId"] for row in csv.DictReader(fin, delimiter="\t"))
+    except FileNotFoundError:
+        logger.debug(f"The snapshot of valid ENA metadata fields {file_in} was not found.")
+        return frozenset()
+
+
+ENA_RETURN_FIELDS = read_ena_return_fields()
+
+
+class FetchError(Exception):
+    """Raised if the metadata of an identifier could not be resolved or fetched."""
+
 
 class Response:
     """
@@ -105,27 +155,75 @@ class Response:
 
     Methods:
         text: The response's body as a decoded string.
+        iter_lines: The response's body as decoded lines, decompressed incrementally.
+        close: Release the underlying connection.
 
     """
 
-    def __init__(self, *, response, **kwargs):
+    _CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, *, response, stream=False, on_close=None, **kwargs):
         """
         Initialize an HTTP response object.
 
         Args:
             response (http.client.HTTPResponse): A standard library response object
                 that is wrapped by this class.
+            stream (bool): Whether to read the body lazily instead of immediately.
+            on_close (callable): Called with a flag whether the connection may be
+                reused once the body has been read or the response is closed.
             **kwargs: Passed to parent classes.
 
         """
         super().__init__(**kwargs)
         self._response = response
-        # Immediately read the body while the response context is still available.
-        self._raw = self._response.read()
+        self._on_close = on_close
+        self._raw = None
         self._content = None
+        if not stream:
+            # Immediately read the body while the response context is still available.
+            try:
+                self._raw = self._response.read()
+            finally:
+                self.close()
+
+    def close(self):
+        """Release the connection, which may only be reused if the body was read completely."""
+        if self._on_close is not None:
+            on_close, self._on_close = self._on_close, None
+            on_close(self._response.isclosed() and not self._response.will_close)
+
+    def _iter_raw(self):
+        """Yield the raw body in chunks, reading it from the connection if necessary."""
+        if self._raw is not None:
+            yield self._raw
+            return
+        try:
+            while chunk := self._response.read(self._CHUNK_SIZE):
+                yield chunk
+        finally:
+            self.close()
+
+    def _iter_content(self):
+        """Yield the decompressed body in chunks."""
+        method = self._response.getheader("Content-Encoding", "")
+        if not method:
+            yield from self._iter_raw()
+            return
+        if method == "gzip":
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif method == "deflate":
+            decompressor = zlib.decompressobj()
+        else:
+            raise ValueError(f"Unsupported compression: {method}")
+        for chunk in self._iter_raw():
+            yield decompressor.decompress(chunk)
+        yield decompressor.flush()
 
     def _decompress(self):
         """Decompress the response body if necessary."""
+        if self._raw is None:
+            self._raw = b"".join(self._iter_raw())
         method = self._response.getheader("Content-Encoding", "")
         if not method:
             self._content = self._raw
@@ -142,6 +240,20 @@ class Response:
         """Get the response's HTTP status code."""
         return self._response.status
 
+    @property
+    def headers(self):
+        """Get the response's headers."""
+        return self._response.headers
+
+    @property
+    def will_close(self):
+        """Get whether the server closes the connection after this response."""
+        return self._response.will_close
+
+    def getheader(self, name, default=None):
+        """Return the value of the given response header."""
+        return self._response.getheader(name, default)
+
     @property
     def reason(self):
         """Get the response's reason phrase."""
@@ -154,12 +266,1025 @@ class Response:
             self._decompress()
         return self._content
 
+    def _encoding(self):
+        """Return the character encoding declared by the response or UTF-8."""
+        _, params = cgi.parse_header(self._response.getheader("Content-Type", ""))
+        return params.get("charset", "utf-8")
+
     def text(self, encoding=None):
         """Return the response's body as a decoded string."""
-        if encoding is None:
-            _, params = cgi.parse_header(self._response.getheader("Content-Type", ""))
-            encoding = params.get("charset", "utf-8")
-        return self.body.decode(encoding)
+        return self.body.decode(encoding or self._encoding())
+
+    def iter_lines(self, encoding=None):
+        """Yield the response's body line by line, including line endings, without buffering all of it."""
+        decoder = codecs.getincrementaldecoder(encoding or self._encoding())()
+        pending = ""
+        chunks = self._iter_content() if self._content is None else [self._content]
+        for chunk in chunks:
+            lines = (pending + decoder.decode(chunk)).split("\n")
+            pending = lines.pop()
+            for line in lines:
+                yield line + "\n"
+        pending += decoder.decode(b"", final=True)
+        if pending:
+            yield pending
+
+
+class ConnectionPool:
+    """
+    Define a thread-safe pool of persistent HTTP(S) connections.
+
+    Idle connections are kept alive and reused for later requests to the same host,
+    which avoids a DNS lookup and the TCP and TLS handshakes per request. The number of
+    connections open to each host at the same time is bounded by its pool size.
+    Like `urllib.request.urlopen`, requests are sent through the proxies of the
+    `http_proxy` and `https_proxy` environment variables unless `no_proxy` excludes
+    their host, HTTPS requests through a `CONNECT` tunnel.
+
+    Attributes:
+        max_size (int): The default maximum number of connections per host.
+        host_sizes (dict): Maximum number of connections for specific hosts.
+
+    """
+
+    _REDIRECT_CODES = frozenset({301, 302, 303, 307, 308})
+    _MAX_REDIRECTS = 5
+    # Errors indicating that the server closed an idle persistent connection.
+    _STALE_ERRORS = (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError)
+
+    def __init__(self, max_size=4, host_sizes=None, timeout=60, **kwargs):
+        """
+        Initialize an empty connection pool.
+
+        Args:
+            max_size (int): The default maximum number of connections per host.
+            host_sizes (dict): Maximum number of connections for specific hosts.
+            timeout (float): The timeout of blocking socket operations in seconds.
+            **kwargs: Passed to parent constructor.
+
+        """
+        super().__init__(**kwargs)
+        self.max_size = max_size
+        self.host_sizes = dict(host_sizes or {})
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._slots = {}
+        self._proxies = {}
+
+    def request(self, url, data=None, stream=False):
+        """
+        Send a GET request, or a POST request if data are given, and follow redirects.
+
+        Args:
+            url (str): The URL to request.
+            data (bytes): An URL-encoded form to send as the request body.
+            stream (bool): Whether to read the body lazily. The connection is only
+                released once the body was read completely or the response is closed.
+
+        Returns:
+            Response: The response of the final request.
+
+        Raises:
+            urllib.error.HTTPError: For responses with an error status code.
+            urllib.error.URLError: If the server could not be reached.
+
+        """
+        for _ in range(self._MAX_REDIRECTS + 1):
+            response = self._send(url, data, stream)
+            if response.status not in self._REDIRECT_CODES:
+                break
+            response.close()
+            url = urljoin(url, response.getheader("Location"))
+            if response.status == 303:
+                data = None
+        if response.status >= 400:
+            response.close()
+            raise HTTPError(url, response.status, response.reason, response.headers, None)
+        return response
+
+    def _send(self, url, data, stream):
+        """Send a single request on a pooled connection."""
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path + (f"?{parts.query}" if parts.query else "")
+        method = "GET" if data is None else "POST"
+        headers = {"Accept-Encoding": "gzip", "User-Agent": "nf-core/fetchngs"}
+        if data is not None:
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        slot = self._slot(key)
+        proxy, proxy_headers = self._proxies[key]
+        if proxy is not None and parts.scheme == "http":
+            # Plain HTTP proxies are sent the absolute URL instead of tunneling the request.
+            path = urlunsplit(parts._replace(fragment=""))
+            headers.update(proxy_headers)
+        slot.acquire()
+        connection, reused = self._acquire(key)
+        try:
+            try:
+                connection.request(method, path, body=data, headers=headers)
+                response = connection.getresponse()
+            except self._STALE_ERRORS:
+                if not reused:
+                    raise
+                connection.close()
+                connection = self._connect(key)
+                connection.request(method, path, body=data, headers=headers)
+                response = connection.getresponse()
+        except (OSError, http.client.HTTPException) as error:
+            self._release(key, slot, connection, False)
+            raise URLError(error) from error
+        try:
+            return Response(
+                response=response,
+                stream=stream,
+                on_close=functools.partial(self._release, key, slot, connection),
+            )
+        except (OSError, http.client.HTTPException) as error:
+            raise URLError(error) from error
+
+    def _release(self, key, slot, connection, reuse):
+        """Return the connection to the idle connections of its host or close it."""
+        if reuse:
+            with self._lock:
+                self._idle.setdefault(key, []).append(connection)
+        else:
+            connection.close()
+        slot.release()
+
+    def _slot(self, key):
+        """Return the semaphore bounding the number of connections to the given host."""
+        with self._lock:
+            if key not in self._slots:
+                host = urlsplit(f"//{key[1]}").hostname
+                self._slots[key] = threading.BoundedSemaphore(self.host_sizes.get(host, self.max_size))
+                self._proxies[key] = self._proxy(key)
+            return self._slots[key]
+
+    @staticmethod
+    def _proxy(key):
+        """Return the address of the proxy of the host, or `None`, and the headers authenticating with it."""
+        scheme, netloc = key
+        proxy = getproxies().get(scheme)
+        if not proxy or proxy_bypass(netloc):
+            return None, {}
+        parts = urlsplit(proxy if "://" in proxy else f"http://{proxy}")
+        headers = {}
+        if parts.username is not None:
+            credentials = f"{unquote(parts.username)}:{unquote(parts.password or '')}"
+            headers["Proxy-Authorization"] = f"Basic {base64.b64encode(credentials.encode()).decode('ascii')}"
+        return parts.netloc.rpartition("@")[2], headers
+
+    def _acquire(self, key):
+        """Return an idle connection to the host if possible or a new one."""
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+        return self._connect(key), False
+
+    def _connect(self, key):
+        """Create a new connection to the host or its proxy."""
+        scheme, netloc = key
+        proxy, proxy_headers = self._proxies[key]
+        if scheme == "https":
+            connection = http.client.HTTPSConnection(proxy or netloc, timeout=self._timeout)
+            if proxy is not None:
+                connection.set_tunnel(netloc, headers=proxy_headers)
+            return connection
+        return http.client.HTTPConnection(proxy or netloc, timeout=self._timeout)
+
+
+class RecordedResponse:
+    """
+    Define a stand-in for a standard library HTTP response that replays a recorded one.
+
+    It provides the subset of the `http.client.HTTPResponse` interface that is used by
+    the `Response` class.
+
+    """
+
+    def __init__(self, status, reason, headers, body, **kwargs):
+        """
+        Initialize the response.
+
+        Args:
+            status (int): The numeric HTTP status code.
+            reason (str): The reason phrase.
+            headers (dict): The response headers.
+            body (bytes): The response body.
+            **kwargs: Passed to parent constructor.
+
+        """
+        super().__init__(**kwargs)
+        self.status = status
+        self.reason = reason
+        self.headers = email.message.Message()
+        for name, value in headers.items():
+            self.headers[name] = value
+        self.will_close = False
+        self._body = io.BytesIO(body)
+
+    def read(self, amt=None):
+        """Read up to `amt` bytes of the body or all of the remaining body."""
+        return self._body.read(amt)
+
+    def isclosed(self):
+        """Return whether the body has been read completely."""
+        return self._body.tell() == len(self._body.getbuffer())
+
+    def getheader(self, name, default=None):
+        """Return the value of the given header."""
+        return self.headers.get(name, default)
+
+
+class HTTPRecorder:
+    """
+    Define a transport that records the responses of another transport to fixture files.
+
+    Every response is stored decompressed in a JSON file named after a hash of the request
+    method, URL and body, which is also how `HTTPReplayer` finds it again. The NCBI API key
+    is removed from requests before they are hashed or stored. Responses with an error
+    status code are recorded as well unless they are retried, since transient errors are
+    injected by the replayer instead.
+
+    """
+
+    def __init__(self, transport, directory, retry_status_codes=frozenset(), **kwargs):
+        """
+        Initialize the recorder.
+
+        Args:
+            transport (ConnectionPool): The transport whose responses are recorded.
+            directory (pathlib.Path): The directory of the fixture files.
+            retry_status_codes (frozenset): The HTTP status codes of responses that are
+                retried and therefore not recorded (default none).
+            **kwargs: Passed to parent constructor.
+
+        """
+        super().__init__(**kwargs)
+        self._transport = transport
+        self._directory = directory
+        self._retry_status_codes = frozenset(retry_status_codes)
+        self._directory.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def fixture_name(url, data=None):
+        """Return the file name of the fixture of a request without any secret parameters."""
+        url, data = HTTPRecorder.redact(url, data)
+        key = "\n".join(["GET" if data is None else "POST", url, (data or b"").decode("utf-8")])
+        return hashlib.sha256(key.encode("utf-8")).hexdigest() + ".json"
+
+    @staticmethod
+    def redact(url, data=None):
+        """Return the URL and the form data without the NCBI API key."""
+        parts = urlsplit(url)
+        query = urlencode([(key, value) for key, value in parse_qsl(parts.query) if key != "api_key"])
+        url = urlunsplit(parts._replace(query=query))
+        if data is not None:
+            data = urlencode([(key, value) for key, value in parse_qsl(data.decode("utf-8")) if key != "api_key"])
+            data = data.encode("utf-8")
+        return url, data
+
+    def request(self, url, data=None, stream=False):
+        """Send the request with the wrapped transport and record its response."""
+        try:
+            response = self._transport.request(url, data=data, stream=False)
+        except HTTPError as error:
+            if error.status not in self._retry_status_codes:
+                self._record(url, data, error.status, error.reason, error.headers, b"")
+            raise
+        self._record(url, data, response.status, response.reason, response.headers, response.body)
+        return self.replay(url, data, stream, self._directory)
+
+    def _record(self, url, data, status, reason, headers, body):
+        """Write the fixture file of a response."""
+        redacted_url, redacted_data = self.redact(url, data)
+        fixture = {
+            "url": redacted_url,
+            "data": None if redacted_data is None else redacted_data.decode("utf-8"),
+            "status": status,
+            "reason": reason,
+            "headers": {name: headers[name] for name in ("Content-Type", "Retry-After") if headers.get(name)},
+            "body": body.decode("utf-8"),
+        }
+        path = self._directory / self.fixture_name(url, data)
+        tmp = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        with tmp.open("w") as fout:
+            json.dump(fixture, fout, indent=1)
+        os.replace(tmp, path)
+
+    @staticmethod
+    def replay(url, data, stream, directory):
+        """Return the recorded response of the request or raise its recorded error."""
+        path = directory / HTTPRecorder.fixture_name(url, data)
+        if not path.is_file():
+            raise HTTPError(url, 404, f"No recorded response in {path}", email.message.Message(), None)
+        with path.open() as fin:
+            fixture = json.load(fin)
+        response = RecordedResponse(
+            fixture["status"], fixture["reason"], fixture["headers"], fixture["body"].encode("utf-8")
+        )
+        if response.status >= 400:
+            raise HTTPError(url, response.status, response.reason, response.headers, None)
+        return Response(response=response, stream=stream)
+
+
+class HTTPReplayer:
+    """
+    Define a transport that replays recorded responses without network access.
+
+    Network conditions can be simulated by delaying every response, by throttling
+    requests beyond a rate with 429 Too Many Requests responses and by failing a random
+    fraction of requests with 503 Service Unavailable responses.
+
+    """
+
+    def __init__(self, directory, latency=0.0, rate=None, error_rate=0.0, seed=None, **kwargs):
+        """
+        Initialize the replayer.
+
+        Args:
+            directory (pathlib.Path): The directory of the fixture files.
+            latency (float): The delay of every response in seconds.
+            rate (float): The number of requests per second beyond which requests are
+                throttled (default no throttling).
+            error_rate (float): The probability of a request to fail.
+            seed (int): The seed of the random errors.
+            **kwargs: Passed to parent constructor.
+
+        """
+        super().__init__(**kwargs)
+        self._directory = directory
+        self._latency = latency
+        self._rate = rate
+        self._error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tokens = rate
+        self._last = time.monotonic()
+
+    def request(self, url, data=None, stream=False):
+        """Return the recorded response of the request under the simulated network conditions."""
+        time.sleep(self._latency)
+        with self._lock:
+            throttled = not self._take_token()
+            failed = self._random.random() < self._error_rate
+        if throttled:
+            headers = email.message.Message()
+            headers["Retry-After"] = "1"
+            raise HTTPError(url, 429, "Too Many Requests", headers, None)
+        if failed:
+            raise HTTPError(url, 503, "Service Unavailable", email.message.Message(), None)
+        return HTTPRecorder.replay(url, data, stream, self._directory)
+
+    def _take_token(self):
+        """Take a token from the bucket refilled at the throttling rate and return whether one was left."""
+        if not self._rate:
+            return True
+        now = time.monotonic()
+        self._tokens = min(self._rate, self._tokens + (now - self._last) * self._rate)
+        self._last = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+
+class RetryPolicy:
+    """
+    Define when and after which delay failed requests are retried.
+
+    Delays grow exponentially with every attempt and are randomized between half and
+    the full backoff to spread out retries of concurrent requests. A `Retry-After`
+    header sent by the server takes precedence if it asks for a longer delay. Besides
+    the number of retries per request, the total number of retries of a run is limited.
+
+    Attributes:
+        max_retries (int): The maximum number of retries per request.
+        status_codes (frozenset): The HTTP status codes of responses that are retried.
+
+    """
+
+    def __init__(
+        self,
+        max_retries=5,
+        budget=100,
+        backoff=5.0,
+        max_delay=300.0,
+        status_codes=frozenset({429, 500, 502, 503, 504}),
+        **kwargs,
+    ):
+        """
+        Initialize the retry policy.
+
+        Args:
+            max_retries (int): The maximum number of retries per request.
+            budget (int): The maximum number of retries of all requests combined.
+            backoff (float): The delay before the first retry in seconds.
+            max_delay (float): The upper limit of any delay in seconds.
+            status_codes (frozenset): The HTTP status codes of responses that are retried.
+            **kwargs: Passed to parent constructor.
+
+        """
+        super().__init__(**kwargs)
+        self.max_retries = max_retries
+        self.status_codes = frozenset(status_codes)
+        self.budget = budget
+        self._backoff = backoff
+        self._max_delay = max_delay
+        self._lock = threading.Lock()
+
+    def consume(self):
+        """Take one retry from the budget of the run and return whether one was left."""
+        with self._lock:
+            if self.budget <= 0:
+                return False
+            self.budget -= 1
+            return True
+
+    def delay(self, attempt, retry_after=None):
+        """Return the number of seconds to wait before the given retry attempt, starting at 1."""
+        backoff = min(self._max_delay, self._backoff * 2 ** (attempt - 1))
+        delay = random.uniform(backoff / 2, backoff)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self._max_delay))
+        return delay
+
+    @staticmethod
+    def parse_retry_after(value):
+        """Return the delay in seconds requested by a `Retry-After` header or `None` if it is invalid."""
+        if not value:
+            return None
+        value = value.strip()
+        if value.isdigit():
+            return float(value)
+        try:
+            retry_date = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if retry_date.tzinfo is None:
+            retry_date = retry_date.replace(tzinfo=timezone.utc)
+        return max(0.0, (retry_date - datetime.now(timezone.utc)).total_seconds())
+
+
+class RateLimiter:
+    """
+    Define a thread-safe limiter for the global rate of outgoing requests.
+
+    Requests are spaced evenly such that no more than `rate` requests are sent per
+    second across all threads sharing the limiter.
+
+    Attributes:
+        rate (float): The maximum number of requests per second or `None` to disable
+            rate limiting.
+
+    """
+
+    def __init__(self, rate=None, **kwargs):
+        """
+        Initialize the rate limiter.
+
+        Args:
+            rate (float): The maximum number of requests per second (default no limit).
+            **kwargs: Passed to parent constructor.
+
+        """
+        super().__init__(**kwargs)
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._next_slot = time.monotonic()
+
+    def acquire(self):
+        """Block until the next request may be sent."""
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + 1.0 / self.rate
+        if delay > 0:
+            time.sleep(delay)
+
+
+class MetadataCache:
+    """
+    Define a persistent cache of resolved identifiers and fetched metadata.
+
+    Entries are keyed by the endpoint, the accession and the requested fields and are
+    stored compressed in an SQLite database. Entries older than the time-to-live are
+    ignored and the least recently used entries are evicted once the total size of the
+    cache exceeds its limit. The cache is disabled until it is opened.
+
+    """
+
+    _FILENAME = "sra_ids_to_runinfo.sqlite"
+
+    def __init__(self, **kwargs):
+        """
+        Initialize a disabled cache.
+
+        Args:
+            **kwargs: Passed to parent constructor.
+
+        """
+        super().__init__(**kwargs)
+        self._connection = None
+        self._lock = threading.Lock()
+        self._ttl = None
+        self._max_size = None
+
+    def open(self, cache_dir, ttl, max_size):
+        """
+        Open or create the cache in the given directory.
+
+        Args:
+            cache_dir (pathlib.Path): The directory containing the cache database.
+            ttl (float): The maximum age of a valid entry in seconds.
+            max_size (int): The maximum total size of all entries in bytes.
+
+        """
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        self._ttl = ttl
+        self._max_size = max_size
+        # The connection is shared by all worker threads and guarded by the lock.
+        self._connection = sqlite3.connect(cache_dir / self._FILENAME, timeout=60, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "endpoint TEXT, accession TEXT, fields TEXT, value BLOB, size INTEGER, "
+                "created REAL, accessed REAL, PRIMARY KEY (endpoint, accession, fields))"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)")
+
+    @property
+    def enabled(self):
+        """Get whether the cache has been opened."""
+        return self._connection is not None
+
+    def get(self, endpoint, accession, fields=""):
+        """Return the cached value for the given key or `None` if it is missing or expired."""
+        if self._connection is None:
+            return None
+        key = (endpoint, accession, fields)
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT value, created FROM cache WHERE endpoint = ? AND accession = ? AND fields = ?", key
+            ).fetchone()
+            if row is None or row[1] + self._ttl < time.time():
+                return None
+            self._connection.execute(
+                "UPDATE cache SET accessed = ? WHERE endpoint = ? AND accession = ? AND fields = ?",
+                (time.time(), *key),
+            )
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(self, endpoint, accession, value, fields=""):
+        """Store the JSON serializable value for the given key and evict old entries if necessary."""
+        if self._connection is None:
+            return
+        blob = zlib.compress(json.dumps(value).encode("utf-8"))
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (endpoint, accession, fields, blob, len(blob), now, now),
+            )
+            self._evict()
+
+    def _evict(self):
+        """Delete the least recently used entries until the cache fits its maximum size."""
+        (total,) = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()
+        if total <= self._max_size:
+            return
+        for rowid, size in self._connection.execute("SELECT rowid, size FROM cache ORDER BY accessed").fetchall():
+            self._connection.execute("DELETE FROM cache WHERE rowid = ?", (rowid,))
+            total -= size
+            if total <= self._max_size:
+                break
+
+
+class PreviousRuninfo:
+    """
+    Define the metadata of a previous run that are reused in incremental mode.
+
+    The rows of the previous output are kept by experiment accession and are reused
+    instead of fetching those experiments again. Only identifiers recorded in the state
+    file written by the previous run are mapped to their experiments without resolving
+    them, since a previous row only shows that an identifier matched some experiments,
+    not all of them. The experiments of the identifiers of the current run are recorded
+    for the next run.
+
+    """
+
+    def __init__(self, **kwargs):
+        """
+        Initialize without any previous metadata.
+
+        Args:
+            **kwargs: Passed to parent constructor.
+
+        """
+        super().__init__(**kwargs)
+        self._fieldnames = []
+        self._rows = {}
+        self._ids = {}
+        self._recorded = {}
+        self._lock = threading.Lock()
+
+    def open(self, fieldnames, runinfo=None, state=None):
+        """
+        Load the output and the state file of a previous run if they exist.
+
+        Args:
+            fieldnames (list): The metadata fields of the current run, which must include
+                the experiment accession.
+            runinfo (pathlib.Path): The output file of a previous run with the same fields.
+            state (pathlib.Path): The state file written by a previous run.
+
+        """
+        self._fieldnames = list(fieldnames)
+        if runinfo is not None and runinfo.is_file():
+            with runinfo.open(newline="") as fin:
+                reader = csv.reader(fin, delimiter="\t")
+                if next(reader, None) != self._fieldnames:
+                    logger.warning(f"Ignoring {runinfo} since its columns differ from the requested metadata fields.")
+                else:
+                    self._load_rows(reader)
+        if state is not None and state.is_file():
+            with state.open() as fin:
+                self._ids.update(json.load(fin)["ids"])
+        logger.info(f"Loaded {len(self._rows)} experiments and {len(self._ids)} identifiers of the previous run.")
+
+    def _load_rows(self, reader):
+        """Keep the previous rows by experiment."""
+        experiment_index = self._fieldnames.index("experiment_accession")
+        for row in reader:
+            self._rows.setdefault(row[experiment_index], []).append(tuple(row))
+
+    def experiments(self, db_id):
+        """Return the experiments of the identifier recorded in the state or `None` if it is unknown."""
+        return self._ids.get(db_id)
+
+    def rows(self, experiment):
+        """Return the previous metadata rows of the experiment or `None` if it is unknown."""
+        rows = self._rows.get(experiment)
+        if rows is None:
+            return None
+        return [dict(zip(self._fieldnames, row)) for row in rows]
+
+    def verify(self, ena_fetcher):
+        """
+        Forget previous experiments whose FastQ files changed upstream.
+
+        The run accessions, MD5 checksums and sizes of the FastQ files of the experiments
+        are fetched with batched search requests and compared to the previous rows.
+        Experiments that differ or are missing upstream are fetched again.
+
+        """
+        columns = [column for column in ("run_accession", "fastq_md5", "fastq_bytes") if column in self._fieldnames]
+        indices = [self._fieldnames.index(column) for column in columns]
+        experiments = list(self._rows)
+        current = ena_fetcher.search_experiments(experiments, fields=columns)
+        changed = [
+            acc
+            for acc in experiments
+            if sorted(tuple(row[column] for column in columns) for row in current.get(acc, []))
+            != sorted(tuple(row[index] for index in indices) for row in self._rows[acc])
+        ]
+        for acc in changed:
+            del self._rows[acc]
+        logger.info(f"Found {len(changed)} of {len(experiments)} previous experiments changed upstream.")
+
+    def record(self, db_id, experiments):
+        """Record the experiments of an identifier of the current run."""
+        with self._lock:
+            self._recorded[db_id] = list(experiments)
+
+    def save(self, state):
+        """Atomically write the recorded experiments of all identifiers to the state file."""
+        state.parent.mkdir(parents=True, exist_ok=True)
+        tmp = state.with_name(f"{state.name}.tmp")
+        with tmp.open("w") as fout:
+            json.dump({"ids": self._recorded}, fout)
+        os.replace(tmp, state)
+
+
+class CheckpointJournal:
+    """
+    Define an append-only journal of the identifiers processed by a run.
+
+    Every line is a JSON record of an identifier with either the experiments and metadata
+    rows fetched for it or the reason why it failed. Records are flushed as soon as an
+    identifier is done, such that a run resumed from the journal only processes the
+    identifiers that failed or were not reached. Failures are also written to a report
+    instead of ending the run. The journal is disabled until it is opened.
+
+    Attributes:
+        failed (int): The number of identifiers that failed in this run.
+
+    """
+
+    def __init__(self, **kwargs):
+        """
+        Initialize a disabled journal.
+
+        Args:
+            **kwargs: Passed to parent constructor.
+
+        """
+        super().__init__(**kwargs)
+        self.failed = 0
+        self._file = None
+        self._report = None
+        self._writer = None
+        self._offsets = {}
+        self._lock = threading.Lock()
+
+    def open(self, path, report, fieldnames, resume=False):
+        """
+        Open the journal, keeping the records of a previous attempt if it is resumed.
+
+        Args:
+            path (pathlib.Path): The journal file.
+            report (pathlib.Path): The report of the identifiers that failed.
+            fieldnames (list): The metadata fields of the run.
+            resume (bool): Whether to reuse the identifiers completed in the journal.
+
+        """
+        header = {"fields": list(fieldnames)}
+        end = 0
+        if resume and path.is_file():
+            with path.open("rb") as fin:
+                for line in fin:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # The last record of an interrupted run may be incomplete.
+                        break
+                    if end == 0 and record != header:
+                        logger.error(f"The journal {path} was written for other metadata fields and cannot be resumed!")
+                        sys.exit(1)
+                    if record.get("status") == "done":
+                        self._offsets[record["id"]] = end
+                    end += len(line)
+            logger.info(f"Resuming with {len(self._offsets)} identifiers completed by the previous attempt.")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = path.open("r+b" if end else "w+b")
+        self._file.truncate(end)
+        self._file.seek(end)
+        if not end:
+            self._append(header)
+        report.parent.mkdir(parents=True, exist_ok=True)
+        self._report = report.open("w", newline="")
+        self._writer = csv.writer(self._report)
+        self._writer.writerow(["id", "error"])
+
+    @property
+    def enabled(self):
+        """Get whether the journal has been opened."""
+        return self._file is not None
+
+    def completed(self, db_id):
+        """Return whether the identifier was completed by a previous attempt."""
+        return db_id in self._offsets
+
+    def load(self, db_id):
+        """Return the experiments and the metadata rows of an identifier completed by a previous attempt."""
+        with self._lock:
+            self._file.seek(self._offsets[db_id])
+            record = json.loads(self._file.readline())
+            self._file.seek(0, os.SEEK_END)
+        return record["experiments"], record["rows"]
+
+    def done(self, db_id, experiments, rows):
+        """Record the experiments and the metadata rows fetched for the identifier."""
+        self._append({"id": db_id, "status": "done", "experiments": list(experiments), "rows": list(rows)})
+
+    def fail(self, db_id, error):
+        """Record and report that the identifier failed."""
+        self._append({"id": db_id, "status": "failed", "error": str(error)})
+        with self._lock:
+            self.failed += 1
+            self._writer.writerow([db_id, str(error)])
+            self._report.flush()
+
+    def _append(self, record):
+        """Append the record and flush it to disk."""
+        line = (json.dumps(record) + "\n").encode("utf-8")
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        """Close the journal and the report."""
+        if self._file is not None:
+            self._file.close()
+            self._report.close()
+
+
+class AdaptiveRateLimiter(RateLimiter):
+    """
+    Define a rate limiter that adapts to throttling by the server.
+
+    The rate is halved when the server responds with 429 Too Many Requests, at most
+    once per second such that concurrent rejections count once, and increased again
+    in small steps with every successful request up to the maximum rate allowed for
+    the server.
+
+    """
+
+    def __init__(self, rate, min_rate=None, **kwargs):
+        """
+        Initialize the rate limiter at its maximum rate.
+
+        Args:
+            rate (float): The maximum number of requests per second.
+            min_rate (float): The lower limit when slowing down (default 1/16 of the rate).
+            **kwargs: Passed to parent constructor.
+
+        """
+        super().__init__(rate=rate, **kwargs)
+        self.max_rate = rate
+        self._min_rate = min_rate or rate / 16
+        self._step = rate / 100
+        self._last_throttle = float("-inf")
+
+    def throttle(self):
+        """Halve the rate after the server rejected a request as too many."""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_throttle < 1:
+                return
+            self._last_throttle = now
+            self.rate = max(self._min_rate, self.rate / 2)
+        logger.debug(f"Reduced request rate to {self.rate:.2f} requests per second.")
+
+    def recover(self):
+        """Increase the rate after a successful request."""
+        if self.rate < self.max_rate:
+            with self._lock:
+                self.rate = min(self.max_rate, self.rate + self._step)
+
+
+class HostRateLimiter:
+    """
+    Define adaptive rate limiters for individual upstream hosts.
+
+    Attributes:
+        rates (dict): The maximum number of requests per second by host name. Requests
+            to other hosts are not limited.
+
+    """
+
+    def __init__(self, rates=None, **kwargs):
+        """
+        Initialize the rate limiters.
+
+        Args:
+            rates (dict): The maximum number of requests per second by host name.
+            **kwargs: Passed to parent constructor.
+
+        """
+        super().__init__(**kwargs)
+        self.rates = dict(rates or {})
+        self._lock = threading.Lock()
+        self._limiters = {}
+
+    def get(self, url):
+        """Return the rate limiter for the host of the given URL or `None` if it is not limited."""
+        host = urlsplit(url).hostname
+        with self._lock:
+            if host not in self._limiters:
+                rate = self.rates.get(host)
+                self._limiters[host] = AdaptiveRateLimiter(rate) if rate else None
+            return self._limiters[host]
+
+
+class RequestCoalescer:
+    """
+    Define a thread-safe registry of in-flight requests.
+
+    A request that is identical to one still in flight waits for and shares its response
+    instead of being sent again.
+
+    Attributes:
+        saved (int): The number of requests that shared the response of another one.
+
+    """
+
+    def __init__(self, **kwargs):
+        """
+        Initialize without any requests in flight.
+
+        Args:
+            **kwargs: Passed to parent constructor.
+
+        """
+        super().__init__(**kwargs)
+        self.saved = 0
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    def request(self, key, send):
+        """Return the result of `send` or of the identical request in flight with the same key."""
+        with self._lock:
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self._in_flight[key] = Future()
+            else:
+                self.saved += 1
+        if owner:
+            try:
+                future.set_result(send())
+            except BaseException as error:
+                future.set_exception(error)
+            finally:
+                with self._lock:
+                    del self._in_flight[key]
+        return future.result()
+
+
+class AccessionRegistry:
+    """
+    Define a thread-safe registry of the accessions fetched for the identifiers of a run.
+
+    Every accession is only fetched for the first identifier in input order whose
+    resolution contains it, since the rows of later identifiers are only written once.
+    If an earlier identifier claims an accession that is still being fetched for a later
+    one, it waits for and shares those rows. Rows are kept until the identifier owning
+    them has been written, or for the rest of the run if that identifier failed, such
+    that later identifiers only skip the rows once they are known to have been written.
+
+    Attributes:
+        skipped (int): The number of accessions skipped for later identifiers.
+        shared (int): The number of accessions shared with later identifiers.
+
+    """
+
+    FETCH, SHARE, SKIP = "fetch", "share", "skip"
+
+    def __init__(self, **kwargs):
+        """
+        Initialize an empty registry.
+
+        Args:
+            **kwargs: Passed to parent constructor.
+
+        """
+        super().__init__(**kwargs)
+        self.skipped = 0
+        self.shared = 0
+        self._lock = threading.Lock()
+        self._owners = {}
+        self._rows = {}
+        self._owned = {}
+
+    def claim(self, accession, index):
+        """
+        Claim the accession for the identifier at the given index of the input.
+
+        Returns:
+            tuple: Whether to fetch, share or skip the accession and the future of its
+                rows, which must be resolved by the caller if it is to fetch them. The
+                future of a skipped accession is `None` once its owner has been written,
+                otherwise its rows must still be used in case the owner fails.
+
+        """
+        with self._lock:
+            owner = self._owners.get(accession)
+            if owner is not None and owner < index:
+                self.skipped += 1
+                return self.SKIP, self._rows.get(accession)
+            self._owners[accession] = index
+            self._owned.setdefault(index, []).append(accession)
+            if owner is not None:
+                self.shared += 1
+                return self.SHARE, self._rows[accession]
+            future = self._rows[accession] = Future()
+            return self.FETCH, future
+
+    def release(self, index, written=True):
+        """Forget the rows owned by the identifier at the given index unless it failed to be written."""
+        with self._lock:
+            for accession in self._owned.pop(index, []):
+                if written and self._owners[accession] == index:
+                    self._rows.pop(accession, None)
+
+
+# Shared by all worker threads, configured from the command line in `main`.
+connection_pool = ConnectionPool()
+# Sends the requests, the connection pool unless responses are recorded or replayed.
+transport = connection_pool
+retry_policy = RetryPolicy()
+rate_limiter = RateLimiter()
+# NCBI allows 3 requests per second without and 10 with an API key, ENA up to 50.
+host_rate_limiter = HostRateLimiter({urlsplit(NCBI_EUTILS_URL).hostname: 3, urlsplit(ENA_PORTAL_API_URL).hostname: 50})
+metadata_cache = MetadataCache()
+previous_runinfo = PreviousRuninfo()
+checkpoint_journal = CheckpointJournal()
+request_coalescer = RequestCoalescer()
 
 
 class DatabaseIdentifierChecker:
@@ -200,6 +1325,11 @@ class DatabaseResolver:
         "SAMD",
     }
     _ENA_PREFIXES = {"ERR", "SRR", "SAMN", "DRR"}
+    # Number of records requested per E-utilities page and of GEO samples per search term.
+    _EUTILS_PAGE_SIZE = 500
+    _EUTILS_TERM_SIZE = 200
+    # Sent with every E-utilities request if set, which raises the allowed request rate.
+    ncbi_api_key = None
 
     @classmethod
     def expand_identifier(cls, identifier):
@@ -216,69 +1346,89 @@ class DatabaseResolver:
         """
         prefix = ID_REGEX.match(identifier).group(1)
         if prefix in cls._GEO_GSM_PREFIXES:
-            return cls._gsm_to_srx(identifier)
+            resolve = cls._gsm_to_srx
         elif prefix in cls._GEO_GSE_PREFIXES:
-            return cls._gse_to_srx(identifier)
+            resolve = cls._gse_to_srx
         elif prefix in cls._SRA_PREFIXES:
-            return cls._id_to_srx(identifier)
+            resolve = cls._id_to_srx
         elif prefix in cls._ENA_PREFIXES:
-            return cls._id_to_erx(identifier)
+            resolve = cls._id_to_erx
         else:
             return [identifier]
+        ids = metadata_cache.get("expand_identifier", identifier)
+        if ids is None:
+            ids = resolve(identifier)
+            if ids:
+                metadata_cache.put("expand_identifier", identifier, ids)
+        return ids
 
     @classmethod
     def _content_check(cls, response, identifier):
-        """Check that the response has content or terminate."""
+        """Check that the response has content or close it and fail."""
         if response.status == 204:
-            logger.error(f"There is no content for id {identifier}. Maybe you lack the right " f"permissions?")
-            sys.exit(1)
+            # Release the pooled connection of a streamed response.
+            response.close()
+            raise FetchError(f"There is no content for id {identifier}. Maybe you lack the right permissions?")
 
     @classmethod
     def _id_to_srx(cls, identifier):
         """Resolve the identifier to SRA experiments."""
-        params = {"id": identifier, "db": "sra", "rettype": "runinfo", "retmode": "text"}
-        response = fetch_url(f"https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi?{urlencode(params)}")
+        params = cls._eutils_params({"id": identifier, "db": "sra", "rettype": "runinfo", "retmode": "text"})
+        response = fetch_url(f"{NCBI_EUTILS_URL}/efetch.fcgi?{urlencode(params)}")
         cls._content_check(response, identifier)
-        return [row["Experiment"] for row in open_table(response, delimiter=",")]
+        return list(dict.fromkeys(row["Experiment"] for row in open_table(response, delimiter=",")))
+
+    @classmethod
+    def _eutils_params(cls, params):
+        """Add the NCBI API key to the given E-utilities parameters if one was provided."""
+        return {**params, "api_key": cls.ncbi_api_key} if cls.ncbi_api_key else params
+
+    @classmethod
+    def _esearch(cls, db, term, identifier):
+        """Search the database and keep the result on the E-utilities history server."""
+        data = cls._eutils_params({"db": db, "term": term, "usehistory": "y", "retmax": 0, "retmode": "json"})
+        response = fetch_url(f"{NCBI_EUTILS_URL}/esearch.fcgi", data=data)
+        cls._content_check(response, identifier)
+        result = json.loads(response.text())["esearchresult"]
+        return int(result["count"]), {"WebEnv": result["webenv"], "query_key": result["querykey"]}
+
+    @classmethod
+    def _fetch_history(cls, endpoint, count, history, params, identifier):
+        """Yield the responses for all records of a search result on the history server page by page."""
+        for retstart in range(0, count, cls._EUTILS_PAGE_SIZE):
+            data = cls._eutils_params({**params, **history, "retstart": retstart, "retmax": cls._EUTILS_PAGE_SIZE})
+            response = fetch_url(f"{NCBI_EUTILS_URL}/{endpoint}", data=data)
+            cls._content_check(response, identifier)
+            yield response
 
     @classmethod
     def _gsm_to_srx(cls, identifier):
         """Resolve the GEO identifier to SRA experiments."""
-        ids = []
-        params = {"term": identifier, "db": "sra", "retmode": "json"}
-        response = fetch_url(f"https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi?{urlencode(params)}")
-        cls._content_check(response, identifier)
-        r_json = json.loads(response.text())
-        gsm_ids = r_json["esearchresult"]["idlist"]
-        for gsm_id in gsm_ids:
-            ids += cls._id_to_srx(gsm_id)
-        return ids
+        return cls._gsms_to_srx([identifier], identifier)
 
     @classmethod
-    def _gds_to_gsm(cls, identifier):
-        """Resolve the GEO UIDs to GSM IDs to then resolve to SRA IDs."""
+    def _gsms_to_srx(cls, gsm_ids, identifier):
+        """Resolve many GEO sample identifiers to SRA experiments with a few combined searches."""
         ids = []
-        params = {"id": identifier, "db": "gds", "retmode": "json", "retmax": 10}
-        response = fetch_url(f"https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi?{urlencode(params)}")
-        cls._content_check(response, identifier)
-        r_json = json.loads(response.text())
-
-        for each in r_json["result"][identifier]["samples"][0:]:
-            ids += cls._gsm_to_srx(each["accession"])
-        return ids
+        params = {"db": "sra", "rettype": "runinfo", "retmode": "text"}
+        for start in range(0, len(gsm_ids), cls._EUTILS_TERM_SIZE):
+            term = " OR ".join(gsm_ids[start : start + cls._EUTILS_TERM_SIZE])
+            count, history = cls._esearch("sra", term, identifier)
+            for response in cls._fetch_history("efetch.fcgi", count, history, params, identifier):
+                ids += [row["Experiment"] for row in open_table(response, delimiter=",")]
+        return list(dict.fromkeys(ids))
 
     @classmethod
     def _gse_to_srx(cls, identifier):
-        """Resolve the GSE identifier to GEO UIDs."""
-        ids = []
-        params = {"term": identifier, "db": "gds", "retmode": "json"}
-        response = fetch_url(f"https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi?{urlencode(params)}")
-        cls._content_check(response, identifier)
-        r_json = json.loads(response.text())
-        gds_uids = r_json["esearchresult"]["idlist"]
-        for gds_uid in gds_uids:
-            ids += cls._gds_to_gsm(gds_uid)
-        return ids
+        """Resolve the GSE identifier to the GEO samples of all its GEO UIDs and those to SRA experiments."""
+        gsm_ids = []
+        count, history = cls._esearch("gds", identifier, identifier)
+        params = {"db": "gds", "retmode": "json"}
+        for response in cls._fetch_history("esummary.fcgi", count, history, params, identifier):
+            result = json.loads(response.text())["result"]
+            for gds_uid in result.get("uids", []):
+                gsm_ids += [each["accession"] for each in result[gds_uid]["samples"]]
+        return cls._gsms_to_srx(list(dict.fromkeys(gsm_ids)), identifier)
 
     @classmethod
     def _id_to_erx(cls, identifier):
@@ -289,47 +1439,277 @@ class DatabaseResolver:
             "result": "read_run",
             "fields": ",".join(fields),
         }
-        response = fetch_url(f"https://www.ebi.ac.uk/ena/portal/api/filereport?{urlencode(params)}")
+        response = fetch_url(f"{ENA_PORTAL_API_URL}/filereport?{urlencode(params)}")
         cls._content_check(response, identifier)
         return [row["experiment_accession"] for row in open_table(response, delimiter="\t")]
 
 
+class RunFilter:
+    """
+    Define a filter of runs by the values of their metadata fields.
+
+    A filter expression is a comma-separated list of conditions that must all be met.
+    Each condition is either `field=value` or `field!=value`, where alternative values
+    are separated by `|`, e.g., `library_strategy=RNA-Seq,tax_id=9606|10090`. The filter
+    is pushed into the query of ENA search requests, such that unwanted runs are never
+    transferred, and applied to the rows of any other request locally.
+
+    Attributes:
+        conditions (list): The field, whether it is negated and the values of every condition.
+
+    """
+
+    _CONDITION_REGEX = re.compile(r"^\s*(\w+)\s*(!?=)\s*(.*?)\s*$")
+
+    def __init__(self, expression="", **kwargs):
+        """
+        Parse the filter expression.
+
+        Args:
+            expression (str): The filter expression, which may be empty to keep all runs.
+            **kwargs: Passed to parent constructor.
+
+        Raises:
+            ValueError: If a condition is malformed.
+
+        """
+        super().__init__(**kwargs)
+        self.conditions = []
+        for condition in filter(str.strip, expression.split(",")):
+            match = self._CONDITION_REGEX.match(condition)
+            if match is None or not match.group(3):
+                raise ValueError(f"Invalid condition '{condition.strip()}'")
+            field, operator, values = match.groups()
+            self.conditions.append((field, operator == "!=", tuple(value.strip() for value in values.split("|"))))
+
+    def __bool__(self):
+        return bool(self.conditions)
+
+    @property
+    def fields(self):
+        """Get the metadata fields the filter depends on."""
+        return list(dict.fromkeys(field for field, _, _ in self.conditions))
+
+    @property
+    def query(self):
+        """Get the filter in the query syntax of the ENA portal API."""
+        terms = []
+        for field, negate, values in self.conditions:
+            quoted = [value if value.isdigit() else f'"{value}"' for value in values]
+            if negate:
+                terms += [f"{field}!={value}" for value in quoted]
+            else:
+                terms.append("(" + " OR ".join(f"{field}={value}" for value in quoted) + ")")
+        return " AND ".join(terms)
+
+    def matches(self, row):
+        """Return whether the metadata row meets all conditions; fields missing from the row never do."""
+        return all(field in row and (row[field] in values) != negate for field, negate, values in self.conditions)
+
+
 class ENAMetadataFetcher:
     """Define a service class for fetching metadata from ENA."""
 
-    def __init__(self, ena_metadata_fields, **kwargs):
+    # Search fields of the accessions that are not resolved to experiments, by their prefix.
+    _QUERY_FIELDS = {
+        "PRJNA": "study_accession",
+        "PRJEB": "study_accession",
+        "PRJDB": "study_accession",
+        "SRP": "secondary_study_accession",
+        "ERP": "secondary_study_accession",
+        "DRP": "secondary_study_accession",
+        "SAMN": "sample_accession",
+        "SAMEA": "sample_accession",
+        "SAMD": "sample_accession",
+        "SRS": "secondary_sample_accession",
+        "ERS": "secondary_sample_accession",
+        "DRS": "secondary_sample_accession",
+        "SRA": "submission_accession",
+        "ERA": "submission_accession",
+        "DRA": "submission_accession",
+        "SRX": "experiment_accession",
+        "ERX": "experiment_accession",
+        "DRX": "experiment_accession",
+    }
+
+    def __init__(self, ena_metadata_fields, batch_size=100, run_filter=None, **kwargs):
         """
         Initialize the service with the desired metadata fields.
 
         Args:
             ena_metadata_fields (iterable): An iterable of the desired fields.
+            batch_size (int): The maximum number of experiment accessions combined
+                into a single search request.
+            run_filter (RunFilter): Only fetch the runs matching this filter (default all runs).
             **kwargs: Passed to parent constructor.
         """
         super().__init__(**kwargs)
-        self._params = {"result": "read_run", "fields": ",".join(ena_metadata_fields)}
+        self._fields = list(ena_metadata_fields)
+        self._batch_size = batch_size
+        self._filter = run_filter or RunFilter()
+        self.registry = AccessionRegistry()
+        self._params = {"result": "read_run", "fields": ",".join(self._fields)}
+        # Cached rows depend on the filter they were fetched with.
+        self._cache_key = f"{self._params['fields']}|{self._filter.query}" if self._filter else self._params["fields"]
 
     def open_experiment_table(self, accession):
         """
         Open the metadata table belonging to the given experiment accession.
 
+        With a filter, the runs of the accession are searched with the filter as part
+        of the query if possible. Otherwise, its file report is filtered locally.
+
         Args:
             accession (str): An ENA experiment accession.
 
         Returns:
-            csv.DictReader: A CSV reader instance of the metadata.
+            iterable: The metadata rows, e.g., a CSV reader instance.
 
         """
-        params = {**self._params, "accession": accession}
-        response = fetch_url(f"https://www.ebi.ac.uk/ena/portal/api/filereport?{urlencode(params)}")
+        if not self._filter:
+            params = {**self._params, "accession": accession}
+            response = fetch_url(f"{ENA_PORTAL_API_URL}/filereport?{urlencode(params)}", stream=True)
+            self._content_check(response, accession)
+            return open_table(response, delimiter="\t")
+        query_field = self._QUERY_FIELDS.get(ID_REGEX.match(accession).group(1))
+        if query_field is not None:
+            return self._search(f'{query_field}="{accession}"', self._fields, stream=True)
+        extra = [field for field in self._filter.fields if field not in self._fields]
+        params = {**self._params, "fields": ",".join(self._fields + extra), "accession": accession}
+        response = fetch_url(f"{ENA_PORTAL_API_URL}/filereport?{urlencode(params)}", stream=True)
         self._content_check(response, accession)
+        return (
+            {field: row[field] for field in self._fields}
+            for row in open_table(response, delimiter="\t")
+            if self._filter.matches(row)
+        )
+
+    def open_experiment_tables(self, accessions, index=0):
+        """
+        Open the metadata tables belonging to multiple accessions.
+
+        Experiment accessions already written for an earlier identifier of the run are
+        skipped, and those claimed by an earlier identifier that has not been written yet
+        or being fetched for a later identifier are shared, unless fetching them failed,
+        see `AccessionRegistry`. The others are combined into search requests
+        of up to `batch_size` accessions whose result is split back into one table per
+        accession, which is always done with a filter. Any other accession, or an experiment
+        missing from the search result without a filter, is fetched on its own. Only the
+        former is streamed unless it has to be stored in the cache, since it is the
+        identifier itself and therefore unique within the run.
+
+        Args:
+            accessions (list): ENA accessions as returned by the database resolver.
+            index (int): The index of the identifier in the input of the run.
+
+        Yields:
+            iterable: The metadata rows of each accession not skipped in the given order.
+
+        """
+        fields = self._cache_key
+        claims = {}
+        for accession in dict.fromkeys(accessions):
+            claims[accession] = self.registry.claim(accession, index) if EXPERIMENT_REGEX.match(accession) else None
+        fetch = [acc for acc, claim in claims.items() if claim is not None and claim[0] == AccessionRegistry.FETCH]
+        try:
+            tables = {acc: rows for acc in fetch if (rows := self._stored_rows(acc)) is not None}
+            experiments = [acc for acc in fetch if acc not in tables]
+            if experiments and (self._filter or self._batch_size > 1 and len(experiments) > 1):
+                found = self.search_experiments(experiments)
+                for accession in experiments:
+                    # Experiments without runs matching the filter are missing from the search result.
+                    rows = found.get(accession, [] if self._filter else None)
+                    if rows is not None:
+                        metadata_cache.put("read_run", accession, rows, fields)
+                        tables[accession] = rows
+            for accession in fetch:
+                if accession not in tables:
+                    tables[accession] = list(self.open_experiment_table(accession))
+                    metadata_cache.put("read_run", accession, tables[accession], fields)
+                claims[accession][1].set_result(tables[accession])
+        except BaseException as error:
+            # Do not leave other identifiers waiting for rows that will never arrive.
+            for accession in fetch:
+                if not claims[accession][1].done():
+                    claims[accession][1].set_exception(error)
+            raise
+        for accession, claim in claims.items():
+            if claim is not None:
+                future = claim[1]
+                try:
+                    rows = future.result() if future is not None else None
+                except Exception:
+                    # The identifier owning the rows failed, which is only tolerated with a journal.
+                    rows = list(self.open_experiment_table(accession))
+                # Skipped rows are only dropped once written, duplicates are dropped by the writer.
+                if rows is not None:
+                    yield rows
+                continue
+            rows = self._stored_rows(accession)
+            if rows is not None:
+                yield rows
+                continue
+            table = self.open_experiment_table(accession)
+            if metadata_cache.enabled:
+                table = list(table)
+                metadata_cache.put("read_run", accession, table, fields)
+            yield table
+
+    def _stored_rows(self, accession):
+        """Return the rows of the accession from the previous run or the cache or `None`."""
+        rows = previous_runinfo.rows(accession)
+        if rows is not None:
+            return [row for row in rows if self._filter.matches(row)]
+        return metadata_cache.get("read_run", accession, self._cache_key)
+
+    def search_experiments(self, experiments, fields=None):
+        """
+        Search the metadata rows of experiments with one request per batch of experiments.
+
+        Args:
+            experiments (list): ENA experiment accessions.
+            fields (list): The metadata fields to fetch (default the desired fields).
+
+        Returns:
+            dict: The metadata rows of every experiment found by its accession.
+
+        """
+        tables = {}
+        for start in range(0, len(experiments), self._batch_size):
+            tables.update(self._search_experiments(experiments[start : start + self._batch_size], fields))
+        return tables
+
+    def _search_experiments(self, experiments, fields=None):
+        """Return the metadata rows of the given experiments found by a single search request."""
+        fields = list(fields or self._fields)
+        # The experiment accession is required to split the result but may not be desired.
+        strip_accession = "experiment_accession" not in fields
+        fields = fields + ["experiment_accession"] if strip_accession else fields
+        query = " OR ".join(f'experiment_accession="{acc}"' for acc in experiments)
+        tables = {}
+        for row in self._search(query, fields):
+            accession = row.pop("experiment_accession") if strip_accession else row["experiment_accession"]
+            tables.setdefault(accession, []).append(row)
+        return tables
+
+    def _search(self, query, fields, stream=False):
+        """Return the metadata rows of the runs found by a search request, restricted by the filter."""
+        if self._filter:
+            query = f"({query}) AND {self._filter.query}"
+        data = {"result": "read_run", "fields": ",".join(fields), "query": query, "format": "tsv", "limit": 0}
+        response = fetch_url(f"{ENA_PORTAL_API_URL}/search", data=data, stream=stream)
+        if response.status == 204:
+            response.close()
+            return []
         return open_table(response, delimiter="\t")
 
     @classmethod
     def _content_check(cls, response, identifier):
-        """Check that the response has content or terminate."""
+        """Check that the response has content or close it and fail."""
         if response.status == 204:
-            logger.error(f"There is no content for id {identifier}. Maybe you lack the right " f"permissions?")
-            sys.exit(1)
+            # Release the pooled connection of a streamed response.
+            response.close()
+            raise FetchError(f"There is no content for id {identifier}. Maybe you lack the right permissions?")
 
 
 def open_table(response, delimiter=","):
@@ -344,7 +1724,7 @@ def open_table(response, delimiter=","):
             csv.DictReader: A CSV reader instance of the response body.
 
     """
-    return csv.DictReader(response.text().splitlines(), delimiter=delimiter)
+    return csv.DictReader(response.iter_lines(), delimiter=delimiter)
 
 
 def parse_args(args=None):
@@ -371,6 +1751,167 @@ def parse_args(args=None):
         default=",".join(ENA_METADATA_FIELDS),
         help=f"Comma-separated list of ENA metadata fields to fetch " f"(default: {','.join(ENA_METADATA_FIELDS)}).",
     )
+    parser.add_argument(
+        "-f",
+        "--filter",
+        type=str,
+        default="",
+        help="Only fetch runs whose ENA metadata fields match all of the comma-separated conditions "
+        "'field=value' or 'field!=value', where '|' separates alternative values, e.g. "
+        "'library_strategy=RNA-Seq,tax_id=9606|10090' (default all runs).",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="The number of identifiers to resolve and fetch concurrently (default 1).",
+    )
+    parser.add_argument(
+        "--resolve-workers",
+        type=int,
+        default=None,
+        help="The number of identifiers to resolve concurrently while the metadata of resolved "
+        "identifiers are fetched (default the number of workers).",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=100,
+        help="The maximum number of experiments whose metadata are fetched from ENA in a single "
+        "request; use 1 to fetch every experiment separately (default 100).",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        default=None,
+        help="Directory of a persistent cache for resolved identifiers, fetched metadata and the "
+        "list of valid ENA fields that can be shared between runs (default no cache).",
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=float,
+        default=7,
+        help="The number of days after which cached entries are fetched again (default 7).",
+    )
+    parser.add_argument(
+        "--cache-max-size",
+        type=int,
+        default=1024,
+        help="The maximum size of the cache in MB before the least recently used entries are evicted (default 1024).",
+    )
+    parser.add_argument(
+        "--previous",
+        type=Path,
+        default=None,
+        help="Output file of a previous run with the same metadata fields; experiments found in it are "
+        "not fetched again but their rows are reused (default none).",
+    )
+    parser.add_argument(
+        "--state",
+        type=Path,
+        default=None,
+        help="State file mapping every identifier to its experiments, which is read to skip the resolution "
+        "of known identifiers and rewritten for the next run (default none).",
+    )
+    parser.add_argument(
+        "--check-changes",
+        action="store_true",
+        help="Compare the run accessions, 'fastq_md5' and 'fastq_bytes' of the previous experiments to ENA "
+        "with batched requests and fetch changed experiments again.",
+    )
+    parser.add_argument(
+        "--journal",
+        type=Path,
+        default=None,
+        help="Journal file to which the rows of every identifier are appended once it is done; identifiers "
+        "that fail are reported and skipped instead of ending the run (default none).",
+    )
+    parser.add_argument(
+        "--failures",
+        type=Path,
+        default=None,
+        help="Report of the identifiers that failed in journaled mode "
+        "(default the output file with the suffix '.failures.csv').",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Reuse the identifiers completed in the journal by a previous attempt and only process the "
+        "identifiers that failed or were not reached.",
+    )
+    parser.add_argument(
+        "--pool-size",
+        type=str,
+        default=None,
+        help="The maximum number of persistent connections per host, optionally followed by "
+        "comma-separated overrides for specific hosts, e.g. '8,eutils.ncbi.nlm.nih.gov=3' "
+        "(default the number of workers).",
+    )
+    parser.add_argument(
+        "--max-retries",
+        type=int,
+        default=5,
+        help="The maximum number of times a failed request is retried (default 5).",
+    )
+    parser.add_argument(
+        "--retry-budget",
+        type=int,
+        default=100,
+        help="The maximum number of retries of all requests combined before giving up (default 100).",
+    )
+    parser.add_argument(
+        "--retry-status-codes",
+        type=str,
+        default="429,500,502,503,504",
+        help="Comma-separated list of HTTP status codes of responses that are retried (default 429,500,502,503,504).",
+    )
+    parser.add_argument(
+        "--api-key",
+        type=str,
+        default=os.environ.get("NCBI_API_KEY"),
+        help="NCBI API key that allows 10 instead of 3 requests per second to the E-utilities "
+        "(default the environment variable NCBI_API_KEY).",
+    )
+    parser.add_argument(
+        "--max-requests-per-second",
+        type=float,
+        default=None,
+        help="Limit the number of HTTP requests sent per second across all workers and hosts in "
+        "addition to the per-host limits of NCBI and ENA (default no limit).",
+    )
+    parser.add_argument(
+        "--record",
+        type=Path,
+        default=None,
+        help="Directory to which all responses are recorded as fixture files for --replay (default none).",
+    )
+    parser.add_argument(
+        "--replay",
+        type=Path,
+        default=None,
+        help="Directory of fixture files recorded with --record from which all responses are replayed "
+        "without network access (default none).",
+    )
+    parser.add_argument(
+        "--replay-latency",
+        type=float,
+        default=0.0,
+        help="The delay of every replayed response in seconds (default 0).",
+    )
+    parser.add_argument(
+        "--replay-rate",
+        type=float,
+        default=None,
+        help="The number of replayed requests per second beyond which requests are throttled "
+        "with 429 responses (default no throttling).",
+    )
+    parser.add_argument(
+        "--replay-error-rate",
+        type=float,
+        default=0.0,
+        help="The fraction of replayed requests that fail with 503 responses (default 0).",
+    )
     parser.add_argument(
         "-l",
         "--log-level",
@@ -381,6 +1922,35 @@ def parse_args(args=None):
     return parser.parse_args(args)
 
 
+def parse_pool_size(param, default):
+    """Parse the default and host specific connection pool sizes from the given parameter."""
+    max_size = default
+    host_sizes = {}
+    for value in param.split(",") if param else []:
+        try:
+            host, _, size = value.strip().rpartition("=")
+            if host:
+                host_sizes[host] = int(size)
+            else:
+                max_size = int(size)
+        except ValueError:
+            logger.error(f"Please provide a valid value for --pool-size!\nProvided value = {param}")
+            sys.exit(1)
+    if max_size < 1 or any(size < 1 for size in host_sizes.values()):
+        logger.error(f"Pool sizes must be at least 1!\nProvided value = {param}")
+        sys.exit(1)
+    return max_size, host_sizes
+
+
+def parse_status_codes(param):
+    """Parse the comma-separated HTTP status codes from the given parameter."""
+    try:
+        return frozenset(int(code) for code in param.split(",") if code.strip())
+    except ValueError:
+        logger.error(f"Please provide a valid value for --retry-status-codes!\nProvided value = {param}")
+        sys.exit(1)
+
+
 def validate_fields_parameter(param, valid_vals, param_desc):
     if not param:
         return []
@@ -398,66 +1968,84 @@ def validate_fields_parameter(param, valid_vals, param_desc):
         sys.exit(1)
 
 
-def fetch_url(url):
-    """Return a response object for the given URL and handle errors appropriately."""
-    sleep_time = 5  # Hardcode sleep duration in seconds
-    max_num_attempts = 3  # Hardcode max number of request attempts
-    attempt = 0
-
-    try:
-        with urlopen(url) as response:
-            return Response(response=response)
-
-    except HTTPError as e:
-        if e.status == 429:
-            # If the response is 429, sleep and retry
-            if "Retry-After" in e.headers:
-                retry_after = int(e.headers["Retry-After"])
-                logging.warning(f"Received 429 response from server. Retrying after {retry_after} seconds...")
-                time.sleep(retry_after)
-            else:
-                logging.warning(f"Received 429 response from server. Retrying in {sleep_time} seconds...")
-                time.sleep(sleep_time)
-                sleep_time *= 2  # Increment sleep time
-            attempt += 1
-            return fetch_url(url)  # Recursive call to retry request
-
-        elif e.status == 500:
-            # If the response is 500, sleep and retry max 3 times
-            if attempt <= max_num_attempts:
-                logging.warning(f"Received 500 response from server. Retrying in {sleep_time} seconds...")
-                time.sleep(sleep_time)
-                sleep_time *= 2
-                attempt += 1
-                return fetch_url(url)
-            else:
-                logging.error("Exceeded max request attempts. Exiting.")
-                sys.exit(1)
-
-    except URLError as e:
-        logger.error("We failed to reach a server.")
-        logger.error(f"Reason: {e.reason}")
-        sys.exit(1)
+def fetch_url(url, data=None, stream=False):
+    """
+    Return a response object for the given URL and handle errors appropriately.
 
+    If form `data` is given, it is URL-encoded and sent as the body of a POST request.
+    If `stream` is true, the body is read lazily, e.g., by `open_table`. Transient
+    failures are retried according to the shared retry policy and a `FetchError` is
+    raised for any other failure. Identical requests that are not streamed share the
+    response of one still in flight.
+    """
+    body = None if data is None else urlencode(data).encode("utf-8")
+    if stream:
+        return send_request(url, body, stream=True)
+    return request_coalescer.request((url, body), functools.partial(send_request, url, body))
 
-def get_ena_fields():
-    params = {"dataPortal": "ena", "format": "tsv", "result": "read_run"}
-    return [
-        row["columnId"]
-        for row in open_table(
-            fetch_url(f"https://www.ebi.ac.uk/ena/portal/api/returnFields?{urlencode(params)}"),
-            delimiter="\t",
-        )
-    ]
 
+def send_request(url, body=None, stream=False):
+    """Send the request with the shared transport, rate limits and retry policy."""
+    host_limiter = host_rate_limiter.get(url)
+    attempt = 0
+    while True:
+        try:
+            rate_limiter.acquire()
+            if host_limiter is not None:
+                host_limiter.acquire()
+            response = transport.request(url, data=body, stream=stream)
+            if host_limiter is not None:
+                host_limiter.recover()
+            return response
+
+        except HTTPError as e:
+            if e.status == 429 and host_limiter is not None:
+                host_limiter.throttle()
+            if e.status not in retry_policy.status_codes:
+                raise FetchError(f"Received {e.status} response from server for {url}.")
+            reason = f"Received {e.status} response from server"
+            retry_after = RetryPolicy.parse_retry_after(e.headers.get("Retry-After"))
+
+        except URLError as e:
+            # Timeouts, connection resets and the like are wrapped by the connection pool.
+            reason = f"We failed to reach a server ({e.reason})"
+            retry_after = None
+
+        attempt += 1
+        if attempt > retry_policy.max_retries or not retry_policy.consume():
+            raise FetchError(f"{reason}. Exceeded max request attempts.")
+        delay = retry_policy.delay(attempt, retry_after)
+        logger.warning(f"{reason}. Retrying in {delay:.1f} seconds...")
+        time.sleep(delay)
+
+
+def get_ena_fields(requested=()):
+    """
+    Return the valid ENA metadata fields needed to validate the requested fields.
 
-def fetch_sra_runinfo(file_in, file_out, ena_metadata_fields):
+    The shipped snapshot of valid fields is used if it contains all requested fields.
+    Otherwise, the current list is fetched from ENA unless it is in the cache.
+    """
+    if ENA_RETURN_FIELDS.issuperset(requested):
+        return sorted(ENA_RETURN_FIELDS)
+    fields = metadata_cache.get("returnFields", "read_run")
+    if fields is None:
+        params = {"dataPortal": "ena", "format": "tsv", "result": "read_run"}
+        fields = [
+            row["columnId"]
+            for row in open_table(
+                fetch_url(f"{ENA_PORTAL_API_URL}/returnFields?{urlencode(params)}"),
+                delimiter="\t",
+            )
+        ]
+        metadata_cache.put("returnFields", "read_run", fields)
+    return fields
+
+
+def read_ids(file_in):
+    """Yield the unique and valid database identifiers from the given file in order."""
     seen_ids = set()
-    run_ids = set()
-    ena_fetcher = ENAMetadataFetcher(ena_metadata_fields)
-    with open(file_in, "r") as fin, open(file_out, "w") as fout:
-        writer = csv.DictWriter(fout, fieldnames=ena_metadata_fields, delimiter="\t")
-        writer.writeheader()
+    with open(file_in, "r") as fin:
         for line in fin:
             db_id = line.strip()
             if db_id in seen_ids:
@@ -467,31 +2055,360 @@ def fetch_sra_runinfo(file_in, file_out, ena_metadata_fields):
                 id_str = ", ".join([x + "*" for x in PREFIX_LIST])
                 logger.error(f"Please provide a valid database id starting with {id_str}!\n" f"Line: '{line.strip()}'")
                 sys.exit(1)
-            ids = DatabaseResolver.expand_identifier(db_id)
-            if not ids:
-                logger.error(f"No matches found for database id {db_id}!\nLine: '{line.strip()}'")
-                sys.exit(1)
-            for accession in ids:
-                for row in ena_fetcher.open_experiment_table(accession):
+            yield db_id
+
+
+def resolve_id(db_id):
+    """Return the accessions of the identifier, which are only resolved if they are not in the previous state."""
+    ids = previous_runinfo.experiments(db_id)
+    if ids is None:
+        ids = DatabaseResolver.expand_identifier(db_id)
+    if not ids:
+        raise FetchError(f"No matches found for database id {db_id}!\nLine: '{db_id}'")
+    return ids
+
+
+def fetch_id_rows(db_id, ids, ena_fetcher, fieldnames, index=0):
+    """
+    Spool all metadata rows of the accessions of a resolved database identifier.
+
+    Experiments of earlier identifiers are skipped once their rows have been written.
+    Rows are written to a temporary file as they are received, which is only kept in
+    memory while it is smaller than `SPOOL_MAX_SIZE`. The experiments of the identifier
+    are recorded for the next run and, together with the rows, in the journal.
+
+    Returns:
+        tempfile.SpooledTemporaryFile: The rewound rows in tab-delimited format.
+
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE, mode="w+", newline="")
+    writer = csv.DictWriter(spool, fieldnames=fieldnames, delimiter="\t")
+    experiments = dict.fromkeys(acc for acc in ids if EXPERIMENT_REGEX.match(acc))
+    for table in ena_fetcher.open_experiment_tables(ids, index):
+        for row in table:
+            writer.writerow(row)
+            experiments[row.get("experiment_accession")] = None
+    experiments = [acc for acc in experiments if acc]
+    previous_runinfo.record(db_id, experiments)
+    spool.seek(0)
+    if checkpoint_journal.enabled:
+        checkpoint_journal.done(db_id, experiments, csv.reader(spool, delimiter="\t"))
+        spool.seek(0)
+    return spool
+
+
+def journaled_id_rows(db_id):
+    """Spool the metadata rows of an identifier completed by a previous attempt from the journal."""
+    experiments, rows = checkpoint_journal.load(db_id)
+    previous_runinfo.record(db_id, experiments)
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE, mode="w+", newline="")
+    csv.writer(spool, delimiter="\t").writerows(rows)
+    spool.seek(0)
+    return spool
+
+
+class PipelineStage:
+    """
+    Define a stage of the pipeline that runs its tasks on its own pool of worker threads.
+
+    The number of tasks queued or running in a stage is bounded by its capacity, such
+    that submitting a task blocks while the stage is full and slower stages hold back
+    faster ones. Stages are context managers that wait for their tasks on exit and
+    cancel queued tasks if an error occurred.
+
+    Attributes:
+        name (str): The name of the stage in its statistics.
+        queued (int): The number of tasks waiting for a worker.
+        active (int): The number of running tasks.
+        completed (int): The number of finished tasks.
+
+    """
+
+    def __init__(self, name, workers, capacity, **kwargs):
+        """
+        Initialize the stage and start its worker pool.
+
+        Args:
+            name (str): The name of the stage in its statistics.
+            workers (int): The number of tasks that run concurrently.
+            capacity (int): The maximum number of tasks queued or running.
+            **kwargs: Passed to parent constructor.
+
+        """
+        super().__init__(**kwargs)
+        self.name = name
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        self._busy = 0.0
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(capacity)
+        self._futures = set()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self._start = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            # Refuse new tasks before cancelling the queued ones (`cancel_futures` requires Python 3.9).
+            self._executor.shutdown(wait=False)
+            with self._lock:
+                futures = list(self._futures)
+            for future in futures:
+                future.cancel()
+        self._executor.shutdown(wait=True)
+
+    def submit(self, fn, *args):
+        """
+        Queue the task once the stage has capacity and return its future.
+
+        Raises:
+            RuntimeError: If the stage was shut down.
+
+        """
+        self._slots.acquire()
+        with self._lock:
+            self.queued += 1
+        try:
+            future = self._executor.submit(self._run, fn, *args)
+        except BaseException:
+            with self._lock:
+                self.queued -= 1
+            self._slots.release()
+            raise
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        """Free the slot of a finished or cancelled task, which never ran in the latter case."""
+        with self._lock:
+            if future.cancelled():
+                self.queued -= 1
+            self._futures.discard(future)
+        self._slots.release()
+
+    def _run(self, fn, *args):
+        """Run the task and update the statistics of the stage."""
+        start = time.monotonic()
+        with self._lock:
+            self.queued -= 1
+            self.active += 1
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self.active -= 1
+                self.completed += 1
+                self._busy += time.monotonic() - start
+
+    def stats(self):
+        """Return the queue depth, the throughput and the utilization of the stage as text."""
+        with self._lock:
+            elapsed = max(time.monotonic() - self._start, 1e-9)
+            return (
+                f"{self.name}: {self.queued} queued, {self.active} active, {self.completed} done "
+                f"({self.completed / elapsed:.1f}/s, {self._busy / elapsed:.1f} workers busy)"
+            )
+
+
+def chain_future(source, target):
+    """Resolve the target future with the result or exception of the finished source future."""
+    if source.cancelled():
+        target.cancel()
+    elif source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+
+def fetch_sra_runinfo(
+    file_in, file_out, ena_metadata_fields, workers=1, batch_size=100, resolve_workers=None, run_filter=None
+):
+    """
+    Fetch the metadata of all identifiers in the input file and write them as a table.
+
+    Identifiers pass through a pipeline of three stages with bounded queues: they are
+    resolved to accessions, the metadata rows of those are fetched and spooled, and the
+    rows are written in the order of the input file. Resolving and fetching each run on
+    their own pool of worker threads so that both keep requests in flight while the other
+    stage or the writer is busy. Every experiment is only fetched once per run, for the
+    first identifier resolving to it. If the journal is enabled, identifiers completed by
+    a previous attempt are read from it and failed identifiers are reported and skipped.
+
+    Args:
+        file_in (pathlib.Path): File containing database identifiers, one per line.
+        file_out (pathlib.Path): Output file in tab-delimited format.
+        ena_metadata_fields (list): The ENA metadata fields to fetch.
+        workers (int): The number of identifiers whose metadata are fetched concurrently.
+        batch_size (int): The maximum number of experiments fetched per ENA request.
+        resolve_workers (int): The number of identifiers resolved concurrently (default `workers`).
+        run_filter (RunFilter): Only fetch and write the runs matching this filter (default all runs).
+
+    """
+    resolve_workers = resolve_workers or workers
+    run_ids = set()
+    ena_fetcher = ENAMetadataFetcher(ena_metadata_fields, batch_size=batch_size, run_filter=run_filter)
+    resolve_stage = PipelineStage("resolve", resolve_workers, capacity=2 * resolve_workers)
+    fetch_stage = PipelineStage("fetch", workers, capacity=2 * workers)
+    # The writer waits for the identifiers in input order, which bounds the number in flight.
+    write_stage = PipelineStage("write", 1, capacity=2 * (resolve_workers + workers))
+    stages = (resolve_stage, fetch_stage, write_stage)
+    stopped = threading.Event()
+
+    def report():
+        while not stopped.wait(STATS_INTERVAL):
+            logger.info("; ".join(stage.stats() for stage in stages))
+
+    def submit_fetch(index, db_id, resolved, result):
+        try:
+            fetched = fetch_stage.submit(
+                fetch_id_rows, db_id, resolved.result(), ena_fetcher, ena_metadata_fields, index
+            )
+        except BaseException as error:
+            result.set_exception(error)
+            return
+        fetched.add_done_callback(lambda fetched: chain_future(fetched, result))
+
+    with open(file_out, "w") as fout, resolve_stage, fetch_stage, write_stage:
+        writer = csv.DictWriter(fout, fieldnames=ena_metadata_fields, delimiter="\t")
+        writer.writeheader()
+
+        def write_rows(index, db_id, result):
+            try:
+                spool = result.result()
+            except Exception as error:
+                if not checkpoint_journal.enabled:
+                    raise
+                logger.warning(f"Skipping database id {db_id}: {error}")
+                checkpoint_journal.fail(db_id, error)
+                ena_fetcher.registry.release(index, written=False)
+                return
+            with spool:
+                for row in csv.DictReader(spool, fieldnames=ena_metadata_fields, delimiter="\t"):
                     run_accession = row["run_accession"]
                     if run_accession not in run_ids:
                         writer.writerow(row)
                         run_ids.add(run_accession)
+            ena_fetcher.registry.release(index)
+
+        threading.Thread(target=report, daemon=True).start()
+        try:
+            pending = deque()
+            for index, db_id in enumerate(read_ids(file_in)):
+                result = Future()
+                if checkpoint_journal.completed(db_id):
+                    result.set_result(journaled_id_rows(db_id))
+                else:
+                    resolved = resolve_stage.submit(resolve_id, db_id)
+                    resolved.add_done_callback(functools.partial(submit_fetch, index, db_id, result=result))
+                pending.append(write_stage.submit(write_rows, index, db_id, result))
+                # Fail fast if an identifier could not be processed.
+                while pending and pending[0].done():
+                    pending.popleft().result()
+            while pending:
+                pending.popleft().result()
+        finally:
+            stopped.set()
+    logger.info("; ".join(stage.stats() for stage in stages))
+    registry = ena_fetcher.registry
+    logger.info(
+        f"Saved {registry.skipped + registry.shared + request_coalescer.saved} requests by skipping "
+        f"{registry.skipped} and sharing {registry.shared} duplicate experiments and sharing "
+        f"{request_coalescer.saved} identical requests in flight."
+    )
 
 
 def main(args=None):
+    global transport
     args = parse_args(args)
     logging.basicConfig(level=args.log_level, format="[%(levelname)s] %(message)s")
     if not args.file_in.is_file():
         logger.error(f"The given input file {args.file_in} was not found!")
         sys.exit(1)
+    if args.workers < 1 or args.batch_size < 1 or (args.resolve_workers is not None and args.resolve_workers < 1):
+        logger.error("The number of workers and the batch size must be at least 1!")
+        sys.exit(1)
     args.file_out.parent.mkdir(parents=True, exist_ok=True)
-    ena_metadata_fields = validate_fields_parameter(
-        args.ena_metadata_fields,
-        valid_vals=get_ena_fields(),
-        param_desc="--ena_metadata_fields",
-    )
-    fetch_sra_runinfo(args.file_in, args.file_out, ena_metadata_fields)
+    connection_pool.max_size, connection_pool.host_sizes = parse_pool_size(args.pool_size, default=args.workers)
+    rate_limiter.rate = args.max_requests_per_second
+    if args.api_key:
+        DatabaseResolver.ncbi_api_key = args.api_key
+        host_rate_limiter.rates[urlsplit(NCBI_EUTILS_URL).hostname] = 10
+    retry_policy.max_retries = args.max_retries
+    retry_policy.budget = args.retry_budget
+    retry_policy.status_codes = parse_status_codes(args.retry_status_codes)
+    if args.record is not None and args.replay is not None:
+        logger.error("Responses cannot be recorded and replayed at the same time!")
+        sys.exit(1)
+    if args.record is not None:
+        transport = HTTPRecorder(connection_pool, args.record, retry_status_codes=retry_policy.status_codes)
+    elif args.replay is not None:
+        transport = HTTPReplayer(
+            args.replay, latency=args.replay_latency, rate=args.replay_rate, error_rate=args.replay_error_rate
+        )
+    if args.resume and args.journal is None:
+        logger.error("A journal is required to resume a previous attempt!")
+        sys.exit(1)
+    if args.cache_dir is not None:
+        metadata_cache.open(args.cache_dir, ttl=args.cache_ttl * 86400, max_size=args.cache_max_size * 1024**2)
+    try:
+        requested_fields = args.ena_metadata_fields.split(",") if args.ena_metadata_fields else []
+        ena_metadata_fields = validate_fields_parameter(
+            args.ena_metadata_fields,
+            valid_vals=get_ena_fields(requested=requested_fields),
+            param_desc="--ena_metadata_fields",
+        )
+        try:
+            run_filter = RunFilter(args.filter)
+        except ValueError as error:
+            logger.error(f"Please provide a valid value for --filter!\n{error} in '{args.filter}'")
+            sys.exit(1)
+        validate_fields_parameter(
+            ",".join(run_filter.fields),
+            valid_vals=get_ena_fields(requested=run_filter.fields),
+            param_desc="--filter",
+        )
+        if args.previous is not None or args.state is not None:
+            if "experiment_accession" not in ena_metadata_fields:
+                logger.error("The field 'experiment_accession' is required with --previous or --state!")
+                sys.exit(1)
+            missing = [field for field in run_filter.fields if field not in ena_metadata_fields]
+            if args.previous is not None and missing:
+                logger.error(f"The fields of --filter are required with --previous, missing: {','.join(missing)}!")
+                sys.exit(1)
+            previous_runinfo.open(ena_metadata_fields, runinfo=args.previous, state=args.state)
+            if args.check_changes:
+                previous_runinfo.verify(
+                    ENAMetadataFetcher(ena_metadata_fields, batch_size=args.batch_size, run_filter=run_filter)
+                )
+        if args.journal is not None:
+            failures = args.failures or args.file_out.with_suffix(".failures.csv")
+            checkpoint_journal.open(args.journal, failures, ena_metadata_fields, resume=args.resume)
+        fetch_sra_runinfo(
+            args.file_in,
+            args.file_out,
+            ena_metadata_fields,
+            workers=args.workers,
+            batch_size=args.batch_size,
+            resolve_workers=args.resolve_workers,
+            run_filter=run_filter,
+        )
+    except FetchError as error:
+        logger.error(error)
+        sys.exit(1)
+    finally:
+        checkpoint_journal.close()
+    if args.state is not None:
+        previous_runinfo.save(args.state)
+    if checkpoint_journal.failed:
+        logger.warning(
+            f"{checkpoint_journal.failed} database ids failed and are listed in {failures}. "
+            f"Run again with --resume to retry only those."
+        )
 
 
 if __name__ == "__main__":
@@ -3,14 +3,23 @@
 
 import argparse
 import csv
+import heapq
 import logging
+import pickle
 import sys
-from itertools import chain
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from functools import partial
+from itertools import chain, groupby
+from operator import itemgetter
 from pathlib import Path
 
 
 logger = logging.getLogger()
 
+LOG_FORMAT = "[%(levelname)s] %(message)s"
+
 
 def parse_args(args=None):
     Description = "Create samplesheet with FTP download links and md5ums from sample information obtained via 'sra_ids_to_runinfo.py' script."
@@ -28,6 +37,22 @@ def parse_args(args=None):
         type=Path,
         help="Output file containing paths to download FastQ files along with their associated md5sums.",
     )
+    parser.add_argument(
+        "-m",
+        "--max-rows-in-memory",
+        type=int,
+        default=None,
+        help="Merge the input files with bounded memory by sorting at most this many rows in memory "
+        "and spilling the rest to temporary files (default all rows are kept in memory).",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="The number of input files to parse concurrently in separate processes when all rows "
+        "are kept in memory (default 1).",
+    )
     parser.add_argument(
         "-l",
         "--log-level",
@@ -42,120 +67,336 @@ def valid_fastq_extension(fastq):
     return fastq.endswith("fastq.gz")
 
 
-def parse_sra_runinfo(file_in):
-    runinfo = {}
-    columns = [
-        "run_accession",
+COLUMNS = [
+    "run_accession",
+    "experiment_accession",
+    "library_layout",
+    "fastq_ftp",
+    "fastq_md5",
+]
+EXTENSIONS = [
+    "fastq_1",
+    "fastq_2",
+    "md5_1",
+    "md5_2",
+    "single_end",
+]
+# Columns whose values repeat across the runs of an experiment, sample or study and
+# are shared between samples once interned. Values of other columns, like accessions,
+# checksums and links of runs, are unique and would only grow the interned strings.
+SHARED_COLUMNS = frozenset(
+    {
         "experiment_accession",
+        "sample_accession",
+        "secondary_sample_accession",
+        "study_accession",
+        "secondary_study_accession",
+        "submission_accession",
+        "experiment_alias",
+        "sample_alias",
+        "study_alias",
         "library_layout",
-        "fastq_ftp",
-        "fastq_md5",
-    ]
-    extensions = [
-        "fastq_1",
-        "fastq_2",
-        "md5_1",
-        "md5_2",
-        "single_end",
-    ]
-    with open(file_in, "r", newline="") as fin:
-        reader = csv.DictReader(fin, delimiter="\t", skipinitialspace=True)
-        header = list(reader.fieldnames)
-        if missing := frozenset(columns).difference(frozenset(header)):
-            logger.critical(f"The following expected columns are missing from {file_in}: " f"{', '.join(missing)}.")
-            sys.exit(1)
-        for row in reader:
-            db_id = row["experiment_accession"]
-            if row["fastq_ftp"]:
-                fq_files = row["fastq_ftp"].split(";")[-2:]
-                fq_md5 = row["fastq_md5"].split(";")[-2:]
-                if len(fq_files) == 1:
-                    assert fq_files[0].endswith(".fastq.gz"), f"Unexpected FastQ file format {file_in.name}."
-                    if row["library_layout"] != "SINGLE":
-                        logger.warning(f"The library layout '{row['library_layout']}' should be " f"'SINGLE'.")
-                    sample = {
-                        "fastq_1": fq_files[0],
-                        "fastq_2": None,
-                        "md5_1": fq_md5[0],
-                        "md5_2": None,
-                        "single_end": "true",
-                    }
-                elif len(fq_files) == 2:
-                    assert fq_files[0].endswith("_1.fastq.gz"), f"Unexpected FastQ file format {file_in.name}."
-                    assert fq_files[1].endswith("_2.fastq.gz"), f"Unexpected FastQ file format {file_in.name}."
-                    if row["library_layout"] != "PAIRED":
-                        logger.warning(f"The library layout '{row['library_layout']}' should be " f"'PAIRED'.")
-                    sample = {
-                        "fastq_1": fq_files[0],
-                        "fastq_2": fq_files[1],
-                        "md5_1": fq_md5[0],
-                        "md5_2": fq_md5[1],
-                        "single_end": "false",
-                    }
-                else:
-                    raise RuntimeError(f"Unexpected number of FastQ files: {fq_files}.")
-            else:
-                # In some instances, FTP links don't exist for FastQ files.
-                # These have to be downloaded with the run accession using sra-tools.
-                sample = dict.fromkeys(extensions, None)
-                if row["library_layout"] == "SINGLE":
-                    sample["single_end"] = "true"
-                elif row["library_layout"] == "PAIRED":
-                    sample["single_end"] = "false"
-
-            sample.update(row)
-            if db_id not in runinfo:
-                runinfo[db_id] = [sample]
-            else:
-                if sample in runinfo[db_id]:
-                    logger.error(
-                        f"Input run info file contains duplicate rows!\n" f"{', '.join([row[col] for col in header])}"
-                    )
-                else:
-                    runinfo[db_id].append(sample)
+        "library_selection",
+        "library_source",
+        "library_strategy",
+        "library_name",
+        "instrument_model",
+        "instrument_platform",
+        "tax_id",
+        "scientific_name",
+        "sample_title",
+        "experiment_title",
+        "study_title",
+        "sample_description",
+    }
+)
+
+
+def row_to_sample(row, fastq_ftp, fastq_md5, library_layout, file_in):
+    """
+    Create a sample record from a run info row.
+
+    Returns:
+        tuple: The values of the row followed by the values of the `EXTENSIONS` columns.
+
+    """
+    if fastq_ftp:
+        fq_files = fastq_ftp.split(";")[-2:]
+        fq_md5 = fastq_md5.split(";")[-2:]
+        if len(fq_files) == 1:
+            assert fq_files[0].endswith(".fastq.gz"), f"Unexpected FastQ file format {file_in.name}."
+            if library_layout != "SINGLE":
+                logger.warning(f"The library layout '{library_layout}' should be " f"'SINGLE'.")
+            extension = (fq_files[0], None, fq_md5[0], None, "true")
+        elif len(fq_files) == 2:
+            assert fq_files[0].endswith("_1.fastq.gz"), f"Unexpected FastQ file format {file_in.name}."
+            assert fq_files[1].endswith("_2.fastq.gz"), f"Unexpected FastQ file format {file_in.name}."
+            if library_layout != "PAIRED":
+                logger.warning(f"The library layout '{library_layout}' should be " f"'PAIRED'.")
+            extension = (fq_files[0], fq_files[1], fq_md5[0], fq_md5[1], "false")
+        else:
+            raise RuntimeError(f"Unexpected number of FastQ files: {fq_files}.")
+    else:
+        # In some instances, FTP links don't exist for FastQ files.
+        # These have to be downloaded with the run accession using sra-tools.
+        single_end = None
+        if library_layout == "SINGLE":
+            single_end = "true"
+        elif library_layout == "PAIRED":
+            single_end = "false"
+        extension = (None, None, None, None, single_end)
+
+    return tuple(row) + extension
+
+
+def read_sra_runinfo(file_in):
+    """
+    Open a run info file and check its header.
+
+    Samples are tuples indexed like the header followed by the `EXTENSIONS` columns,
+    rather than dictionaries, since storing the column names once per run dominates
+    the memory used by large files. Values of the `SHARED_COLUMNS` are interned.
+
+    Returns:
+        tuple: The header of the file and an iterator over the experiment accession
+            and sample of each row, which closes the file once exhausted.
+
+    """
+    fin = open(file_in, "r", newline="")
+    reader = csv.reader(fin, delimiter="\t", skipinitialspace=True)
+    header = next(reader, [])
+    if missing := frozenset(COLUMNS).difference(frozenset(header)):
+        logger.critical(f"The following expected columns are missing from {file_in}: " f"{', '.join(missing)}.")
+        sys.exit(1)
+    columns = itemgetter(
+        *(header.index(col) for col in ("experiment_accession", "fastq_ftp", "fastq_md5", "library_layout"))
+    )
+    shared = [index for index, col in enumerate(header) if col in SHARED_COLUMNS]
+
+    def samples():
+        with fin:
+            for row in reader:
+                # Skip blank lines and pad short rows like `csv.DictReader`.
+                if not row:
+                    continue
+                if len(row) < len(header):
+                    row += [""] * (len(header) - len(row))
+                elif len(row) > len(header):
+                    # `csv.DictReader` kept extra values under the key `None`, which made
+                    # `csv.DictWriter` fail when writing the row. Fail early instead.
+                    raise ValueError(f"Unexpected number of columns in {file_in}: {row}.")
+                for index in shared:
+                    row[index] = sys.intern(row[index])
+                db_id, fastq_ftp, fastq_md5, library_layout = columns(row)
+                yield db_id, row_to_sample(row, fastq_ftp, fastq_md5, library_layout, file_in)
+
+    return header, samples()
+
+
+def log_duplicate_row(sample, header):
+    logger.error(f"Input run info file contains duplicate rows!\n" f"{', '.join(sample[: len(header)])}")
+
+
+def parse_sra_runinfo(file_in):
+    runinfo = {}
+    # Samples of all experiments for constant time duplicate detection.
+    fingerprints = set()
+    header, samples = read_sra_runinfo(file_in)
+    for db_id, sample in samples:
+        if sample in fingerprints:
+            log_duplicate_row(sample, header)
+        else:
+            fingerprints.add(sample)
+            runinfo.setdefault(db_id, []).append(sample)
 
-    return runinfo, header + extensions
+    return runinfo, header + EXTENSIONS
 
 
-def sra_runinfo_to_ftp(files_in, file_out):
+def combine_headers(headers):
+    """Create a combined header from all input files."""
+    combined_header = headers[0] + list(set().union(chain.from_iterable(headers)).difference(headers[0]))
+    combined_header.insert(0, "id")
+    return combined_header
+
+
+def row_writer(fout, combined_header, headers):
+    """
+    Create a function writing samples of input files with the given headers.
+
+    The function takes the experiment accession, the index of the input file and the
+    sample and writes it with the columns of the combined header.
+
+    """
+    writer = csv.writer(fout, delimiter="\t", lineterminator="\r\n")
+    writer.writerow(combined_header)
+    layouts = []
+    for header in headers:
+        # Input columns take precedence over extension columns of the same name.
+        positions = {col: len(header) + idx for idx, col in enumerate(EXTENSIONS)}
+        positions.update((col, idx) for idx, col in enumerate(header))
+        # Columns missing from an input file point past the end of its samples.
+        missing = len(header) + len(EXTENSIONS)
+        layouts.append(
+            (
+                positions["run_accession"],
+                itemgetter(*(positions.get(col, missing) for col in combined_header[1:])),
+            )
+        )
+
+    def write(db_id, index, sample):
+        run_accession, columns = layouts[index]
+        writer.writerow((f"{db_id}_{sample[run_accession]}", *columns(sample + ("",))))
+
+    return write
+
+
+def parse_sra_runinfo_files(files_in, workers=1):
+    """
+    Parse the run info files, in a pool of worker processes if requested.
+
+    Returns:
+        iterator: The results of `parse_sra_runinfo` in the order of the input files.
+
+    """
+    workers = min(workers, len(files_in))
+    if workers <= 1:
+        yield from map(parse_sra_runinfo, files_in)
+        return
+    # Workers don't inherit the logging configuration unless they are forked.
+    initializer = partial(logging.basicConfig, level=logger.level, format=LOG_FORMAT)
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer) as executor:
+        yield from executor.map(parse_sra_runinfo, files_in)
+
+
+def sra_runinfo_to_ftp(files_in, file_out, workers=1):
     samplesheet = {}
     header = []
-    for file_in in files_in:
-        runinfo, sample_header = parse_sra_runinfo(file_in)
+    for index, (runinfo, sample_header) in enumerate(parse_sra_runinfo_files(files_in, workers)):
         header.append(sample_header)
         for db_id, rows in runinfo.items():
             if db_id not in samplesheet:
-                samplesheet[db_id] = rows
+                samplesheet[db_id] = (index, rows)
             else:
                 logger.warning(f"Duplicate sample identifier found!\nID: '{db_id}'")
 
-    # Create a combined header from all input files.
-    combined_header = header[0] + list(set().union(chain.from_iterable(header)).difference(header[0]))
-    combined_header.insert(0, "id")
+    combined_header = combine_headers(header)
 
     # Write samplesheet with paths to FastQ files and md5 sums.
     if samplesheet:
         with file_out.open("w", newline="") as fout:
-            writer = csv.DictWriter(fout, fieldnames=combined_header, delimiter="\t")
-            writer.writeheader()
+            write = row_writer(fout, combined_header, [names[: -len(EXTENSIONS)] for names in header])
             for db_id in sorted(samplesheet):
-                for idx, row in enumerate(samplesheet[db_id], start=1):
-                    row["id"] = f"{db_id}"
-                    if "run_accession" in row:
-                        row["id"] = f"{db_id}_{row['run_accession']}"
-                    writer.writerow(row)
+                index, rows = samplesheet[db_id]
+                for row in rows:
+                    write(db_id, index, row)
+
+
+def spill_sorted(records, max_rows):
+    """
+    Sort the records in chunks of at most `max_rows` records.
+
+    All chunks but the last one are spilled to temporary files.
+
+    Returns:
+        list: An iterator over the sorted records of each chunk.
+
+    """
+    runs = []
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= max_rows:
+            chunk.sort()
+            runs.append(spill(chunk))
+            chunk = []
+    chunk.sort()
+    runs.append(iter(chunk))
+    return runs
+
+
+def spill(chunk):
+    """Write the records to a temporary file and return an iterator reading them back."""
+    tmp = tempfile.TemporaryFile()
+    for record in chunk:
+        pickle.dump(record, tmp, protocol=pickle.HIGHEST_PROTOCOL)
+    tmp.seek(0)
+
+    def records():
+        with tmp:
+            while True:
+                try:
+                    yield pickle.load(tmp)
+                except EOFError:
+                    return
+
+    return records()
+
+
+def sra_runinfo_to_ftp_streaming(files_in, file_out, max_rows):
+    """
+    Merge the run info files like `sra_runinfo_to_ftp` with bounded memory.
+
+    Rows are read incrementally, sorted by experiment accession in chunks of at most
+    `max_rows` rows that are spilled to temporary files and merged while writing the
+    output. For every experiment, only the rows of the first file that contains it
+    are kept, in their original order.
+
+    """
+    def records(index, samples):
+        # Sort rows by experiment, then by file and original position.
+        for seq, (db_id, sample) in enumerate(samples):
+            yield db_id, index, seq, sample
+
+    headers = []
+    sources = []
+    for index, file_in in enumerate(files_in):
+        header, samples = read_sra_runinfo(file_in)
+        headers.append(header)
+        sources.append(records(index, samples))
+    combined_header = combine_headers([header + EXTENSIONS for header in headers])
+
+    with ExitStack() as stack:
+        write = None
+        runs = spill_sorted(chain.from_iterable(sources), max_rows)
+        for db_id, group in groupby(heapq.merge(*runs), key=itemgetter(0)):
+            first_index = None
+            fingerprints = set()
+            duplicates = set()
+            for _, index, _, sample in group:
+                fingerprint = (index, sample)
+                if fingerprint in fingerprints:
+                    log_duplicate_row(sample, headers[index])
+                    continue
+                fingerprints.add(fingerprint)
+                if first_index is None:
+                    first_index = index
+                if index != first_index:
+                    if index not in duplicates:
+                        duplicates.add(index)
+                        logger.warning(f"Duplicate sample identifier found!\nID: '{db_id}'")
+                    continue
+                if write is None:
+                    fout = stack.enter_context(file_out.open("w", newline=""))
+                    write = row_writer(fout, combined_header, headers)
+                write(db_id, index, sample)
 
 
 def main(args=None):
     args = parse_args(args)
-    logging.basicConfig(level=args.log_level, format="[%(levelname)s] %(message)s")
+    logging.basicConfig(level=args.log_level, format=LOG_FORMAT)
+    if args.workers < 1:
+        logger.critical("The number of workers must be at least 1!")
+        sys.exit(1)
     files = [Path(x.strip()) for x in args.files_in.split(",")]
     for path in files:
         if not path.is_file():
             logger.critical(f"The given input file {path} was not found!")
             sys.exit(1)
     args.file_out.parent.mkdir(parents=True, exist_ok=True)
-    sra_runinfo_to_ftp(files, args.file_out)
+    if args.max_rows_in_memory:
+        sra_runinfo_to_ftp_streaming(files, args.file_out, args.max_rows_in_memory)
+    else:
+        sra_runinfo_to_ftp(files, args.file_out, workers=args.workers)
 
 
 if __name__ == "__main__":
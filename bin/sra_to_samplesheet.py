@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+
+import argparse
+import csv
+import logging
+import sys
+from contextlib import ExitStack
+from pathlib import Path
+
+from multiqc_mappings_config import mappings_config
+
+logger = logging.getLogger()
+
+
+def parse_args(args=None):
+    Description = "Create the samplesheet, the sample id mappings and the MultiQC config for all runs from the sample information merged by the pipeline."
+    Epilog = "Example usage: python sra_to_samplesheet.py <FILE_IN> <OUTDIR>"
+
+    parser = argparse.ArgumentParser(description=Description, epilog=Epilog)
+    parser.add_argument(
+        "file_in",
+        metavar="FILE_IN",
+        type=Path,
+        help="Tab-delimited file with the metadata of one run per row, sorted by the 'id' column.",
+    )
+    parser.add_argument(
+        "outdir",
+        metavar="OUTDIR",
+        type=Path,
+        help="Output directory for 'samplesheet.csv', 'id_mappings.csv' and 'multiqc_config.yml'.",
+    )
+    parser.add_argument(
+        "-p",
+        "--pipeline",
+        choices=("rnaseq", "atacseq", "taxprofiler", "viralrecon"),
+        default=None,
+        help="Add the columns required by the samplesheet of this nf-core pipeline.",
+    )
+    parser.add_argument(
+        "-s",
+        "--strandedness",
+        default="auto",
+        help="The value of the 'strandedness' column for nf-core/rnaseq (default auto).",
+    )
+    parser.add_argument(
+        "-f",
+        "--mapping-fields",
+        default="",
+        help="Comma-separated list of metadata fields written to the sample id mappings "
+        "(default no mappings and MultiQC config are created).",
+    )
+    parser.add_argument(
+        "-l",
+        "--log-level",
+        help="The desired log level (default WARNING).",
+        choices=("CRITICAL", "ERROR", "WARNING", "INFO", "DEBUG"),
+        default="WARNING",
+    )
+    return parser.parse_args(args)
+
+
+# Columns needed to download the data that are removed from the samplesheet.
+DOWNLOAD_COLUMNS = [
+    "id",
+    "fastq_1",
+    "fastq_2",
+    "md5_1",
+    "md5_2",
+    "single_end",
+]
+
+
+def get_pipeline_columns(pipeline, strandedness):
+    """Return the columns added after the FastQ files for the given nf-core pipeline."""
+    if pipeline == "rnaseq":
+        return {"strandedness": strandedness}
+    elif pipeline == "atacseq":
+        return {"replicate": "1"}
+    elif pipeline == "taxprofiler":
+        return {"fasta": ""}
+    return {}
+
+
+def quote(values):
+    return ",".join(f'"{value}"' for value in values)
+
+
+def run_to_sample(run, pipeline_columns):
+    """Create the samplesheet entry of a run, keyed by samplesheet column."""
+    sample = {
+        "sample": run["id"].rsplit("_", 1)[0],
+        "fastq_1": run["fastq_1"],
+        "fastq_2": run["fastq_2"],
+    }
+    sample.update(pipeline_columns)
+    sample.update((key, value) for key, value in run.items() if key not in DOWNLOAD_COLUMNS)
+    return sample
+
+
+def sra_to_samplesheet(file_in, outdir, pipeline_columns, mapping_fields):
+    """
+    Write the samplesheet, id mappings and MultiQC config in a single pass over the runs.
+
+    Rows are written in the order of the input file. Only the MultiQC renaming entries
+    are kept in memory since MultiQC expects them sorted.
+
+    """
+    fields = ["sample"] + [field.strip().lower() for field in mapping_fields.split(",")] if mapping_fields else []
+    fields = list(dict.fromkeys(fields))
+    rename = []
+    with ExitStack() as stack:
+        fin = stack.enter_context(open(file_in, newline=""))
+        samplesheet = stack.enter_context((outdir / "samplesheet.csv").open("w"))
+        mappings = stack.enter_context((outdir / "id_mappings.csv").open("w"))
+        # The metadata are joined with tabs by the pipeline without any quoting.
+        reader = csv.DictReader(fin, delimiter="\t", quoting=csv.QUOTE_NONE)
+        for index, run in enumerate(reader):
+            sample = run_to_sample(run, pipeline_columns)
+            if index == 0:
+                if invalid := [field for field in fields if field not in sample]:
+                    logger.critical(
+                        f"Invalid option for '--sample_mapping_fields': {', '.join(invalid)}.\n"
+                        f"Valid options: {', '.join(sample)}"
+                    )
+                    sys.exit(1)
+                samplesheet.write(quote(sample))
+                if fields:
+                    mappings.write(quote(fields))
+            samplesheet.write("\n" + quote(sample.values()))
+            if fields:
+                line = quote(sample[field] for field in fields)
+                mappings.write("\n" + line)
+                rename.append(line)
+
+    if fields:
+        with (outdir / "multiqc_config.yml").open("w") as fout:
+            fout.write(mappings_config(fields, rename))
+
+
+def main(args=None):
+    args = parse_args(args)
+    logging.basicConfig(level=args.log_level, format="[%(levelname)s] %(message)s")
+    if not args.file_in.is_file():
+        logger.critical(f"The given input file {args.file_in} was not found!")
+        sys.exit(1)
+    args.outdir.mkdir(parents=True, exist_ok=True)
+    pipeline_columns = get_pipeline_columns(args.pipeline, args.strandedness)
+    sra_to_samplesheet(args.file_in, args.outdir, pipeline_columns, args.mapping_fields)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
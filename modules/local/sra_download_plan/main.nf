@@ -1,5 +1,5 @@
 
-process MULTIQC_MAPPINGS_CONFIG {
+process SRA_DOWNLOAD_PLAN {
 
     conda "conda-forge::python=3.9.5"
     container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
@@ -7,17 +7,23 @@ process MULTIQC_MAPPINGS_CONFIG {
         'biocontainers/python:3.9--1' }"
 
     input:
-    path csv
+    path tsv
+    val download_method
 
     output:
-    path "*yml"        , emit: yml
-    path "versions.yml", emit: versions
+    path "*.download_plan.tsv", emit: tsv
+    path "versions.yml"       , emit: versions
 
     script:
+    def args = task.ext.args ?: ''
+    def prefix = task.ext.prefix ?: 'sra'
     """
-    multiqc_mappings_config.py \\
-        $csv \\
-        multiqc_config.yml
+    sra_download_plan.py \\
+        ${tsv.join(',')} \\
+        ${prefix}.download_plan.tsv \\
+        --download-method $download_method \\
+        --group-prefix $prefix \\
+        $args
 
     cat <<-END_VERSIONS > versions.yml
     "${task.process}":
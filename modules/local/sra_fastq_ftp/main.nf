@@ -4,10 +4,10 @@ process SRA_FASTQ_FTP {
     label 'process_low'
     label 'error_retry'
 
-    conda "conda-forge::wget=1.20.1"
+    conda "conda-forge::python=3.9.5"
     container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
-        'https://depot.galaxyproject.org/singularity/wget:1.20.1' :
-        'biocontainers/wget:1.20.1' }"
+        'https://depot.galaxyproject.org/singularity/python:3.9--1' :
+        'biocontainers/python:3.9--1' }"
 
     input:
     tuple val(meta), val(fastq)
@@ -19,43 +19,19 @@ process SRA_FASTQ_FTP {
 
     script:
     def args = task.ext.args ?: ''
-    if (meta.single_end) {
-        """
-        wget \\
-            $args \\
-            -O ${meta.id}.fastq.gz \\
-            ${fastq[0]}
-
-        echo "${meta.md5_1}  ${meta.id}.fastq.gz" > ${meta.id}.fastq.gz.md5
-        md5sum -c ${meta.id}.fastq.gz.md5
-
-        cat <<-END_VERSIONS > versions.yml
-        "${task.process}":
-            wget: \$(echo \$(wget --version | head -n 1 | sed 's/^GNU Wget //; s/ .*\$//'))
-        END_VERSIONS
-        """
-    } else {
-        """
-        wget \\
-            $args \\
-            -O ${meta.id}_1.fastq.gz \\
-            ${fastq[0]}
-
-        echo "${meta.md5_1}  ${meta.id}_1.fastq.gz" > ${meta.id}_1.fastq.gz.md5
-        md5sum -c ${meta.id}_1.fastq.gz.md5
-
-        wget \\
-            $args \\
-            -O ${meta.id}_2.fastq.gz \\
-            ${fastq[1]}
-
-        echo "${meta.md5_2}  ${meta.id}_2.fastq.gz" > ${meta.id}_2.fastq.gz.md5
-        md5sum -c ${meta.id}_2.fastq.gz.md5
-
-        cat <<-END_VERSIONS > versions.yml
-        "${task.process}":
-            wget: \$(echo \$(wget --version | head -n 1 | sed 's/^GNU Wget //; s/ .*\$//'))
-        END_VERSIONS
-        """
-    }
+    // The sizes of the FastQ files are used to plan download segments if available
+    def sizes = meta.fastq_bytes ? meta.fastq_bytes.tokenize(';').takeRight(meta.single_end ? 1 : 2) : []
+    def downloads = meta.single_end ?
+        [ "--download ${fastq[0]} ${meta.md5_1} ${meta.id}.fastq.gz ${sizes[0] ?: ''}" ] :
+        [ "--download ${fastq[0]} ${meta.md5_1} ${meta.id}_1.fastq.gz ${sizes[0] ?: ''}", "--download ${fastq[1]} ${meta.md5_2} ${meta.id}_2.fastq.gz ${sizes[1] ?: ''}" ]
+    """
+    sra_fastq_download.py \\
+        ${downloads.join(' \\\n        ')} \\
+        $args
+
+    cat <<-END_VERSIONS > versions.yml
+    "${task.process}":
+        python: \$(python --version | sed 's/Python //g')
+    END_VERSIONS
+    """
 }
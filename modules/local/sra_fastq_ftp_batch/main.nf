@@ -0,0 +1,39 @@
+
+process SRA_FASTQ_FTP_BATCH {
+    tag "$group"
+    label 'process_low'
+    label 'error_retry'
+
+    conda "conda-forge::python=3.9.5"
+    container "${ workflow.containerEngine == 'singularity' && !task.ext.singularity_pull_docker_container ?
+        'https://depot.galaxyproject.org/singularity/python:3.9--1' :
+        'biocontainers/python:3.9--1' }"
+
+    input:
+    tuple val(group), val(metas), val(fastqs)
+
+    output:
+    tuple val(metas), path("*fastq.gz"), emit: fastq
+    tuple val(metas), path("*md5")     , emit: md5
+    path "versions.yml"                , emit: versions
+
+    script:
+    def args = task.ext.args ?: ''
+    // Download the FastQ files of all runs in the group within a single task
+    def downloads = [ metas, fastqs ].transpose().collectMany { meta, fastq ->
+        def sizes = meta.fastq_bytes ? meta.fastq_bytes.tokenize(';').takeRight(meta.single_end ? 1 : 2) : []
+        meta.single_end ?
+            [ "--download ${fastq[0]} ${meta.md5_1} ${meta.id}.fastq.gz ${sizes[0] ?: ''}" ] :
+            [ "--download ${fastq[0]} ${meta.md5_1} ${meta.id}_1.fastq.gz ${sizes[0] ?: ''}", "--download ${fastq[1]} ${meta.md5_2} ${meta.id}_2.fastq.gz ${sizes[1] ?: ''}" ]
+    }
+    """
+    sra_fastq_download.py \\
+        ${downloads.join(' \\\n        ')} \\
+        $args
+
+    cat <<-END_VERSIONS > versions.yml
+    "${task.process}":
+        python: \$(python --version | sed 's/Python //g')
+    END_VERSIONS
+    """
+}
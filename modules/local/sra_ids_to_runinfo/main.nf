@@ -1,6 +1,6 @@
 
 process SRA_IDS_TO_RUNINFO {
-    tag "$id"
+    tag "${[ ids ].flatten()[0]}${ids instanceof List && ids.size() > 1 ? ' (+' + (ids.size() - 1) + ')' : ''}"
     label 'error_retry'
 
     conda "conda-forge::python=3.9.5"
@@ -9,7 +9,7 @@ process SRA_IDS_TO_RUNINFO {
         'biocontainers/python:3.9--1' }"
 
     input:
-    val id
+    val ids
     val fields
 
     output:
@@ -17,13 +17,17 @@ process SRA_IDS_TO_RUNINFO {
     path "versions.yml", emit: versions
 
     script:
+    def args = task.ext.args ?: ''
+    def id_list = [ ids ].flatten()
+    def prefix = task.ext.prefix ?: (id_list.size() > 1 ? "${id_list[0]}_${id_list.size()}_ids" : "${id_list[0]}")
     def metadata_fields = fields ? "--ena_metadata_fields ${fields}" : ''
     """
-    echo $id > id.txt
+    printf '%s\\n' ${id_list.join(' ')} > id.txt
     sra_ids_to_runinfo.py \\
         id.txt \\
-        ${id}.runinfo.tsv \\
-        $metadata_fields
+        ${prefix}.runinfo.tsv \\
+        $metadata_fields \\
+        $args
 
     cat <<-END_VERSIONS > versions.yml
     "${task.process}":
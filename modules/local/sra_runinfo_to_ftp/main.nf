@@ -14,10 +14,12 @@ process SRA_RUNINFO_TO_FTP {
     path "versions.yml", emit: versions
 
     script:
+    def args = task.ext.args ?: ''
     """
     sra_runinfo_to_ftp.py \\
         ${runinfo.join(',')} \\
-        ${runinfo.toString().tokenize(".")[0]}.runinfo_ftp.tsv
+        ${runinfo.toString().tokenize(".")[0]}.runinfo_ftp.tsv \\
+        $args
 
     cat <<-END_VERSIONS > versions.yml
     "${task.process}":
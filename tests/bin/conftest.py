@@ -0,0 +1,367 @@
+"""
+Shared fixtures of the tests of the scripts in `bin/`.
+
+`sra_ids_to_runinfo.py` is tested without network access against `FakeAPI`, a local
+HTTP server that answers the ENA portal API and NCBI E-utilities requests of the script
+from a synthetic catalogue of runs, or by replaying responses recorded from that server.
+All accessions and metadata served are made up; only their structure mimics the real APIs.
+"""
+
+import csv
+import hashlib
+import json
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+BIN_DIR = Path(__file__).resolve().parents[2] / "bin"
+FIXTURES_DIR = Path(__file__).resolve().parent / "fixtures"
+RUNNER = Path(__file__).resolve().parent / "fake_api_runner.py"
+
+sys.path.insert(0, str(BIN_DIR))
+
+# The fields of a run by which it can be found in a file report or search.
+ACCESSION_FIELDS = (
+    "run_accession",
+    "experiment_accession",
+    "sample_accession",
+    "secondary_sample_accession",
+    "study_accession",
+    "secondary_study_accession",
+    "submission_accession",
+)
+RUNINFO_COLUMNS = {
+    "Run": "run_accession",
+    "Experiment": "experiment_accession",
+    "SRAStudy": "secondary_study_accession",
+    "BioProject": "study_accession",
+    "Sample": "secondary_sample_accession",
+    "BioSample": "sample_accession",
+}
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--record-fixtures",
+        action="store_true",
+        default=False,
+        help="Record the replayed responses of the example ids from the fake API again.",
+    )
+
+
+def next_accession(accession, offset):
+    """Return the accession whose number is the given offset after the one of the accession."""
+    prefix, number = re.match(r"^([A-Z]+)([0-9]+)$", accession).groups()
+    return f"{prefix}{int(number) + offset:0{len(number)}d}"
+
+
+def synthetic_run(run, experiment, sample, secondary_sample, study, secondary_study, submission, **fields):
+    """Return the metadata of a made-up paired-end run."""
+    ftp = f"ftp.sra.ebi.ac.uk/vol1/fastq/{run[:6]}/{run}/{run}"
+    row = {
+        "run_accession": run,
+        "experiment_accession": experiment,
+        "sample_accession": sample,
+        "secondary_sample_accession": secondary_sample,
+        "study_accession": study,
+        "secondary_study_accession": secondary_study,
+        "submission_accession": submission,
+        "library_layout": "PAIRED",
+        "library_strategy": "RNA-Seq",
+        "tax_id": "9606",
+        "read_count": "1000",
+        "fastq_ftp": f"{ftp}_1.fastq.gz;{ftp}_2.fastq.gz",
+        "fastq_md5": ";".join(hashlib.md5(f"{run}_{mate}".encode()).hexdigest() for mate in (1, 2)),
+        "fastq_bytes": "100000;100000",
+    }
+    row.update(fields)
+    return row
+
+
+def synthetic_catalogue():
+    """
+    Return the runs of the catalogue and the samples of the GEO series.
+
+    Experiments `ERX0` to `ERX49` have the runs `ERR{2n}` and `ERR{2n+1}` and two
+    experiments each share a sample `SAMN{n//2}`, which is resolved to both. Every
+    example id of `sra_ids_to_runinfo.py` is part of a small study as well.
+
+    """
+    runs = []
+    for n in range(50):
+        for run in (2 * n, 2 * n + 1):
+            runs.append(
+                synthetic_run(
+                    f"ERR{run}",
+                    f"ERX{n}",
+                    f"SAMN{n // 2}",
+                    f"ERS{n // 2}",
+                    "PRJEB1",
+                    "ERP1",
+                    "ERA1",
+                    library_strategy="RNA-Seq" if n % 2 == 0 else "WGS",
+                )
+            )
+    # The example run, experiment, sample and secondary sample and the study of every database.
+    studies = [
+        ("SRR390278", "SRX111814", "SAMN00765663", "SRS282569", "PRJNA63463", "SRP003255", "SRA023522"),
+        ("ERR674736", "ERX629702", "SAMEA3121481", "ERS4399631", "PRJEB7743", "ERP120836", "ERA2421642"),
+        ("DRR171822", "DRX162434", "SAMD00114846", "DRS090921", "PRJDB4176", "DRP004793", "DRA008156"),
+        ("SRR039245", "SRX018721", "SAMN00009210", "SRS009350", "PRJNA118303", "SRP001890", "SRA010453"),
+    ]
+    for run, experiment, sample, secondary_sample, *study in studies:
+        for offset in range(2):
+            for mate in range(2):
+                runs.append(
+                    synthetic_run(
+                        next_accession(run, 2 * offset + mate),
+                        next_accession(experiment, offset),
+                        next_accession(sample, offset),
+                        next_accession(secondary_sample, offset),
+                        *study,
+                    )
+                )
+    # GEO samples of the last study above.
+    geo = {"GSE18729": {"GSM465244": "SRX018721", "GSM465245": "SRX018722"}}
+    return runs, geo
+
+
+class FakeAPIHandler(BaseHTTPRequestHandler):
+    """Define a handler passing every request to the `FakeAPI` of its server."""
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        # Like web servers, send small responses of persistent connections without delay.
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server.api.connected()
+
+    def do_CONNECT(self):
+        self.server.api.tunnel(self.path, self.headers.get("Proxy-Authorization"))
+        self.send_error(502, "Tunnels are not supported")
+
+    def do_GET(self):
+        self._respond(parse_qs(urlsplit(self.path).query))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self._respond(parse_qs(body.decode("utf-8")))
+
+    def _respond(self, params):
+        status, content_type, body = self.server.api.handle(urlsplit(self.path).path, params)
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeAPI:
+    """
+    Define a local server answering requests to the ENA portal API and NCBI E-utilities.
+
+    Attributes:
+        url (str): The base URL of the server.
+        requests (list): The endpoint and the accessions of every request received.
+        connections (int): The number of connections accepted.
+        connect_delay (float): The delay in seconds of accepting a connection, like
+            the TLS handshake with a remote server.
+        tunnels (list): The target and the proxy authorization of every `CONNECT`
+            request received as a proxy, which are refused.
+        withdrawn (set): Accessions whose file reports are empty and that are missing
+            from search results.
+        errors (dict): The number of 503 Service Unavailable responses still to be sent
+            for requests of an accession.
+        delays (dict): The delay in seconds of the responses to requests of an accession.
+
+    """
+
+    def __init__(self):
+        self.runs, self.geo = synthetic_catalogue()
+        self.requests = []
+        self.connections = 0
+        self.connect_delay = 0
+        self.tunnels = []
+        self.withdrawn = set()
+        self.errors = {}
+        self.delays = {}
+        self._lock = threading.Lock()
+        self._history = {}
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), FakeAPIHandler)
+        self._server.daemon_threads = True
+        self._server.api = self
+        self.url = f"http://127.0.0.1:{self._server.server_port}"
+
+    def __enter__(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def connected(self):
+        with self._lock:
+            self.connections += 1
+        time.sleep(self.connect_delay)
+
+    def tunnel(self, target, authorization):
+        with self._lock:
+            self.tunnels.append((target, authorization))
+
+    def count(self, accession):
+        """Return the number of requests of the given accession."""
+        with self._lock:
+            return sum(accession in accessions for _, accessions in self.requests)
+
+    def handle(self, path, params):
+        """Return the status, content type and body of the response to a request."""
+        endpoint = path.rsplit("/", 1)[-1]
+        params = {key: values[0] for key, values in params.items()}
+        if endpoint == "search":
+            accessions = re.findall(r'(?:{})="([^"]+)"'.format("|".join(ACCESSION_FIELDS)), params["query"])
+        else:
+            accessions = [params[key] for key in ("accession", "id") if key in params]
+        with self._lock:
+            self.requests.append((endpoint, accessions))
+            failing = [acc for acc in accessions if self.errors.get(acc, 0) > 0]
+            for accession in failing:
+                self.errors[accession] -= 1
+        time.sleep(max([self.delays.get(accession, 0) for accession in accessions], default=0))
+        if failing:
+            return 503, "text/plain", b"Service Unavailable"
+        if any(accession in self.withdrawn for accession in accessions) and endpoint != "search":
+            return 204, "text/plain", b""
+        if endpoint == "filereport":
+            return self._table(self._find(params["accession"]), params["fields"].split(","))
+        if endpoint == "search":
+            return self._table(self._search(params["query"]), params["fields"].split(","))
+        if endpoint == "returnFields":
+            # The fields of the runs and one that is missing from the shipped snapshot.
+            fields = [{"columnId": field} for field in sorted({*self.runs[0], "checklist"})]
+            return self._table(fields, ["columnId", "description"])
+        if endpoint == "esearch.fcgi":
+            return self._esearch(params)
+        if endpoint == "esummary.fcgi":
+            return self._esummary(params)
+        if endpoint == "efetch.fcgi":
+            runs = self._history[params["WebEnv"]] if "WebEnv" in params else self._find(params["id"])
+            return self._runinfo(runs[int(params.get("retstart", 0)) :][: int(params.get("retmax", len(runs)))])
+        return 404, "text/plain", b"Not Found"
+
+    def _find(self, accession):
+        return [row for row in self.runs if accession in (row[field] for field in ACCESSION_FIELDS)]
+
+    def _search(self, query):
+        """Return the runs matching a query of accessions and conditions joined by AND."""
+        accessions = set()
+        conditions = {}
+        for field, operator, value in re.findall(r'(\w+)\s*(!?=)\s*("[^"]*"|[\w.-]+)', query):
+            value = value.strip('"')
+            if field in ACCESSION_FIELDS and operator == "=":
+                accessions.add(value)
+            else:
+                conditions.setdefault((field, operator), set()).add(value)
+        return [
+            row
+            for row in self.runs
+            if accessions.intersection(row[field] for field in ACCESSION_FIELDS)
+            and row["experiment_accession"] not in self.withdrawn
+            and all(
+                (row.get(field, "") in values) == (operator == "=") for (field, operator), values in conditions.items()
+            )
+        ]
+
+    def _table(self, rows, fields):
+        lines = ["\t".join(fields)] + ["\t".join(row.get(field, "") for field in fields) for row in rows]
+        return 200, "text/plain", ("\n".join(lines) + "\n").encode("utf-8")
+
+    def _runinfo(self, rows):
+        lines = [",".join(RUNINFO_COLUMNS)]
+        lines += [",".join(row[field] for field in RUNINFO_COLUMNS.values()) for row in rows]
+        return 200, "text/plain", ("\n".join(lines) + "\n").encode("utf-8")
+
+    def _esearch(self, params):
+        terms = [term.strip() for term in params["term"].split(" OR ")]
+        if params["db"] == "gds":
+            items = [f"2{term[3:]:0>8}" for term in terms if term in self.geo]
+        else:
+            experiments = {sample: exp for samples in self.geo.values() for sample, exp in samples.items()}
+            items = [row for term in terms if term in experiments for row in self._find(experiments[term])]
+        with self._lock:
+            webenv = f"MCID_{len(self._history)}"
+            self._history[webenv] = items
+        result = {"count": str(len(items)), "webenv": webenv, "querykey": "1"}
+        return 200, "application/json", json.dumps({"esearchresult": result}).encode("utf-8")
+
+    def _esummary(self, params):
+        start = int(params.get("retstart", 0))
+        uids = self._history[params["WebEnv"]][start : start + int(params.get("retmax", 500))]
+        result = {"uids": uids}
+        for uid in uids:
+            series = next(gse for gse in self.geo if f"2{gse[3:]:0>8}" == uid)
+            result[uid] = {"accession": series, "samples": [{"accession": gsm} for gsm in self.geo[series]]}
+        return 200, "application/json", json.dumps({"result": result}).encode("utf-8")
+
+
+@pytest.fixture
+def api():
+    """Start a fake API with the synthetic catalogue for the test."""
+    with FakeAPI() as fake_api:
+        yield fake_api
+
+
+@pytest.fixture
+def run_runinfo(api):
+    """
+    Return a function running `sra_ids_to_runinfo.py` with the given arguments against the fake API.
+
+    The script runs in its own process, which is killed if it does not finish in time,
+    and its exit code is returned.
+
+    """
+
+    def run(args, timeout=60):
+        command = [sys.executable, str(RUNNER), api.url, *map(str, args)]
+        try:
+            result = subprocess.run(command, capture_output=True, text=True, timeout=timeout)
+        except subprocess.TimeoutExpired as error:
+            sys.stderr.write(error.stderr.decode("utf-8") if error.stderr else "")
+            pytest.fail(f"sra_ids_to_runinfo.py did not finish within {timeout} seconds")
+        sys.stderr.write(result.stderr)
+        return result.returncode
+
+    return run
+
+
+def write_ids(path, ids):
+    """Write the database identifiers to a file, one per line, and return its path."""
+    path.write_text("".join(f"{db_id}\n" for db_id in ids))
+    return path
+
+
+def write_table(path, rows):
+    """Write the rows to a tab-delimited file with the columns of all rows and return its path."""
+    with open(path, "w", newline="") as fout:
+        writer = csv.DictWriter(fout, fieldnames=list({col: None for row in rows for col in row}), delimiter="\t")
+        writer.writeheader()
+        writer.writerows(rows)
+    return path
+
+
+def read_table(path):
+    """Return the rows of a tab-delimited file as dictionaries."""
+    with open(path, newline="") as fin:
+        return list(csv.DictReader(fin, delimiter="\t"))
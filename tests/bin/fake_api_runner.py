@@ -0,0 +1,33 @@
+"""
+Run `sra_ids_to_runinfo.py` with its requests sent to the fake API at the given base URL.
+
+Usage: python fake_api_runner.py <API_URL> <ARGS>...
+
+Retries are not delayed and hosts are not rate limited, such that tests run quickly.
+"""
+
+import sys
+from pathlib import Path
+from urllib.parse import urlsplit, urlunsplit
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "bin"))
+
+import sra_ids_to_runinfo  # noqa: E402
+
+
+def main(api_url, args):
+    base = urlsplit(api_url)
+    request = sra_ids_to_runinfo.connection_pool.request
+
+    def route(url, data=None, stream=False):
+        url = urlunsplit(urlsplit(url)._replace(scheme=base.scheme, netloc=base.netloc))
+        return request(url, data=data, stream=stream)
+
+    sra_ids_to_runinfo.connection_pool.request = route
+    sra_ids_to_runinfo.retry_policy.delay = lambda attempt, retry_after=None: 0.0
+    sra_ids_to_runinfo.host_rate_limiter.rates.clear()
+    return sra_ids_to_runinfo.main(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1], sys.argv[2:]))
@@ -0,0 +1,91 @@
+"""
+Benchmarks of the scripts in `bin/`, which are skipped unless pytest-benchmark is installed.
+
+Run them with `pytest tests/bin/test_benchmarks.py --benchmark-only`.
+"""
+
+import csv
+from urllib.request import urlopen
+
+import pytest
+import sra_ids_to_runinfo
+import sra_runinfo_to_ftp
+from conftest import FIXTURES_DIR, synthetic_run, write_ids, write_table
+
+pytest.importorskip("pytest_benchmark")
+
+RUNS = 50000
+
+
+@pytest.fixture(scope="module")
+def runinfo_files(tmp_path_factory):
+    """Write the run info of a large synthetic study split across four files."""
+    path = tmp_path_factory.mktemp("runinfo")
+    files = []
+    for part in range(4):
+        rows = [
+            synthetic_run(f"ERR{run}", f"ERX{run // 2}", f"SAMN{run // 4}", f"ERS{run // 4}", "PRJEB1", "ERP1", "ERA1")
+            for run in range(part * RUNS // 4, (part + 1) * RUNS // 4)
+        ]
+        files.append(path / f"part{part}.runinfo.tsv")
+        with open(files[-1], "w", newline="") as fout:
+            writer = csv.DictWriter(fout, rows[0].keys(), delimiter="\t")
+            writer.writeheader()
+            writer.writerows(rows)
+    return files
+
+
+def test_replay_example_ids(benchmark, tmp_path):
+    module = sra_ids_to_runinfo
+    ids = write_ids(tmp_path / "ids.txt", module.SRA_IDS + module.ENA_IDS + module.DDBJ_IDS + module.GEO_IDS)
+    out = tmp_path / "out.tsv"
+    args = [str(ids), str(out), "--replay", str(FIXTURES_DIR / "example_ids")]
+    benchmark.pedantic(module.main, args=(args,), rounds=5)
+    assert out.read_text() == (FIXTURES_DIR / "example_ids.runinfo.tsv").read_text()
+
+
+@pytest.fixture(scope="module")
+def merged_runinfo(runinfo_files, tmp_path_factory):
+    """Return the output of merging the run info files in memory."""
+    file_out = tmp_path_factory.mktemp("merged") / "out.tsv"
+    sra_runinfo_to_ftp.main([",".join(map(str, runinfo_files)), str(file_out)])
+    return file_out.read_bytes()
+
+
+@pytest.mark.parametrize("max_rows", [None, 5000])
+def test_merge_runinfo_files(benchmark, runinfo_files, merged_runinfo, tmp_path, max_rows):
+    args = [",".join(map(str, runinfo_files)), str(tmp_path / "out.tsv")]
+    if max_rows:
+        args += ["--max-rows-in-memory", str(max_rows)]
+    benchmark.pedantic(sra_runinfo_to_ftp.main, args=(args,), rounds=3)
+    assert (tmp_path / "out.tsv").read_bytes() == merged_runinfo
+    assert merged_runinfo.count(b"\n") == RUNS + 1
+
+
+@pytest.mark.parametrize("pooled", [True, False], ids=["pooled", "urlopen"])
+def test_request_latency(benchmark, api, pooled):
+    # Every new connection costs as much as a handshake with a remote server.
+    api.connect_delay = 0.02
+    url = f"{api.url}/ena/portal/api/filereport?accession=ERX0&result=read_run&fields=run_accession"
+    pool = sra_ids_to_runinfo.ConnectionPool()
+
+    def request():
+        if pooled:
+            return pool.request(url).text()
+        with urlopen(url) as response:
+            return response.read().decode("utf-8")
+
+    assert benchmark.pedantic(request, rounds=20, warmup_rounds=1) == "run_accession\nERR0\nERR1\n"
+
+
+@pytest.mark.parametrize("runs_per_experiment", [10, 1000, 100000])
+def test_parse_runinfo_per_experiment_size(benchmark, tmp_path, runs_per_experiment):
+    # The same number of rows in experiments of different sizes should take as long to parse.
+    benchmark.group = "parse_sra_runinfo"
+    rows = [
+        synthetic_run(f"ERR{run}", f"ERX{run // runs_per_experiment}", "SAMN1", "ERS1", "PRJEB1", "ERP1", "ERA1")
+        for run in range(100000)
+    ]
+    file_in = write_table(tmp_path / "runinfo.tsv", rows)
+    runinfo, _ = benchmark.pedantic(sra_runinfo_to_ftp.parse_sra_runinfo, args=(file_in,), rounds=3)
+    assert sum(map(len, runinfo.values())) == len(rows)
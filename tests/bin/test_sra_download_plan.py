@@ -0,0 +1,67 @@
+"""Tests of `sra_download_plan.py`."""
+
+import pytest
+import sra_download_plan
+from conftest import read_table, write_table
+
+
+@pytest.mark.parametrize(
+    "row,size",
+    [
+        ({"fastq_bytes": "100;200"}, 300),
+        # Only the sizes of the last two files are downloaded, like `fastq_1` and `fastq_2`.
+        ({"fastq_bytes": "50;100;200"}, 300),
+        ({"fastq_bytes": "100", "read_count": "5"}, 100),
+        ({"fastq_bytes": "", "read_count": "5", "single_end": "false"}, 1000),
+        ({"fastq_bytes": "100;unknown", "read_count": "5", "single_end": "true"}, 500),
+        ({"fastq_bytes": "", "read_count": ""}, None),
+        ({}, None),
+    ],
+)
+def test_run_size(row, size):
+    assert sra_download_plan.run_size(row, bytes_per_read=100) == size
+
+
+@pytest.mark.parametrize("size,tier", [(None, "low"), (9, "low"), (10, "medium"), (99, "medium"), (100, "high")])
+def test_run_tier(size, tier):
+    assert sra_download_plan.run_tier(size, [10, 100]) == tier
+
+
+def test_pack_groups_first_fit_decreasing():
+    sizes = {0: 60, 1: 50, 2: 40, 3: 30, 4: 20}
+    assert sra_download_plan.pack_groups(sizes, max_group_size=100, max_group_runs=10) == [[0, 2], [1, 3, 4]]
+
+
+def test_pack_groups_limits_the_number_of_runs():
+    sizes = dict.fromkeys(range(5), 1)
+    assert sra_download_plan.pack_groups(sizes, max_group_size=100, max_group_runs=2) == [[0, 1], [2, 3], [4]]
+
+
+def run(run_id, fastq_bytes, fastq_aspera="", fastq_1="ftp.sra.ebi.ac.uk/run_1.fastq.gz"):
+    """Return the row of a run with the given FastQ file sizes and links."""
+    return {"id": run_id, "fastq_bytes": fastq_bytes, "fastq_aspera": fastq_aspera, "fastq_1": fastq_1}
+
+
+def test_runs_of_all_files_are_planned_once(tmp_path):
+    first = write_table(
+        tmp_path / "first.runinfo_ftp.tsv",
+        [run("SRX1_SRR1", "10;10"), run("SRX2_SRR2", "30;30"), run("SRX3_SRR3", "5000")],
+    )
+    second = write_table(
+        tmp_path / "second.runinfo_ftp.tsv",
+        # The run of SRX2 is in both files and the other small run has no FTP links.
+        [run("SRX2_SRR2", "30;30"), run("SRX4_SRR4", "10", fastq_1=""), {**run("SRX5_SRR5", "20"), "extra": "x"}],
+    )
+    out = tmp_path / "plan.tsv"
+    args = [f"{first},{second}", out, "--small-run-size", 100, "--max-group-size", 1000, "--tier-sizes", "1000,10000"]
+    sra_download_plan.main(list(map(str, args)))
+    rows = read_table(out)
+    assert [row["id"] for row in rows] == ["SRX1_SRR1", "SRX2_SRR2", "SRX3_SRR3", "SRX4_SRR4", "SRX5_SRR5"]
+    assert [(row["download_group"], row["download_group_size"], row["download_tier"]) for row in rows] == [
+        ("first_group1", "3", "low"),
+        ("first_group1", "3", "low"),
+        ("SRX3_SRR3", "1", "medium"),
+        ("SRX4_SRR4", "1", "low"),
+        ("first_group1", "3", "low"),
+    ]
+    assert [row["extra"] for row in rows] == ["", "", "", "", "x"]
@@ -0,0 +1,294 @@
+"""Tests of `sra_fastq_download.py` against a local HTTP server with range requests."""
+
+import errno
+import hashlib
+import itertools
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import sra_fastq_download
+
+SIZE = 10000
+
+
+class FileHandler(BaseHTTPRequestHandler):
+    """Define a handler passing every request to the `FileServer` of its server."""
+
+    def do_GET(self):
+        status, headers, body, drop = self.server.files.handle(self.path.lstrip("/"), self.headers.get("Range"))
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        # A dropped connection ends the body before its announced length.
+        self.wfile.write(body[:drop])
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FileServer:
+    """
+    Define a local server of files that supports single byte-range requests.
+
+    Attributes:
+        url (str): The base URL of the server.
+        files (dict): The content of the files by name.
+        requests (list): The name and the `Range` header of every request received.
+        drops (dict): The number of bytes of the body sent before the connection is
+            closed, once, by file name and first byte of the response.
+        delays (dict): The delay in seconds of responses by file name and first byte.
+        ranges (bool): Whether range requests are supported.
+
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.requests = []
+        self.drops = {}
+        self.delays = {}
+        self.ranges = True
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), FileHandler)
+        self._server.daemon_threads = True
+        self._server.files = self
+        self.url = f"http://127.0.0.1:{self._server.server_port}"
+
+    def __enter__(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def add(self, name, size=SIZE, seed=0):
+        """Serve random content under the name and return its URL and md5 sum."""
+        self.files[name] = random.Random(seed).randbytes(size)
+        return f"{self.url}/{name}", hashlib.md5(self.files[name]).hexdigest()
+
+    def ranges_of(self, name):
+        """Return the `Range` headers of the requests of a file."""
+        return [value for requested, value in self.requests if requested == name]
+
+    def handle(self, name, value):
+        """Return the status, headers, body and the length before a dropped connection of a response."""
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", value or "")
+        start = int(match.group(1)) if match and self.ranges else 0
+        with self._lock:
+            self.requests.append((name, value))
+            drop = self.drops.pop((name, start), None)
+        if name not in self.files:
+            return 404, {}, b"Not Found", None
+        data = self.files[name]
+        time.sleep(self.delays.get((name, start), 0))
+        if match is None or not self.ranges:
+            return 200, {}, data, drop
+        if start >= len(data):
+            return 416, {"Content-Range": f"bytes */{len(data)}"}, b"", None
+        end = min(int(match.group(2) or len(data) - 1), len(data) - 1)
+        return 206, {"Content-Range": f"bytes {start}-{end}/{len(data)}"}, data[start : end + 1], drop
+
+
+@pytest.fixture
+def server():
+    """Start a local file server for the test."""
+    with FileServer() as file_server:
+        yield file_server
+
+
+def download(*downloads, options=()):
+    """Run the script with the given downloads and return its exit code."""
+    args = [arg for values in downloads for arg in ("--download", *map(str, values))]
+    try:
+        sra_fastq_download.main([*args, "--backoff", "0", "--timeout", "10", *map(str, options)])
+    except SystemExit as error:
+        return error.code
+    return 0
+
+
+def test_dropped_connection_is_resumed_with_a_range_request(server, tmp_path):
+    url, md5 = server.add("run.fastq.gz")
+    server.drops[("run.fastq.gz", 0)] = 1000
+    out = tmp_path / "run.fastq.gz"
+    assert download((url, md5, out)) == 0
+    assert out.read_bytes() == server.files["run.fastq.gz"]
+    assert (tmp_path / "run.fastq.gz.md5").read_text() == f"{md5}  run.fastq.gz\n"
+    assert server.ranges_of("run.fastq.gz") == [None, "bytes=1000-"]
+    assert not (tmp_path / "run.fastq.gz.part").exists()
+
+
+def test_existing_partial_file_is_resumed(server, tmp_path):
+    url, md5 = server.add("run.fastq.gz")
+    out = tmp_path / "run.fastq.gz"
+    (tmp_path / "run.fastq.gz.part").write_bytes(server.files["run.fastq.gz"][:2500])
+    assert download((url, md5, out)) == 0
+    assert out.read_bytes() == server.files["run.fastq.gz"]
+    assert server.ranges_of("run.fastq.gz") == ["bytes=2500-"]
+
+
+def test_complete_partial_file_is_not_downloaded_again(server, tmp_path):
+    # The range past the end of a complete partial file is answered with 416.
+    url, md5 = server.add("run.fastq.gz")
+    out = tmp_path / "run.fastq.gz"
+    (tmp_path / "run.fastq.gz.part").write_bytes(server.files["run.fastq.gz"])
+    assert download((url, md5, out)) == 0
+    assert out.read_bytes() == server.files["run.fastq.gz"]
+    assert server.ranges_of("run.fastq.gz") == [f"bytes={SIZE}-"]
+
+
+def test_partial_file_larger_than_the_file_is_restarted(server, tmp_path):
+    url, md5 = server.add("run.fastq.gz")
+    out = tmp_path / "run.fastq.gz"
+    (tmp_path / "run.fastq.gz.part").write_bytes(server.files["run.fastq.gz"] + b"garbage")
+    assert download((url, md5, out)) == 0
+    assert out.read_bytes() == server.files["run.fastq.gz"]
+    assert server.ranges_of("run.fastq.gz") == [f"bytes={SIZE + 7}-", None]
+
+
+def test_partial_file_is_restarted_without_range_support(server, tmp_path):
+    url, md5 = server.add("run.fastq.gz")
+    server.ranges = False
+    out = tmp_path / "run.fastq.gz"
+    (tmp_path / "run.fastq.gz.part").write_bytes(server.files["run.fastq.gz"][:2500])
+    assert download((url, md5, out)) == 0
+    assert out.read_bytes() == server.files["run.fastq.gz"]
+
+
+def test_md5_mismatch_removes_the_file(server, tmp_path):
+    url, _ = server.add("run.fastq.gz")
+    out = tmp_path / "run.fastq.gz"
+    assert download((url, "0" * 32, out)) == 1
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.parametrize("md5", ["", "null"])
+def test_missing_md5_fails_before_downloading(server, tmp_path, md5):
+    url, _ = server.add("run.fastq.gz")
+    assert download((url, md5, tmp_path / "run.fastq.gz")) == 1
+    assert server.requests == []
+
+
+def test_missing_file_is_not_retried(server, tmp_path):
+    url, md5 = server.add("run.fastq.gz")
+    assert download((f"{url}.missing", md5, tmp_path / "run.fastq.gz")) == 1
+    assert server.ranges_of("run.fastq.gz.missing") == [None]
+
+
+def test_segments_written_out_of_order_are_hashed_in_file_order(tmp_path):
+    data = random.Random(1).randbytes(SIZE)
+    part = sra_fastq_download.SegmentedFile(tmp_path / "run.fastq.gz", SIZE, 4)
+    for index in reversed(range(4)):
+        first, last = part.remaining(index)
+        # Write every segment in two chunks.
+        middle = (first + last) // 2
+        part.write(index, data[first:middle])
+        part.write(index, data[middle : last + 1])
+    assert part.hexdigest() == hashlib.md5(data).hexdigest()
+    part.close()
+    assert part.path.read_bytes() == data
+
+
+def test_segments_are_downloaded_concurrently(server, tmp_path):
+    url, md5 = server.add("run.fastq.gz")
+    # The first segment completes last, so the md5 sum is computed from data read back.
+    server.delays[("run.fastq.gz", 0)] = 0.3
+    out = tmp_path / "run.fastq.gz"
+    assert download((url, md5, out, SIZE), options=["--segments", 4, "--min-segment-size", 1000]) == 0
+    assert out.read_bytes() == server.files["run.fastq.gz"]
+    assert sorted(server.ranges_of("run.fastq.gz")) == [
+        "bytes=0-2499",
+        "bytes=2500-4999",
+        "bytes=5000-7499",
+        "bytes=7500-9999",
+    ]
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["run.fastq.gz", "run.fastq.gz.md5"]
+
+
+def test_segments_resume_from_their_saved_progress(server, tmp_path):
+    url, md5 = server.add("run.fastq.gz")
+    server.drops[("run.fastq.gz", 5000)] = 1000
+    out = tmp_path / "run.fastq.gz"
+    options = ["--segments", 4, "--min-segment-size", 1000, "--max-retries", 0]
+    assert download((url, md5, out, SIZE), options=options) == 1
+    assert (tmp_path / "run.fastq.gz.part.json").is_file()
+
+    server.requests.clear()
+    assert download((url, md5, out, SIZE), options=options) == 0
+    assert out.read_bytes() == server.files["run.fastq.gz"]
+    assert server.ranges_of("run.fastq.gz") == ["bytes=6000-7499"]
+    assert not (tmp_path / "run.fastq.gz.part.json").exists()
+
+
+def test_size_of_segmented_downloads_is_requested(server, tmp_path):
+    url, md5 = server.add("run.fastq.gz")
+    out = tmp_path / "run.fastq.gz"
+    assert download((url, md5, out), options=["--segments", 2, "--min-segment-size", 1000]) == 0
+    assert out.read_bytes() == server.files["run.fastq.gz"]
+    assert sorted(server.ranges_of("run.fastq.gz")) == ["bytes=0-0", "bytes=0-4999", "bytes=5000-9999"]
+
+
+def test_segmented_download_falls_back_to_a_single_stream(server, tmp_path):
+    url, md5 = server.add("run.fastq.gz")
+    server.ranges = False
+    out = tmp_path / "run.fastq.gz"
+    assert download((url, md5, out, SIZE), options=["--segments", 4, "--min-segment-size", 1000]) == 0
+    assert out.read_bytes() == server.files["run.fastq.gz"]
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["run.fastq.gz", "run.fastq.gz.md5"]
+
+
+def test_stored_files_are_linked_instead_of_downloaded(server, tmp_path):
+    url, md5 = server.add("run.fastq.gz")
+    store = tmp_path / "store"
+    first = tmp_path / "first" / "run.fastq.gz"
+    assert download((url, md5, first), options=["--store-dir", store]) == 0
+    second = tmp_path / "second" / "run.fastq.gz"
+    assert download((url, md5, second), options=["--store-dir", store]) == 0
+    assert len(server.requests) == 1
+    assert second.stat().st_ino == (store / md5[:2] / md5).stat().st_ino
+    assert (tmp_path / "second" / "run.fastq.gz.md5").read_text() == f"{md5}  run.fastq.gz\n"
+
+
+def test_files_removed_from_the_store_are_downloaded_again(server, tmp_path):
+    url, md5 = server.add("run.fastq.gz")
+    store = tmp_path / "store"
+    assert download((url, md5, tmp_path / "first.fastq.gz"), options=["--store-dir", store]) == 0
+    (store / md5[:2] / md5).unlink()
+    second = tmp_path / "second.fastq.gz"
+    assert download((url, md5, second), options=["--store-dir", store]) == 0
+    assert len(server.requests) == 2
+    assert second.read_bytes() == server.files["run.fastq.gz"]
+
+
+def test_stored_files_are_copied_across_file_systems(monkeypatch, tmp_path):
+    def link(source, target):
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+    monkeypatch.setattr(sra_fastq_download.os, "link", link)
+    source = tmp_path / "source"
+    source.write_bytes(b"content")
+    sra_fastq_download.FastqStore.link(source, tmp_path / "target")
+    assert (tmp_path / "target").read_bytes() == b"content"
+    assert (tmp_path / "target").stat().st_ino != source.stat().st_ino
+
+
+def test_least_recently_used_files_are_evicted(monkeypatch, tmp_path):
+    clock = itertools.count()
+    monkeypatch.setattr(sra_fastq_download.time, "time", lambda: next(clock))
+    store = sra_fastq_download.FastqStore(tmp_path / "store", max_size=2 * SIZE)
+    md5s = []
+    for seed in range(3):
+        path = tmp_path / f"{seed}.fastq.gz"
+        path.write_bytes(random.Random(seed).randbytes(SIZE))
+        md5s.append(hashlib.md5(path.read_bytes()).hexdigest())
+        # The first file is used again before the third one is added.
+        if seed == 2:
+            assert store.fetch(md5s[0], tmp_path / "used.fastq.gz")
+        store.add(md5s[-1], path)
+    assert [store.fetch(md5, tmp_path / "out.fastq.gz") for md5 in md5s] == [True, False, True]
+    assert not (tmp_path / "store" / md5s[1][:2] / md5s[1]).exists()
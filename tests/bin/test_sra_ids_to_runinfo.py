@@ -0,0 +1,314 @@
+"""Tests of `sra_ids_to_runinfo.py` against the fake API and replayed responses."""
+
+import shutil
+import threading
+import time
+from email.message import Message
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlsplit
+
+import pytest
+import sra_ids_to_runinfo
+from conftest import FIXTURES_DIR, read_table, write_ids
+
+FIELDS = "run_accession,experiment_accession,sample_accession,fastq_md5"
+EXAMPLE_FIXTURES = FIXTURES_DIR / "example_ids"
+EXAMPLE_RUNINFO = FIXTURES_DIR / "example_ids.runinfo.tsv"
+
+
+def runs(path):
+    """Return the run accessions of an output file in order."""
+    return [row["run_accession"] for row in read_table(path)]
+
+
+def experiment_runs(*experiments):
+    """Return the runs of the synthetic experiments `ERX{n}` in order."""
+    return [f"ERR{2 * n + mate}" for n in experiments for mate in range(2)]
+
+
+def test_experiments_of_an_identifier_are_fetched_in_batches(api, run_runinfo, tmp_path):
+    api.geo["GSE1"] = {f"GSM{n}": f"ERX{n}" for n in range(50)}
+    ids = write_ids(tmp_path / "ids.txt", ["GSE1"])
+    outputs = {}
+    for batch_size, ena_requests in [(1, 50), (10, 5), (100, 1)]:
+        api.requests.clear()
+        outputs[batch_size] = tmp_path / f"out{batch_size}.tsv"
+        assert run_runinfo([ids, outputs[batch_size], "-ef", FIELDS, "--batch-size", batch_size]) == 0
+        assert sum(endpoint in ("filereport", "search") for endpoint, _ in api.requests) == ena_requests
+    assert runs(outputs[1]) == experiment_runs(*range(50))
+    assert outputs[10].read_bytes() == outputs[100].read_bytes() == outputs[1].read_bytes()
+
+
+def test_pool_reuses_connections(api, run_runinfo, tmp_path):
+    ids = write_ids(tmp_path / "ids.txt", [f"ERX{n}" for n in range(20)])
+    out = tmp_path / "out.tsv"
+    assert run_runinfo([ids, out, "-ef", FIELDS, "-w", 4, "--batch-size", 1]) == 0
+    assert runs(out) == experiment_runs(*range(20))
+    assert len(api.requests) == 20
+    assert api.connections <= 4
+
+
+def test_withdrawn_experiment_releases_its_connection(api, run_runinfo, tmp_path):
+    # The streamed file report of a withdrawn experiment must not keep the only connection.
+    api.withdrawn.add("ERX1")
+    ids = write_ids(tmp_path / "ids.txt", ["ERX1", "ERX2", "ERX3"])
+    out = tmp_path / "out.tsv"
+    args = [ids, out, "-ef", FIELDS, "-w", 1, "--batch-size", 1, "--pool-size", 1, "--journal", tmp_path / "j.jsonl"]
+    assert run_runinfo(args, timeout=20) == 0
+    assert runs(out) == experiment_runs(2, 3)
+    assert "ERX1" in (tmp_path / "out.failures.csv").read_text()
+
+
+@pytest.fixture
+def no_proxies(monkeypatch):
+    """Clear the proxy settings of the environment for the test."""
+    for name in ("http_proxy", "https_proxy", "no_proxy", "HTTP_PROXY", "HTTPS_PROXY", "NO_PROXY"):
+        monkeypatch.delenv(name, raising=False)
+    return monkeypatch
+
+
+def test_http_requests_are_sent_through_the_proxy(api, no_proxies):
+    no_proxies.setenv("http_proxy", api.url)
+    pool = sra_ids_to_runinfo.ConnectionPool()
+    url = "http://www.ebi.ac.uk/ena/portal/api/filereport?accession=ERX0&result=read_run&fields=run_accession"
+    assert pool.request(url).text() == "run_accession\nERR0\nERR1\n"
+    assert api.requests == [("filereport", ["ERX0"])]
+
+
+def test_https_requests_are_tunneled_through_the_proxy(api, no_proxies):
+    no_proxies.setenv("https_proxy", f"http://user:secret@{urlsplit(api.url).netloc}")
+    pool = sra_ids_to_runinfo.ConnectionPool()
+    with pytest.raises(URLError, match="502"):
+        pool.request("https://www.ebi.ac.uk/ena/portal/api/filereport?accession=ERX0")
+    assert api.tunnels == [("www.ebi.ac.uk:443", "Basic dXNlcjpzZWNyZXQ=")]
+
+
+def test_hosts_excluded_from_the_proxy_are_requested_directly(api, no_proxies):
+    # Nothing listens on the proxy port 9.
+    no_proxies.setenv("http_proxy", "http://127.0.0.1:9")
+    no_proxies.setenv("no_proxy", "127.0.0.1")
+    pool = sra_ids_to_runinfo.ConnectionPool()
+    assert pool.request(f"{api.url}/ena/portal/api/filereport?accession=ERX0&fields=run_accession").status == 200
+
+
+def test_transient_errors_are_retried(api, run_runinfo, tmp_path):
+    api.errors.update({"ERX1": 2, "ERR4": 1})
+    ids = write_ids(tmp_path / "ids.txt", ["ERX1", "ERR4"])
+    out = tmp_path / "out.tsv"
+    assert run_runinfo([ids, out, "-ef", FIELDS, "--max-retries", 2]) == 0
+    assert runs(out) == experiment_runs(1, 2)
+    assert api.count("ERX1") == 3
+
+
+def test_retries_are_limited(api, run_runinfo, tmp_path):
+    api.errors["ERX1"] = 3
+    ids = write_ids(tmp_path / "ids.txt", ["ERX1"])
+    assert run_runinfo([ids, tmp_path / "out.tsv", "-ef", FIELDS, "--max-retries", 2]) == 1
+    assert api.count("ERX1") == 3
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Replace the monotonic clock by one that only moves when the test sets it."""
+    now = [0.0]
+    monkeypatch.setattr(sra_ids_to_runinfo.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_throttled_rate_is_halved_once_per_second(clock):
+    limiter = sra_ids_to_runinfo.AdaptiveRateLimiter(8, min_rate=3)
+    # Concurrent rejections count once.
+    limiter.throttle()
+    limiter.throttle()
+    assert limiter.rate == 4
+    clock[0] = 1.0
+    limiter.throttle()
+    assert limiter.rate == 3
+    for _ in range(100):
+        limiter.recover()
+    assert limiter.rate == 8
+
+
+def test_hosts_are_limited_separately():
+    limiters = sra_ids_to_runinfo.HostRateLimiter({"www.ebi.ac.uk": 50})
+    ena = limiters.get("https://www.ebi.ac.uk/ena/portal/api/search")
+    assert ena is limiters.get("https://www.ebi.ac.uk/ena/browser/api/xml/ERX1")
+    assert ena.rate == 50
+    assert limiters.get("https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi") is None
+
+
+def test_default_fields_are_validated_without_a_request(api, run_runinfo, tmp_path):
+    ids = write_ids(tmp_path / "ids.txt", ["ERX0"])
+    assert run_runinfo([ids, tmp_path / "out.tsv", "--filter", "library_strategy=RNA-Seq"]) == 0
+    assert api.requests == [("search", ["ERX0"])]
+
+
+def test_fields_missing_from_the_snapshot_are_fetched_once(api, run_runinfo, tmp_path):
+    assert "checklist" not in sra_ids_to_runinfo.ENA_RETURN_FIELDS
+    ids = write_ids(tmp_path / "ids.txt", ["ERX0"])
+    args = [ids, tmp_path / "out.tsv", "-ef", f"{FIELDS},checklist", "--cache-dir", tmp_path / "cache"]
+    assert run_runinfo(args) == 0
+    assert run_runinfo(args) == 0
+    assert [endpoint for endpoint, _ in api.requests].count("returnFields") == 1
+    assert run_runinfo([ids, tmp_path / "out.tsv", "-ef", f"{FIELDS},unknown", "--cache-dir", tmp_path / "cache"]) == 1
+
+
+def test_previous_rows_do_not_resolve_identifiers(api, run_runinfo, tmp_path):
+    # `SAMN0` matches the rows of ERX0 in the previous output, but resolves to ERX1 as well.
+    previous = tmp_path / "previous.tsv"
+    assert run_runinfo([write_ids(tmp_path / "erx.txt", ["ERX0"]), previous, "-ef", FIELDS]) == 0
+    api.requests.clear()
+    ids = write_ids(tmp_path / "ids.txt", ["SAMN0"])
+    out = tmp_path / "out.tsv"
+    assert run_runinfo([ids, out, "-ef", FIELDS, "--previous", previous]) == 0
+    assert runs(out) == experiment_runs(0, 1)
+    assert api.count("ERX0") == 0
+    assert api.count("ERX1") == 1
+
+
+def test_identifiers_in_the_state_are_not_resolved_again(api, run_runinfo, tmp_path):
+    ids = write_ids(tmp_path / "ids.txt", ["SAMN0"])
+    previous = tmp_path / "previous.tsv"
+    state = tmp_path / "state.json"
+    assert run_runinfo([ids, previous, "-ef", FIELDS, "--state", state]) == 0
+    api.requests.clear()
+    out = tmp_path / "out.tsv"
+    assert run_runinfo([ids, out, "-ef", FIELDS, "--previous", previous, "--state", state]) == 0
+    assert out.read_text() == previous.read_text()
+    assert api.requests == []
+
+
+def test_experiments_are_fetched_once(api, run_runinfo, tmp_path):
+    # All identifiers resolve to experiment ERX1, `SAMN0` to ERX0 as well.
+    ids = write_ids(tmp_path / "ids.txt", ["ERR2", "ERR3", "ERX1", "SAMN0"])
+    out = tmp_path / "out.tsv"
+    assert run_runinfo([ids, out, "-ef", FIELDS, "-w", 4]) == 0
+    assert runs(out) == experiment_runs(1, 0)
+    assert api.count("ERX1") == 1
+
+
+def test_identical_requests_in_flight_are_coalesced():
+    coalescer = sra_ids_to_runinfo.RequestCoalescer()
+    release = threading.Event()
+    sent = []
+
+    def send():
+        sent.append(None)
+        release.wait(5)
+        return "response"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(coalescer.request("key", send))) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    while coalescer.saved < 2 and not release.is_set():
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert results == ["response"] * 3
+    assert len(sent) == 1
+    assert coalescer.saved == 2
+
+
+@pytest.mark.parametrize("workers,resolve_workers", [(1, 3), (2, 2), (1, 1)])
+def test_failing_identifier_stops_the_pipeline(api, run_runinfo, tmp_path, workers, resolve_workers):
+    # The failure surfaces while resolve workers wait for the full fetch stage.
+    api.withdrawn.add("SRR1")
+    api.delays["SRR1"] = 0.3
+    api.delays.update({f"ERX{n}": 0.2 for n in range(10)})
+    ids = write_ids(tmp_path / "ids.txt", ["SRR1"] + [f"ERX{n}" for n in range(10)])
+    args = [ids, tmp_path / "out.tsv", "-ef", FIELDS, "-w", workers, "--resolve-workers", resolve_workers]
+    assert run_runinfo(args, timeout=20) == 1
+
+
+def test_journal_resumes_failed_identifiers(api, run_runinfo, tmp_path):
+    api.withdrawn.add("ERX3")
+    ids = write_ids(tmp_path / "ids.txt", [f"ERX{n}" for n in range(1, 6)])
+    out = tmp_path / "out.tsv"
+    args = [ids, out, "-ef", FIELDS, "-w", 2, "--batch-size", 1, "--journal", tmp_path / "j.jsonl"]
+    assert run_runinfo(args) == 0
+    assert runs(out) == experiment_runs(1, 2, 4, 5)
+    assert "ERX3" in (tmp_path / "out.failures.csv").read_text()
+
+    api.withdrawn.clear()
+    api.requests.clear()
+    assert run_runinfo(args + ["--resume"]) == 0
+    assert runs(out) == experiment_runs(1, 2, 3, 4, 5)
+    assert [accessions for _, accessions in api.requests] == [["ERX3"]]
+
+
+def test_rows_of_a_failed_owner_are_written_for_later_identifiers(api, run_runinfo, tmp_path):
+    # `SAMN1` claims ERX2 and ERX3 but fails on the withdrawn ERX3, `ERR4` resolves to ERX2.
+    api.withdrawn.add("ERX3")
+    api.delays["ERR4"] = 0.3
+    ids = write_ids(tmp_path / "ids.txt", ["SAMN1", "ERR4"])
+    out = tmp_path / "out.tsv"
+    args = [ids, out, "-ef", FIELDS, "-w", 2, "--journal", tmp_path / "j.jsonl"]
+    assert run_runinfo(args) == 0
+    assert runs(out) == experiment_runs(2)
+    assert "SAMN1" in (tmp_path / "out.failures.csv").read_text()
+
+
+def test_filter_drops_previous_rows_without_its_fields(api, run_runinfo, tmp_path):
+    ids = write_ids(tmp_path / "ids.txt", ["ERX0", "ERX1"])
+    previous = tmp_path / "previous.tsv"
+    assert run_runinfo([ids, previous, "-ef", FIELDS]) == 0
+    args = [ids, tmp_path / "out.tsv", "-ef", FIELDS, "--previous", previous, "--filter", "library_strategy=WGS"]
+    assert run_runinfo(args) == 1
+    assert sra_ids_to_runinfo.RunFilter("library_strategy=WGS").matches({"run_accession": "ERR0"}) is False
+
+
+def test_replay_reproduces_recorded_run(api, run_runinfo, tmp_path):
+    ids = write_ids(tmp_path / "ids.txt", ["SAMN0", "ERR10", "ERX7", "DRX162434", "GSE18729", "SRR390278"])
+    recorded = tmp_path / "recorded.tsv"
+    fixtures = tmp_path / "fixtures"
+    assert run_runinfo([ids, recorded, "-ef", FIELDS, "-w", 2, "--record", fixtures]) == 0
+    assert runs(recorded)
+
+    requests = len(api.requests)
+    for options in ([], ["--replay-error-rate", 0.3, "--replay-rate", 100, "--max-retries", 10]):
+        replayed = tmp_path / "replayed.tsv"
+        args = [ids, replayed, "-ef", FIELDS, "-w", 2, "--replay", fixtures, *options]
+        assert run_runinfo(args) == 0
+        assert replayed.read_text() == recorded.read_text()
+    assert len(api.requests) == requests
+
+    assert run_runinfo([ids, tmp_path / "out.tsv", "-ef", FIELDS, "--replay", tmp_path]) == 1
+
+
+@pytest.mark.parametrize("status,recorded", [(503, False), (404, True)])
+def test_retried_errors_are_not_recorded(tmp_path, status, recorded):
+    class FailingTransport:
+        def request(self, url, data=None, stream=False):
+            raise HTTPError(url, status, "Error", Message(), None)
+
+    url = "https://www.ebi.ac.uk/ena/portal/api/filereport?accession=ERX0"
+    recorder = sra_ids_to_runinfo.HTTPRecorder(FailingTransport(), tmp_path, retry_status_codes={503})
+    with pytest.raises(HTTPError):
+        recorder.request(url)
+    assert (tmp_path / recorder.fixture_name(url)).exists() is recorded
+
+
+def test_recorded_fixtures_do_not_contain_the_api_key(run_runinfo, tmp_path):
+    ids = write_ids(tmp_path / "ids.txt", ["DRX162434", "GSE18729"])
+    fixtures = tmp_path / "fixtures"
+    args = [ids, tmp_path / "out.tsv", "-ef", FIELDS, "--api-key", "secret", "--record", fixtures]
+    assert run_runinfo(args) == 0
+    assert not any("secret" in path.read_text() for path in fixtures.iterdir())
+    args = [ids, tmp_path / "replayed.tsv", "-ef", FIELDS, "--api-key", "other", "--replay", fixtures]
+    assert run_runinfo(args) == 0
+
+
+def test_example_ids(request, run_runinfo, tmp_path):
+    module = sra_ids_to_runinfo
+    ids = write_ids(tmp_path / "ids.txt", module.SRA_IDS + module.ENA_IDS + module.DDBJ_IDS + module.GEO_IDS)
+    out = tmp_path / "out.tsv"
+    if request.config.getoption("--record-fixtures"):
+        shutil.rmtree(EXAMPLE_FIXTURES, ignore_errors=True)
+        assert run_runinfo([ids, out, "--record", EXAMPLE_FIXTURES]) == 0
+        shutil.copyfile(out, EXAMPLE_RUNINFO)
+    # The example ids share experiments, so which requests are sent depends on the order of
+    # concurrent identifiers, which is only deterministic with a single worker.
+    assert run_runinfo([ids, out, "--replay", EXAMPLE_FIXTURES]) == 0
+    assert out.read_text() == EXAMPLE_RUNINFO.read_text()
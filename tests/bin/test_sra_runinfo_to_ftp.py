@@ -0,0 +1,114 @@
+"""Tests of `sra_runinfo_to_ftp.py`."""
+
+import logging
+import sys
+import tracemalloc
+
+import pytest
+import sra_runinfo_to_ftp
+from conftest import read_table, synthetic_run, write_table
+
+
+def experiments(first, count, runs=2, **fields):
+    """Return the rows of `count` made-up experiments from `ERX{first}` with `runs` runs each."""
+    return [
+        synthetic_run(f"ERR{n * runs + run}", f"ERX{n}", f"SAMN{n}", f"ERS{n}", "PRJEB1", "ERP1", "ERA1", **fields)
+        for n in range(first, first + count)
+        for run in range(runs)
+    ]
+
+
+@pytest.fixture
+def runinfo_files(tmp_path):
+    """
+    Write run info files with the cases the merge must handle.
+
+    The experiments of a file are unordered and a row is repeated. Experiments are
+    shared between files, which have different columns. Runs are single-end or
+    without FastQ files.
+
+    """
+    first = experiments(0, 10)[::-1]
+    first.append(first[3])
+    single = experiments(5, 10, runs=1, library_layout="SINGLE", extra="value")
+    for row in single:
+        row["fastq_ftp"] = row["fastq_ftp"].split(";")[0]
+        row["fastq_md5"] = row["fastq_md5"].split(";")[0]
+    return [
+        write_table(tmp_path / "first.tsv", first),
+        write_table(tmp_path / "single.tsv", single),
+        write_table(tmp_path / "missing.tsv", experiments(20, 5, fastq_ftp="", fastq_md5="")),
+        write_table(tmp_path / "shared.tsv", experiments(8, 4)),
+    ]
+
+
+def merge(files, file_out, *options):
+    """Run the script on the files and return the content of the output file."""
+    sra_runinfo_to_ftp.main([",".join(map(str, files)), str(file_out), *map(str, options)])
+    return file_out.read_bytes()
+
+
+def test_merge_order_and_duplicates(runinfo_files, tmp_path):
+    merge(runinfo_files, tmp_path / "out.tsv")
+    rows = read_table(tmp_path / "out.tsv")
+    # Experiments are sorted by accession and keep the order of their runs.
+    experiments = sorted(f"ERX{n}" for n in [*range(15), *range(20, 25)])
+    assert [row["id"].split("_")[0] for row in rows] == sorted(row["id"].split("_")[0] for row in rows)
+    assert sorted({row["id"].split("_")[0] for row in rows}) == experiments
+    assert [row["id"] for row in rows[:4]] == ["ERX0_ERR1", "ERX0_ERR0", "ERX1_ERR3", "ERX1_ERR2"]
+    # The runs of an experiment come from the first file that has it, without the repeated row.
+    layouts = {row["id"].split("_")[0]: row["single_end"] for row in rows}
+    assert [layouts[f"ERX{n}"] for n in range(5, 15)] == ["false"] * 5 + ["true"] * 5
+    assert len(rows) == len({row["id"] for row in rows}) == 10 * 2 + 5 * 1 + 5 * 2
+
+
+@pytest.mark.parametrize("max_rows", [1, 3, 7, 1000])
+def test_bounded_memory_merge_matches_the_in_memory_output(runinfo_files, tmp_path, caplog, max_rows):
+    in_memory = merge(runinfo_files, tmp_path / "in_memory.tsv")
+    messages = sorted(caplog.record_tuples)
+    caplog.clear()
+    assert merge(runinfo_files, tmp_path / "streaming.tsv", "--max-rows-in-memory", max_rows) == in_memory
+    assert sorted(caplog.record_tuples) == messages
+    assert [level for _, level, _ in messages].count(logging.ERROR) == 1
+    assert [level for _, level, _ in messages].count(logging.WARNING) == 9
+
+
+@pytest.mark.parametrize("options", [[], ["--max-rows-in-memory", 10]])
+def test_rows_longer_than_the_header_are_rejected(tmp_path, options):
+    file_in = write_table(tmp_path / "runinfo.tsv", experiments(0, 1))
+    with file_in.open("a") as fout:
+        fout.write("\t".join(experiments(1, 1)[0].values()) + "\textra\n")
+    with pytest.raises(ValueError, match="Unexpected number of columns"):
+        merge([file_in], tmp_path / "out.tsv", *options)
+
+
+def test_parallel_parsing_matches_the_serial_output(runinfo_files, tmp_path):
+    serial = merge(runinfo_files, tmp_path / "serial.tsv")
+    assert merge(runinfo_files, tmp_path / "parallel.tsv", "--workers", 3) == serial
+
+
+def test_peak_memory_of_parsing_runs(tmp_path):
+    # Samples used about 2.4 KiB each as dictionaries and about 1.3 KiB as tuples.
+    runs = 20000
+    file_in = write_table(
+        tmp_path / "runinfo.tsv",
+        experiments(0, runs // 10, runs=10, instrument_model="Illumina NovaSeq 6000", study_title="A made-up study"),
+    )
+    tracemalloc.start()
+    try:
+        runinfo, _ = sra_runinfo_to_ftp.parse_sra_runinfo(file_in)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert sum(map(len, runinfo.values())) == runs
+    assert peak / runs < 1700
+
+
+def test_only_shared_values_are_interned(tmp_path):
+    header, samples = sra_runinfo_to_ftp.read_sra_runinfo(write_table(tmp_path / "runinfo.tsv", experiments(0, 1)))
+    _, sample = next(samples)
+    list(samples)
+    values = dict(zip(header, sample))
+    # Interning an equal string returns the interned value if there is one.
+    assert sys.intern("".join(values["study_accession"])) is values["study_accession"]
+    assert sys.intern("".join(values["fastq_md5"])) is not values["fastq_md5"]
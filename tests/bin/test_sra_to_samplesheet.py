@@ -0,0 +1,28 @@
+"""Tests of `sra_to_samplesheet.py` and `multiqc_mappings_config.py`."""
+
+import multiqc_mappings_config
+import sra_to_samplesheet
+from conftest import synthetic_run, write_table
+
+
+def test_multiqc_config_matches_the_id_mappings(tmp_path):
+    rows = [
+        {"id": f"ERX{n}_ERR{n}", **synthetic_run(f"ERR{n}", f"ERX{n}", f"SAMN{n}", f"ERS{n}", "PRJEB1", "ERP1", "ERA1")}
+        for n in (2, 1)
+    ]
+    for row in rows:
+        row.update(fastq_1=f"{row['id']}_1.fastq.gz", fastq_2=f"{row['id']}_2.fastq.gz", single_end="false")
+    file_in = write_table(tmp_path / "sra_metadata.tsv", rows)
+    sra_to_samplesheet.main([str(file_in), str(tmp_path), "--mapping-fields", "run_accession,sample_accession"])
+    config = (tmp_path / "multiqc_config.yml").read_text()
+    assert config == (
+        "sample_names_rename_buttons:\n"
+        "  - sample\n"
+        "  - run_accession\n"
+        "  - sample_accession\n"
+        "sample_names_rename:\n"
+        '  - ["ERX1", "ERR1", "SAMN1"]\n'
+        '  - ["ERX2", "ERR2", "SAMN2"]\n'
+    )
+    multiqc_mappings_config.main([str(tmp_path / "id_mappings.csv"), str(tmp_path / "config.yml")])
+    assert (tmp_path / "config.yml").read_text() == config
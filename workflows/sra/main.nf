@@ -4,8 +4,9 @@
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 */
 
-include { MULTIQC_MAPPINGS_CONFIG } from '../../modules/local/multiqc_mappings_config'
+include { SRA_DOWNLOAD_PLAN       } from '../../modules/local/sra_download_plan'
 include { SRA_FASTQ_FTP           } from '../../modules/local/sra_fastq_ftp'
+include { SRA_FASTQ_FTP_BATCH     } from '../../modules/local/sra_fastq_ftp_batch'
 include { SRA_IDS_TO_RUNINFO      } from '../../modules/local/sra_ids_to_runinfo'
 include { SRA_RUNINFO_TO_FTP      } from '../../modules/local/sra_runinfo_to_ftp'
 include { ASPERA_CLI              } from '../../modules/local/aspera_cli'
@@ -33,12 +34,14 @@ workflow SRA {
 
     main:
     ch_versions = Channel.empty()
+    // Columns added by the download plan that are only needed to download the FastQ files
+    def download_plan_columns = [ 'download_group', 'download_group_size', 'download_tier' ]
 
     //
-    // MODULE: Get SRA run information for public database ids
+    // MODULE: Get SRA run information for public database ids, optionally in chunks of ids per task
     //
     SRA_IDS_TO_RUNINFO (
-        ids,
+        params.ids_chunk_size > 1 ? ids.collate(params.ids_chunk_size) : ids,
         params.ena_metadata_fields ?: ''
     )
     ch_versions = ch_versions.mix(SRA_IDS_TO_RUNINFO.out.versions.first())
@@ -51,9 +54,21 @@ workflow SRA {
     )
     ch_versions = ch_versions.mix(SRA_RUNINFO_TO_FTP.out.versions.first())
 
-    SRA_RUNINFO_TO_FTP
-        .out
-        .tsv
+    //
+    // MODULE: Plan the downloads of all runs at once by grouping small runs and assigning resource tiers
+    //         Runs can be listed in the run information of several ids, so downloads only start once all of it was fetched
+    //
+    ch_runinfo_ftp = SRA_RUNINFO_TO_FTP.out.tsv
+    if (!params.skip_fastq_download) {
+        SRA_DOWNLOAD_PLAN (
+            SRA_RUNINFO_TO_FTP.out.tsv.collect(),
+            params.download_method
+        )
+        ch_versions = ch_versions.mix(SRA_DOWNLOAD_PLAN.out.versions.first())
+        ch_runinfo_ftp = SRA_DOWNLOAD_PLAN.out.tsv
+    }
+
+    ch_runinfo_ftp
         .splitCsv(header:true, sep:'\t')
         .map {
             meta ->
@@ -89,14 +104,49 @@ workflow SRA {
             }
             .set { ch_sra_reads }
 
+        ch_sra_reads
+            .ftp
+            .branch {
+                meta, fastq ->
+                    batch: meta.download_group != meta.id
+                    single: true
+            }
+            .set { ch_sra_reads_ftp }
+
         //
         // MODULE: If FTP link is provided in run information then download FastQ directly via FTP and validate with md5sums
         //
         SRA_FASTQ_FTP (
-            ch_sra_reads.ftp
+            ch_sra_reads_ftp.single
         )
         ch_versions = ch_versions.mix(SRA_FASTQ_FTP.out.versions.first())
 
+        //
+        // MODULE: Download FastQ files of small runs grouped by the download plan within a single task per group
+        //
+        SRA_FASTQ_FTP_BATCH (
+            ch_sra_reads_ftp
+                .batch
+                .map { meta, fastq -> [ groupKey(meta.download_group, meta.download_group_size.toInteger()), meta, fastq ] }
+                .groupTuple()
+        )
+        ch_versions = ch_versions.mix(SRA_FASTQ_FTP_BATCH.out.versions.first())
+
+        // Assign the downloaded FastQ files of a group to their runs
+        SRA_FASTQ_FTP_BATCH
+            .out
+            .fastq
+            .flatMap {
+                metas, fastq ->
+                    def files = fastq instanceof List ? fastq : [ fastq ]
+                    metas.collect {
+                        meta ->
+                            def names = meta.single_end ? [ "${meta.id}.fastq.gz" ] : [ "${meta.id}_1.fastq.gz", "${meta.id}_2.fastq.gz" ]
+                            [ meta, files.findAll { it.name in names*.toString() }.sort { it.name } ]
+                    }
+            }
+            .set { ch_sra_fastq_batch }
+
         //
         // SUBWORKFLOW: Download sequencing reads without FTP links using sra-tools.
         //
@@ -119,12 +169,13 @@ workflow SRA {
         SRA_FASTQ_FTP
             .out
             .fastq
+            .mix(ch_sra_fastq_batch)
             .mix(FASTQ_DOWNLOAD_PREFETCH_FASTERQDUMP_SRATOOLS.out.reads)
             .mix(ASPERA_CLI.out.fastq)
             .map {
                 meta, fastq ->
                     def reads = fastq instanceof List ? fastq.flatten() : [ fastq ]
-                    def meta_clone = meta.clone()
+                    def meta_clone = meta.findAll { key, value -> !(key in download_plan_columns) }
 
                     meta_clone.fastq_1 = reads[0] ? "${params.outdir}/fastq/${reads[0].getName()}" : ''
                     meta_clone.fastq_2 = reads[1] && !meta.single_end ? "${params.outdir}/fastq/${reads[1].getName()}" : ''
@@ -135,45 +186,39 @@ workflow SRA {
     }
 
     //
-    // MODULE: Stage FastQ files downloaded by SRA together and auto-create a samplesheet
+    // Merge the metadata of all runs into a single file sorted by id
+    // The header lists the columns of all run information files once, in order, without the download plan
+    //
+    ch_runinfo_ftp
+        .map { tsv -> tsv.withReader { it.readLine() }.tokenize('\t') }
+        .reduce { columns, other -> (columns + other).unique() }
+        .map { columns -> (columns - download_plan_columns).join('\t') }
+        .set { ch_sra_metadata_header }
+
+    ch_sra_metadata
+        .combine(ch_sra_metadata_header)
+        .map {
+            meta, header ->
+                def values = header.tokenize('\t').collect { column -> meta.containsKey(column) ? meta[column] : '' }
+                header + '\n' + values.join('\t')
+        }
+        .collectFile(name:'sra_metadata.tsv', newLine: true, keepHeader: true, sort: { it.tokenize('\n')[1] })
+        .set { ch_sra_metadata_tsv }
+
+    //
+    // MODULE: Auto-create a samplesheet, sample id mappings and MultiQC config for all runs in a single task
     //
     SRA_TO_SAMPLESHEET (
-        ch_sra_metadata,
+        ch_sra_metadata_tsv,
         params.nf_core_pipeline ?: '',
         params.nf_core_rnaseq_strandedness ?: 'auto',
-        params.sample_mapping_fields
+        params.sample_mapping_fields ?: ''
     )
+    ch_versions = ch_versions.mix(SRA_TO_SAMPLESHEET.out.versions)
 
-    // Merge samplesheets and mapping files across all samples
-    SRA_TO_SAMPLESHEET
-        .out
-        .samplesheet
-        .map { it[1] }
-        .collectFile(name:'tmp_samplesheet.csv', newLine: true, keepHeader: true, sort: { it.baseName })
-        .map { it.text.tokenize('\n').join('\n') }
-        .collectFile(name:'samplesheet.csv', storeDir: "${params.outdir}/samplesheet")
-        .set { ch_samplesheet }
-
-    SRA_TO_SAMPLESHEET
-        .out
-        .mappings
-        .map { it[1] }
-        .collectFile(name:'tmp_id_mappings.csv', newLine: true, keepHeader: true, sort: { it.baseName })
-        .map { it.text.tokenize('\n').join('\n') }
-        .collectFile(name:'id_mappings.csv', storeDir: "${params.outdir}/samplesheet")
-        .set { ch_mappings }
-
-    //
-    // MODULE: Create a MutiQC config file with sample name mappings
-    //
-    ch_sample_mappings_yml = Channel.empty()
-    if (params.sample_mapping_fields) {
-        MULTIQC_MAPPINGS_CONFIG (
-            ch_mappings
-        )
-        ch_versions = ch_versions.mix(MULTIQC_MAPPINGS_CONFIG.out.versions)
-        ch_sample_mappings_yml = MULTIQC_MAPPINGS_CONFIG.out.yml
-    }
+    ch_samplesheet         = SRA_TO_SAMPLESHEET.out.samplesheet
+    ch_mappings            = SRA_TO_SAMPLESHEET.out.mappings
+    ch_sample_mappings_yml = SRA_TO_SAMPLESHEET.out.yml
 
     //
     // Collate and save software versions